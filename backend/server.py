@@ -1,14 +1,31 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+import httpx
 from airtable import Airtable
 import json
 import pusher
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from bisect import bisect_left, bisect_right, insort
+import threading
+import time
+import asyncio
+import sqlite3
+import uuid
+import base64
+import hashlib
+import re
+import heapq
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 
 # Load environment variables
 load_dotenv()
@@ -17,15 +34,128 @@ load_dotenv()
 WASSENGER_API_KEY = os.getenv("WASSENGER_API_KEY")
 WASSENGER_BASE_URL = os.getenv("WASSENGER_BASE_URL", "https://api.wassenger.com/v1")
 
-# Initialize Pusher
+# A configured device ID skips discovery; otherwise the discovered device is cached
+WASSENGER_DEVICE_ID = os.getenv("WASSENGER_DEVICE_ID")
+if WASSENGER_DEVICE_ID == "your_wassenger_device_id_here":
+    WASSENGER_DEVICE_ID = None
+WASSENGER_DEVICE_CACHE_TTL_SECONDS = int(os.getenv("WASSENGER_DEVICE_CACHE_TTL_SECONDS", "3600"))
+device_cache = {"device_id": None, "resolved_at": 0}
+device_cache_lock = threading.Lock()
+
+# Shared Wassenger HTTP client: pooled connections, timeouts and a circuit breaker
+WASSENGER_POOL_SIZE = int(os.getenv("WASSENGER_POOL_SIZE", "20"))
+WASSENGER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("WASSENGER_CONNECT_TIMEOUT_SECONDS", "3"))
+WASSENGER_READ_TIMEOUT_SECONDS = float(os.getenv("WASSENGER_READ_TIMEOUT_SECONDS", "15"))
+WASSENGER_BREAKER_FAILURE_THRESHOLD = int(os.getenv("WASSENGER_BREAKER_FAILURE_THRESHOLD", "5"))
+WASSENGER_BREAKER_RESET_SECONDS = float(os.getenv("WASSENGER_BREAKER_RESET_SECONDS", "30"))
+last_good_conversations = {"conversations": None, "fetched_at": 0}
+
+# Concurrent per-chat message fetching in /api/conversations
+WASSENGER_CHAT_FETCH_CONCURRENCY = int(os.getenv("WASSENGER_CHAT_FETCH_CONCURRENCY", "8"))
+WASSENGER_CHAT_FETCH_TIMEOUT_SECONDS = float(os.getenv("WASSENGER_CHAT_FETCH_TIMEOUT_SECONDS", "5"))
+
+# Local message store fed by the webhook and sent messages; the Wassenger API is only used to backfill it
+MESSAGE_STORE_PATH = os.getenv("MESSAGE_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "messages.db"))
+CONVERSATION_LIST_LIMIT = 50
+CONVERSATION_MESSAGES_PER_THREAD = 10
+FALLBACK_THREAD_LIMIT = 10
+FALLBACK_MESSAGES_PER_THREAD = 10
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
+
+# Conversation search snippets: matched terms are wrapped in these markers
+SEARCH_HIGHLIGHT_START = "**"
+SEARCH_HIGHLIGHT_END = "**"
+SEARCH_SNIPPET_TOKENS = 12
+SEARCH_TOKEN_PATTERN = re.compile(r"\w+")
+
+# Phone numbers without an international prefix are assumed to be local to this country
+DEFAULT_PHONE_COUNTRY_CODE = os.getenv("DEFAULT_PHONE_COUNTRY_CODE", "971")
+CLIENT_PHONE_INDEX_TTL_SECONDS = int(os.getenv("CLIENT_PHONE_INDEX_TTL_SECONDS", "300"))
+CLIENT_PHONE_FIELDS = ["Phone", "Phone Number", "Mobile", "WhatsApp"]
+CLIENT_INDEX_LOAD_WAIT_SECONDS = 120  # background jobs that need a client index wait this long for its first load
+CLIENT_APPOINTMENT_INDEX_TTL_SECONDS = int(os.getenv("CLIENT_APPOINTMENT_INDEX_TTL_SECONDS", "600"))
+CONVERSATION_BOOKING_LIMIT = 5
+
+# Bulk messaging: jobs run one at a time from a background queue, each within these limits
+BULK_SEND_RATE_PER_SECOND = float(os.getenv("BULK_SEND_RATE_PER_SECOND", "2"))
+BULK_SEND_MAX_RATE_PER_SECOND = float(os.getenv("BULK_SEND_MAX_RATE_PER_SECOND", "10"))
+BULK_SEND_CONCURRENCY = int(os.getenv("BULK_SEND_CONCURRENCY", "4"))
+BULK_SEND_MAX_CONCURRENCY = 16
+BULK_SEND_MAX_ATTEMPTS = 3
+BULK_SEND_RETRY_BASE_SECONDS = 2
+BULK_MAX_RECIPIENTS = 5000
+BULK_JOB_HISTORY_SIZE = 50
+BULK_TEMPLATE_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+BULK_TEMPLATE_FIELDS = {"name", "first_name", "phone", "next_appointment_date", "next_appointment_time"}
+bulk_jobs = OrderedDict()
+bulk_send_queue = None
+bulk_send_task = None
+
+# Appointment reminders are sent this many hours before each appointment (off unless enabled)
+APPOINTMENT_REMINDERS_ENABLED = os.getenv("APPOINTMENT_REMINDERS_ENABLED", "false").lower() == "true"
+REMINDER_OFFSETS_HOURS = [float(hours) for hours in os.getenv("REMINDER_OFFSETS_HOURS", "24,2").split(",") if hours.strip()]
+REMINDER_TEMPLATE = os.getenv(
+    "REMINDER_TEMPLATE",
+    "Hi {first_name}, this is a reminder of your {service} appointment on {date} at {time}. See you soon!"
+)
+REMINDER_GRACE_MINUTES = 30  # reminders this late are still sent, older ones are skipped
+REMINDER_MAX_SLEEP_SECONDS = 300
+REMINDER_DEFAULT_TIME = "10:00 AM"
+REMINDER_MAX_ATTEMPTS = 4  # failed sends are rescheduled with backoff while still within the grace period
+REMINDER_RETRY_BASE_SECONDS = 60
+REMINDER_SENT_KEY_PREFIX = "reminder:"
+# Airtable appointment dates and times are wall-clock times at the salon, whatever the server's timezone
+SALON_TIMEZONE = ZoneInfo(os.getenv("SALON_TIMEZONE", "Asia/Dubai"))
+
+# Incremental message sync: only messages newer than the stored high-water mark are fetched
+WASSENGER_SYNC_INTERVAL_SECONDS = int(os.getenv("WASSENGER_SYNC_INTERVAL_SECONDS", "60"))
+WASSENGER_SYNC_PAGE_SIZE = int(os.getenv("WASSENGER_SYNC_PAGE_SIZE", "100"))
+WASSENGER_SYNC_MAX_PAGES = int(os.getenv("WASSENGER_SYNC_MAX_PAGES", "50"))
+MESSAGE_SYNC_STATE_KEY = "messages_high_water_mark"
+MESSAGE_SYNC_RESUME_STATE_KEY = "messages_sync_resume"  # where a sync cut short by the page cap picks up
+message_sync_task = None
+
+# The stored conversation list is refreshed in the background and reported stale after this long
+CONVERSATION_SNAPSHOT_STALE_SECONDS = int(os.getenv("CONVERSATION_SNAPSHOT_STALE_SECONDS", "180"))
+SNAPSHOT_REFRESHED_STATE_KEY = "conversations_refreshed_at"
+conversation_snapshot = {"refreshing": False, "last_error": None, "task": None}
+
+# Initialize Pusher (PUSHER_HOST/PUSHER_PORT/PUSHER_SSL point it at a local stand-in instead of the cluster)
 pusher_client = pusher.Pusher(
     app_id=os.getenv("PUSHER_APP_ID", "2017288"),
     key=os.getenv("PUSHER_APP_KEY", "f1f929da8fd632930b80"),
     secret=os.getenv("PUSHER_SECRET", "6f33f8791db91b6568df"),
     cluster=os.getenv("PUSHER_CLUSTER", "ap2"),
-    ssl=True
+    host=os.getenv("PUSHER_HOST") or None,
+    port=int(os.getenv("PUSHER_PORT")) if os.getenv("PUSHER_PORT") else None,
+    ssl=os.getenv("PUSHER_SSL", "true").lower() == "true"
 )
 
+# Real-time delivery: "pusher" (hosted) or "sse" (built-in /api/events stream only)
+REALTIME_BACKEND = os.getenv("REALTIME_BACKEND", "pusher").lower()
+PUSHER_CHANNEL = os.getenv("PUSHER_CHANNEL", "my-channel")
+SSE_HEARTBEAT_SECONDS = 15
+SSE_SUBSCRIBER_QUEUE_SIZE = 100
+
+# Pusher events are published off the request path by a background dispatcher
+PUSHER_QUEUE_MAX_SIZE = int(os.getenv("PUSHER_QUEUE_MAX_SIZE", "1000"))
+PUSHER_MAX_RETRIES = int(os.getenv("PUSHER_MAX_RETRIES", "5"))
+PUSHER_BATCH_SIZE = 10
+PUSHER_RETRY_BASE_SECONDS = 0.5
+PUSHER_RETRY_MAX_SECONDS = 30
+PUSHER_SHUTDOWN_TIMEOUT_SECONDS = 5
+
+# Webhooks are acked immediately and processed by a pool of background workers
+WEBHOOK_QUEUE_MAX_SIZE = int(os.getenv("WEBHOOK_QUEUE_MAX_SIZE", "5000"))
+WEBHOOK_WORKER_COUNT = int(os.getenv("WEBHOOK_WORKER_COUNT", "4"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_DEDUP_CACHE_SIZE = 10000
+WEBHOOK_THROUGHPUT_WINDOW_SECONDS = 60
+WEBHOOK_PERSIST_MAX_ATTEMPTS = 5
+WEBHOOK_PERSIST_RETRY_BASE_SECONDS = 0.5
+WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS = 10
+
 app = FastAPI(title="Airtable Dashboard API", version="1.0.0")
 
 # CORS middleware
@@ -82,6 +212,14 @@ AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
 AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
 TABLE_NAME = os.getenv("TABLE_NAME", "Table 1")
 
+# Point the Airtable wrapper at another API root (e.g. the local stand-in in stand_ins.py); the wrapper
+# builds each table URL from Airtable.API_URL when the table is created, so this must come first
+if os.getenv("AIRTABLE_API_URL"):
+    Airtable.API_URL = os.getenv("AIRTABLE_API_URL").rstrip("/")
+# Pause between list pages and batch writes; the wrapper's default keeps under Airtable's 5 requests/second
+if os.getenv("AIRTABLE_PAGE_DELAY_SECONDS"):
+    Airtable.API_LIMIT = float(os.getenv("AIRTABLE_PAGE_DELAY_SECONDS"))
+
 # Initialize Airtable connections
 airtable = None
 airtable_clients = None
@@ -103,6 +241,35 @@ client_name_cache = {}
 service_name_cache = {}
 employee_name_cache = {}
 
+# Analytics cache: results are tied to a data version that writes and upstream changes bump
+ANALYTICS_SYNC_INTERVAL_SECONDS = int(os.getenv("ANALYTICS_SYNC_INTERVAL_SECONDS", "300"))
+analytics_data_version = 0
+analytics_dataset = None  # Appointments index, services and employees as of the last sync
+analytics_cache = {}  # (start_date, end_date) -> {"version": ..., "data": ...}
+analytics_lock = threading.Lock()
+analytics_sync_lock = threading.Lock()  # held for a whole sync, so concurrent callers wait for one sync instead of starting their own
+
+# Background precompute of the named ranges, woken early whenever the data version is bumped
+ANALYTICS_PRECOMPUTE_INTERVAL_SECONDS = int(os.getenv("ANALYTICS_PRECOMPUTE_INTERVAL_SECONDS", "300"))
+precomputed_analytics = {}  # range name -> cache entry
+analytics_scheduler_loop = None
+analytics_refresh_event = None
+analytics_scheduler_task = None
+
+def bump_data_version(reason: str) -> int:
+    """Invalidate cached analytics after a write to appointments or employees; returns the new version"""
+    global analytics_data_version
+    with analytics_lock:
+        analytics_data_version += 1
+        version = analytics_data_version
+        analytics_cache.clear()
+    print(f"Analytics data version bumped to {analytics_data_version} ({reason})")
+    
+    # Ask the scheduler to recompute; this may be called from a worker thread
+    if analytics_scheduler_loop and analytics_refresh_event:
+        analytics_scheduler_loop.call_soon_threadsafe(analytics_refresh_event.set)
+    return version
+
 # Pydantic models
 class Record(BaseModel):
     id: Optional[str] = None
@@ -160,6 +327,22 @@ class SendMessageRequest(BaseModel):
     phone: str
     message: str
 
+class BulkRecipient(BaseModel):
+    phone: str
+    name: Optional[str] = None
+
+class BulkClientFilter(BaseModel):
+    client_ids: Optional[List[str]] = None
+    tag: Optional[str] = None
+    upcoming_appointment: Optional[bool] = None
+
+class BulkMessageRequest(BaseModel):
+    template: str  # may use {name}, {first_name}, {phone}, {next_appointment_date}, {next_appointment_time}
+    recipients: Optional[List[BulkRecipient]] = None
+    client_filter: Optional[BulkClientFilter] = None
+    rate_per_second: Optional[float] = None
+    concurrency: Optional[int] = None
+
 class ConversationMessage(BaseModel):
     id: str
     sender: str  # 'client' or 'ai'
@@ -190,7 +373,9 @@ async def health_check():
         "airtable": airtable_status,
         "api_key_configured": bool(AIRTABLE_API_KEY),
         "base_id_configured": bool(AIRTABLE_BASE_ID),
-        "table_name": TABLE_NAME
+        "table_name": TABLE_NAME,
+        "realtime_backend": REALTIME_BACKEND,
+        "wassenger_circuit": wassenger_client.breaker.status()
     }
 
 # Cache for client names to avoid repeated API calls
@@ -230,23 +415,6 @@ def get_service_name(service_id):
         print(f"Error fetching service {service_id}: {e}")
         return None
 
-def get_service_name(service_id: str) -> str:
-    """Fetch real service name from Services table using service ID"""
-    try:
-        if service_id in service_name_cache:
-            return service_name_cache[service_id]
-        
-        if airtable_services:
-            service_record = airtable_services.get(service_id)
-            if service_record and 'fields' in service_record:
-                service_name = service_record['fields'].get('Service Name') or service_record['fields'].get('Name', 'Unknown Service')
-                service_name_cache[service_id] = service_name
-                return service_name
-    except Exception as e:
-        print(f"Error fetching service name for {service_id}: {e}")
-    
-    return f"Service {service_id[-4:]}"
-
 def get_employee_name(employee_id: str) -> str:
     """Fetch real employee name from Employees table"""
     if not airtable_employees or not employee_id:
@@ -375,6 +543,10 @@ async def create_record(record: RecordCreate):
         airtable_fields = {k: v for k, v in airtable_fields.items() if v is not None}
         
         created_record = airtable.insert(airtable_fields)
+        client_visit_index.upsert(created_record)
+        client_appointment_index.upsert(created_record)
+        reminder_scheduler.upsert(created_record)
+        bump_data_version("record created")
         return map_airtable_record(created_record)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating record: {str(e)}")
@@ -410,6 +582,10 @@ async def update_record(record_id: str, record: RecordUpdate):
             airtable_fields["Notes"] = record.notes
         
         updated_record = airtable.update(record_id, airtable_fields)
+        client_visit_index.upsert(updated_record)
+        client_appointment_index.upsert(updated_record)
+        reminder_scheduler.upsert(updated_record)
+        bump_data_version("record updated")
         return map_airtable_record(updated_record)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating record: {str(e)}")
@@ -422,6 +598,10 @@ async def delete_record(record_id: str):
     
     try:
         airtable.delete(record_id)
+        client_visit_index.remove(record_id)
+        client_appointment_index.remove(record_id)
+        reminder_scheduler.remove(record_id)
+        bump_data_version("record deleted")
         return {"message": "Record deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting record: {str(e)}")
@@ -518,6 +698,10 @@ async def create_appointment(appointment_data: dict):
         }
         
         created_record = airtable.insert(airtable_fields)
+        client_visit_index.upsert(created_record)
+        client_appointment_index.upsert(created_record)
+        reminder_scheduler.upsert(created_record)
+        bump_data_version("appointment created")
         return {
             "success": True,
             "appointment_id": new_appointment_id,
@@ -538,6 +722,10 @@ async def update_appointment(appointment_id: str, update_data: dict):
         if action == 'cancel':
             # Delete the appointment completely from Airtable
             airtable.delete(appointment_id)
+            client_visit_index.remove(appointment_id)
+            client_appointment_index.remove(appointment_id)
+            reminder_scheduler.remove(appointment_id)
+            bump_data_version("appointment cancelled")
             return {
                 "success": True,
                 "action": "deleted",
@@ -563,6 +751,10 @@ async def update_appointment(appointment_id: str, update_data: dict):
                 airtable_fields["Stylist"] = [update_data["employee_id"]]
         
             updated_record = airtable.update(appointment_id, airtable_fields)
+            client_visit_index.upsert(updated_record)
+            client_appointment_index.upsert(updated_record)
+            reminder_scheduler.upsert(updated_record)
+            bump_data_version("appointment updated")
             return {
                 "success": True,
                 "action": "updated",
@@ -579,6 +771,10 @@ async def delete_appointment(appointment_id: str):
     
     try:
         airtable.delete(appointment_id)
+        client_visit_index.remove(appointment_id)
+        client_appointment_index.remove(appointment_id)
+        reminder_scheduler.remove(appointment_id)
+        bump_data_version("appointment deleted")
         return {
             "success": True,
             "message": "Appointment deleted successfully"
@@ -622,6 +818,7 @@ async def create_employee(employee_data: dict):
         airtable_fields = {k: v for k, v in airtable_fields.items() if v is not None and v != ""}
         
         created_employee = airtable_employees.insert(airtable_fields)
+        bump_data_version("employee created")
         return {
             "success": True,
             "employee_id": created_employee['id'],
@@ -753,6 +950,7 @@ async def update_employee(employee_id: str, employee_data: dict):
             }
         
         updated_employee = airtable_employees.update(employee_id, airtable_fields)
+        bump_data_version("employee updated")
         return {
             "success": True,
             "employee_id": updated_employee['id'],
@@ -778,6 +976,7 @@ async def delete_employee(employee_id: str):
     
     try:
         airtable_employees.delete(employee_id)
+        bump_data_version("employee deleted")
         return {
             "success": True,
             "message": "Employee deleted successfully"
@@ -868,428 +1067,2377 @@ async def get_employee_availability():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching employee availability: {str(e)}")
 
-@app.get("/api/conversations")
-async def get_conversations():
-    """Get all conversations from Wassenger"""
-    try:
-        if not WASSENGER_API_KEY:
-            raise HTTPException(status_code=500, detail="Wassenger API key not configured")
+NORMALIZED_TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z")
+
+def normalize_timestamp(value) -> str:
+    """Normalize ISO strings and epoch seconds/milliseconds to sortable ISO 8601 UTC ('...T03:30:00.000Z')
+
+    Missing values mean "now"; unparseable ones become '' so they sort before every real timestamp.
+    """
+    if isinstance(value, str) and NORMALIZED_TIMESTAMP_PATTERN.fullmatch(value):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = value / 1000 if value > 1e11 else value
+        parsed = datetime.fromtimestamp(seconds, tz=timezone.utc)
+    elif isinstance(value, str) and value:
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return ""
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+    else:
+        parsed = datetime.now(timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{parsed.microsecond // 1000:03d}Z"
+
+def contact_thread_id(contact: str) -> str:
+    """Turn a phone number ('+971...', '971...') or WhatsApp ID into the chat ID used for threads ('971...@c.us')"""
+    if "@" in contact:
+        return contact
+    digits = "".join(ch for ch in contact if ch.isdigit())
+    return f"{digits}@c.us" if digits else contact
+
+def normalize_phone(raw) -> Optional[str]:
+    """Normalize a phone number or WhatsApp ID to E.164 ('+971501234567'), or None if it has no digits
+    
+    '00' and '+' prefixes are international; a single leading 0 or a short number is local to
+    DEFAULT_PHONE_COUNTRY_CODE; anything else is assumed to already start with its country code.
+    """
+    if not raw or not isinstance(raw, str):
+        return None
+    raw = raw.split("@")[0].strip()
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if not digits:
+        return None
+    if raw.startswith("+"):
+        return "+" + digits
+    if digits.startswith("00"):
+        return "+" + digits[2:]
+    if digits.startswith("0"):
+        return "+" + DEFAULT_PHONE_COUNTRY_CODE + digits[1:]
+    if len(digits) <= 9:
+        return "+" + DEFAULT_PHONE_COUNTRY_CODE + digits
+    return "+" + digits
+
+def display_phone(thread_id: str) -> str:
+    """Phone number shown for a thread: E.164 for contacts, the bare group ID for groups"""
+    if "@g.us" in thread_id:
+        return thread_id.replace("@g.us", "")
+    # WhatsApp contact IDs always carry the country code
+    digits = "".join(ch for ch in thread_id.split("@")[0] if ch.isdigit())
+    return "+" + digits if digits else thread_id
+
+class MessageStore:
+    """SQLite store of WhatsApp threads and messages, indexed by contact and timestamp"""
+    
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            has_search_index = self.db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+            ).fetchone() is not None
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS threads (
+                    id TEXT PRIMARY KEY,
+                    client TEXT,
+                    phone TEXT,
+                    tag TEXT NOT NULL DEFAULT 'Regular',
+                    last_message TEXT NOT NULL DEFAULT '',
+                    last_message_at TEXT NOT NULL DEFAULT '',
+                    last_from_me INTEGER NOT NULL DEFAULT 0,
+                    unread INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_threads_last_message_at ON threads (last_message_at);
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    thread_id TEXT NOT NULL,
+                    phone TEXT,
+                    from_me INTEGER NOT NULL,
+                    body TEXT NOT NULL DEFAULT '',
+                    created_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_messages_thread_created ON messages (thread_id, created_at);
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+                    body, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, body) VALUES (new.rowid, new.body);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, body) VALUES ('delete', old.rowid, old.body);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF body ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, body) VALUES ('delete', old.rowid, old.body);
+                    INSERT INTO messages_fts (rowid, body) VALUES (new.rowid, new.body);
+                END;
+            """)
+            if not has_search_index:
+                # Index messages stored before full-text search existed
+                self.db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            thread_columns = {row["name"] for row in self.db.execute("PRAGMA table_info(threads)")}
+            if "read_at" not in thread_columns:
+                # Incoming messages newer than read_at count as unread
+                self.db.execute("ALTER TABLE threads ADD COLUMN read_at TEXT NOT NULL DEFAULT ''")
+            
+            # Inbox totals are kept in memory and adjusted on every unread change, so badge reads are O(1)
+            self._load_unread_totals()
+    
+    def _load_unread_totals(self):
+        totals = self.db.execute("SELECT COALESCE(SUM(unread), 0), COUNT(*) FROM threads WHERE unread > 0").fetchone()
+        self.unread_total = totals[0]
+        self.unread_threads = totals[1]
+    
+    @contextmanager
+    def _unread_transaction(self):
+        """Lock and open a transaction that may change unread counts; a rollback reloads the inbox totals"""
+        with self.lock:
+            try:
+                with self.db:
+                    yield
+            except BaseException:
+                # The totals were adjusted as rows changed, so they must follow the rolled-back rows
+                self._load_unread_totals()
+                raise
+    
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM threads LIMIT 1").fetchone() is None
+    
+    def _ensure_thread(self, thread_id, client=None, phone=None, tag=None):
+        self.db.execute(
+            "INSERT OR IGNORE INTO threads (id, client, phone, tag) VALUES (?, ?, ?, ?)",
+            (thread_id, client, phone or display_phone(thread_id), tag or ("Group" if "@g.us" in thread_id else "Regular"))
+        )
+        if client:
+            self.db.execute("UPDATE threads SET client = ? WHERE id = ?", (client, thread_id))
+    
+    def _set_unread(self, thread_id, unread: int, read_at=None):
+        """Set a thread's unread count (and optionally its read marker), keeping the inbox totals in step"""
+        row = self.db.execute("SELECT unread FROM threads WHERE id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return
+        if read_at is None:
+            self.db.execute("UPDATE threads SET unread = ? WHERE id = ?", (unread, thread_id))
+        else:
+            self.db.execute("UPDATE threads SET unread = ?, read_at = ? WHERE id = ?", (unread, read_at, thread_id))
+        self.unread_total += unread - row["unread"]
+        self.unread_threads += (unread > 0) - (row["unread"] > 0)
+    
+    def _insert_message(self, message, count_unread: bool = True) -> bool:
+        """Insert one message and advance its thread's preview and unread state; returns False for an already stored ID"""
+        inserted = self.db.execute(
+            "INSERT OR IGNORE INTO messages (id, thread_id, phone, from_me, body, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (message["id"], message["thread_id"], message.get("phone"), 1 if message["from_me"] else 0,
+             message.get("body") or "", message["created_at"])
+        ).rowcount == 1
+        if inserted:
+            is_latest = self.db.execute(
+                """UPDATE threads SET last_message = ?, last_message_at = ?, last_from_me = ?
+                   WHERE id = ? AND last_message_at <= ?""",
+                (message.get("body") or "", message["created_at"], 1 if message["from_me"] else 0,
+                 message["thread_id"], message["created_at"])
+            ).rowcount == 1
+            
+            if message["from_me"] and is_latest:
+                # Replying from the business number means the thread has been seen
+                self._set_unread(message["thread_id"], 0, read_at=message["created_at"])
+            elif not message["from_me"] and count_unread:
+                thread = self.db.execute("SELECT unread, read_at FROM threads WHERE id = ?", (message["thread_id"],)).fetchone()
+                if message["created_at"] > thread["read_at"]:
+                    self._set_unread(message["thread_id"], thread["unread"] + 1)
+        return inserted
+    
+    def add_message(self, message, client=None) -> bool:
+        """Persist a message (id, thread_id, phone, from_me, body, created_at), creating its thread if needed"""
+        with self._unread_transaction():
+            self._ensure_thread(message["thread_id"], client=client, phone=message.get("phone"))
+            return self._insert_message(message)
+    
+    def add_messages(self, messages, count_unread: bool = True) -> int:
+        """Persist a batch of messages in one transaction, returning how many were new
         
-        # First, get the device ID (we'll need to get this from Wassenger)
-        devices_response = requests.get(
-            f"{WASSENGER_BASE_URL}/devices",
-            headers={
-                "Content-Type": "application/json",
-                "Token": WASSENGER_API_KEY
+        With count_unread=False incoming messages are treated as history and leave unread counts alone.
+        """
+        inserted = 0
+        with self._unread_transaction():
+            for message in messages:
+                self._ensure_thread(message["thread_id"], phone=message.get("phone"))
+                if self._insert_message(message, count_unread):
+                    inserted += 1
+        return inserted
+    
+    def mark_read(self, thread_id: str) -> bool:
+        """Clear a thread's unread count up to its latest message; returns False for an unknown thread"""
+        with self._unread_transaction():
+            thread = self.db.execute("SELECT last_message_at FROM threads WHERE id = ?", (thread_id,)).fetchone()
+            if thread is None:
+                return False
+            self._set_unread(thread_id, 0, read_at=thread["last_message_at"])
+            return True
+    
+    def unread_counts(self):
+        """Inbox badge totals, maintained incrementally"""
+        with self.lock:
+            return {"unread_total": self.unread_total, "unread_threads": self.unread_threads}
+    
+    def thread_state(self, thread_id: str):
+        """Unread count and reply status of one thread, for real-time events"""
+        with self.lock:
+            thread = self.db.execute("SELECT unread, last_from_me FROM threads WHERE id = ?", (thread_id,)).fetchone()
+        if thread is None:
+            return {"unread": 0, "status": "pending"}
+        return {"unread": thread["unread"], "status": "replied" if thread["last_from_me"] else "pending"}
+    
+    def add_new_messages(self, entries) -> list:
+        """Persist (message, client) pairs in one transaction, returning the pairs whose message ID was new"""
+        new_entries = []
+        with self._unread_transaction():
+            for message, client in entries:
+                self._ensure_thread(message["thread_id"], client=client, phone=message.get("phone"))
+                if self._insert_message(message):
+                    new_entries.append((message, client))
+        return new_entries
+    
+    def get_state(self, key: str):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+            return row["value"] if row else None
+    
+    def set_state(self, key: str, value: str):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+    
+    def delete_state_before(self, key_prefix: str, value_before: str) -> int:
+        """Delete state rows under a key prefix whose value sorts before `value_before` (e.g. an ISO timestamp)"""
+        with self.lock, self.db:
+            return self.db.execute(
+                "DELETE FROM sync_state WHERE substr(key, 1, ?) = ? AND value < ?",
+                (len(key_prefix), key_prefix, value_before)
+            ).rowcount
+    
+    def import_conversations(self, conversations):
+        """Persist conversations in the /api/conversations shape, as returned by the upstream backfill"""
+        with self._unread_transaction():
+            for conversation in conversations:
+                thread_id = conversation.get("id") or contact_thread_id(conversation.get("phone", ""))
+                if not thread_id:
+                    continue
+                self._ensure_thread(thread_id, client=conversation.get("client"), phone=conversation.get("phone"), tag=conversation.get("tag"))
+                for msg in conversation.get("messages", []):
+                    if not msg.get("id"):
+                        continue
+                    self._insert_message({
+                        "id": msg["id"],
+                        "thread_id": thread_id,
+                        "phone": msg.get("phone"),
+                        "from_me": msg.get("sender") == "ai",
+                        "body": msg.get("text", ""),
+                        "created_at": normalize_timestamp(msg.get("time"))
+                    }, count_unread=False)
+                
+                # Wassenger's own preview and unread count are authoritative for backfilled threads
+                last_message_at = normalize_timestamp(conversation.get("time"))
+                updated = self.db.execute(
+                    """UPDATE threads SET last_message = ?, last_message_at = ?, last_from_me = ?
+                       WHERE id = ? AND last_message_at <= ?""",
+                    (conversation.get("lastMessage") or "", last_message_at,
+                     1 if conversation.get("status") == "replied" else 0, thread_id, last_message_at)
+                ).rowcount == 1
+                if updated:
+                    unread = conversation.get("unread", 0) or 0
+                    self._set_unread(thread_id, unread, read_at=last_message_at if unread == 0 else "")
+    
+    def _message(self, row):
+        return {
+            "id": row["id"],
+            "sender": "ai" if row["from_me"] else "client",
+            "text": row["body"],
+            "time": row["created_at"],
+            "phone": row["phone"] or display_phone(row["thread_id"])
+        }
+    
+    def _thread_messages(self, thread_id, limit):
+        rows = self.db.execute(
+            "SELECT * FROM messages WHERE thread_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (thread_id, limit)
+        ).fetchall()
+        return [self._message(row) for row in reversed(rows)]
+    
+    def _thread_summary(self, thread):
+        return {
+            "id": thread["id"],
+            "client": thread["client"] or f"Contact {thread['phone']}",
+            "phone": thread["phone"],
+            "lastMessage": thread["last_message"],
+            "time": thread["last_message_at"],
+            "status": "replied" if thread["last_from_me"] else "pending",
+            "unread": thread["unread"],
+            "tag": thread["tag"]
+        }
+    
+    def list_conversations(self, limit: int, messages_per_thread: int = 10):
+        """Most recently active threads in the /api/conversations shape, each with its latest messages"""
+        with self.lock:
+            threads = self.db.execute(
+                "SELECT * FROM threads ORDER BY last_message_at DESC, id DESC LIMIT ?", (limit,)
+            ).fetchall()
+            return [{
+                **self._thread_summary(thread),
+                "messages": self._thread_messages(thread["id"], messages_per_thread)
+            } for thread in threads]
+    
+    def list_thread_page(self, limit: int, after=None):
+        """One page of thread summaries, newest activity first, after the (last_message_at, id) keyset position"""
+        with self.lock:
+            if after:
+                threads = self.db.execute(
+                    """SELECT * FROM threads
+                       WHERE last_message_at < ? OR (last_message_at = ? AND id < ?)
+                       ORDER BY last_message_at DESC, id DESC LIMIT ?""",
+                    (after[0], after[0], after[1], limit + 1)
+                ).fetchall()
+            else:
+                threads = self.db.execute(
+                    "SELECT * FROM threads ORDER BY last_message_at DESC, id DESC LIMIT ?", (limit + 1,)
+                ).fetchall()
+        
+        page = threads[:limit]
+        next_key = (page[-1]["last_message_at"], page[-1]["id"]) if len(threads) > limit else None
+        return [self._thread_summary(thread) for thread in page], next_key
+    
+    def list_message_page(self, thread_id: str, limit: int, before=None):
+        """Up to `limit` messages older than the (created_at, id) keyset position, in chronological order"""
+        with self.lock:
+            if before:
+                rows = self.db.execute(
+                    """SELECT * FROM messages
+                       WHERE thread_id = ? AND (created_at < ? OR (created_at = ? AND id < ?))
+                       ORDER BY created_at DESC, id DESC LIMIT ?""",
+                    (thread_id, before[0], before[0], before[1], limit + 1)
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    "SELECT * FROM messages WHERE thread_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (thread_id, limit + 1)
+                ).fetchall()
+        
+        page = rows[:limit]
+        next_key = (page[-1]["created_at"], page[-1]["id"]) if len(rows) > limit else None
+        return [self._message(row) for row in reversed(page)], next_key
+    
+    def search_messages(self, match_query: str, limit: int):
+        """Best bm25 matches for an FTS5 query, with a highlighted snippet and the thread each belongs to"""
+        with self.lock:
+            rows = self.db.execute(
+                f"""SELECT m.*, t.client AS client,
+                           snippet(messages_fts, 0, '{SEARCH_HIGHLIGHT_START}', '{SEARCH_HIGHLIGHT_END}', '…', {SEARCH_SNIPPET_TOKENS}) AS snippet,
+                           bm25(messages_fts) AS score
+                    FROM messages_fts
+                    JOIN messages m ON m.rowid = messages_fts.rowid
+                    LEFT JOIN threads t ON t.id = m.thread_id
+                    WHERE messages_fts MATCH ?
+                    ORDER BY score LIMIT ?""",
+                (match_query, limit)
+            ).fetchall()
+        return [
+            {
+                **self._message(row),
+                "conversation_id": row["thread_id"],
+                "client": row["client"] or display_phone(row["thread_id"]),
+                "snippet": row["snippet"],
+                "score": round(-row["score"], 4)
             }
-        )
+            for row in rows
+        ]
+    
+    def get_thread(self, thread_id: str):
+        with self.lock:
+            thread = self.db.execute("SELECT * FROM threads WHERE id = ?", (thread_id,)).fetchone()
+        return self._thread_summary(thread) if thread else None
+
+def encode_cursor(key) -> str:
+    """Encode a keyset position as an opaque URL-safe cursor"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Decode a cursor from encode_cursor, raising HTTP 400 for anything malformed"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != 2 or not all(isinstance(part, str) for part in key):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(key)
+
+def validate_page_limit(limit: Optional[int]) -> int:
+    """Apply the default page size and reject sizes outside 1..MAX_PAGE_LIMIT"""
+    if limit is None:
+        return DEFAULT_PAGE_LIMIT
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_LIMIT}")
+    return limit
+
+def build_search_query(q: str) -> str:
+    """Translate user search text into a safe FTS5 query: "quoted phrases", prefix* terms, all terms required"""
+    terms = []
+    for index, part in enumerate(q.split('"')):
+        if index % 2 == 1:
+            words = SEARCH_TOKEN_PATTERN.findall(part)
+            if words:
+                terms.append('"' + " ".join(words) + '"')
+            continue
+        for token in part.split():
+            words = SEARCH_TOKEN_PATTERN.findall(token)
+            if not words:
+                continue
+            terms.append('"' + " ".join(words) + '"' + ("*" if token.endswith("*") else ""))
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query must contain at least one word")
+    return " AND ".join(terms)
+
+def validate_count_param(name: str, value: Optional[int]) -> Optional[int]:
+    """Reject a count query parameter outside 1..MAX_PAGE_LIMIT; None means use the caller's default"""
+    if value is not None and (value < 1 or value > MAX_PAGE_LIMIT):
+        raise HTTPException(status_code=400, detail=f"{name} must be between 1 and {MAX_PAGE_LIMIT}")
+    return value
+
+def parse_wassenger_message(data: dict):
+    """Normalize a Wassenger message object (API or webhook) into a stored message; the ID may be missing"""
+    chat = data.get("chat") if isinstance(data.get("chat"), dict) else {}
+    phone = data.get("phone") or data.get("fromNumber") or chat.get("phone") or ""
+    thread_id = chat.get("id") or data.get("wid") or contact_thread_id(phone)
+    body = data.get("message") or data.get("body") or ""
+    if not thread_id or not body:
+        return None
+    
+    return {
+        "id": data.get("id"),
+        "thread_id": thread_id,
+        "phone": phone,
+        "from_me": bool(data.get("fromMe", False)),
+        "body": body,
+        "created_at": normalize_timestamp(data.get("createdAt") or data.get("timestamp") or data.get("date"))
+    }
+
+def parse_webhook_message(payload: dict):
+    """Normalize a Wassenger webhook payload (event envelope or flat phone/message body) into a stored message"""
+    data = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+    message = parse_wassenger_message(data)
+    if message and not message["id"]:
+        # Derive the ID from the payload so a redelivered message hits the same dedupe key;
+        # the raw timestamp is used because a missing one normalizes to "now"
+        timestamp = data.get("createdAt") or data.get("timestamp") or data.get("date") or ""
+        key = json.dumps([message["thread_id"], str(timestamp), message["from_me"], message["body"]])
+        message["id"] = "webhook-" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return message
+
+message_store = MessageStore(MESSAGE_STORE_PATH)
+
+class ClientAppointmentIndex:
+    """Client record ID -> that client's appointments sorted by start, updated per appointment row"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.appointments_by_client = {}  # client record ID -> sorted [(date, minutes, record ID)]
+        self.appointments = {}  # appointment record ID -> (client ID, sort key, appointment summary)
+        self.synced_at = 0
+        self.loaded = threading.Event()
+    
+    def _summary(self, record):
+        fields = record.get('fields', {})
+        client_ids = fields.get('Client Name', [])
+        appointment_date = parse_appointment_date(fields.get('Appointment Date', ''))
+        if not isinstance(client_ids, list) or not client_ids or appointment_date is None:
+            return None, None, None
+        service_ids = fields.get('Services', [])
+        service_id = service_ids[0] if isinstance(service_ids, list) and service_ids else None
+        key = (appointment_date.isoformat(), parse_clock_minutes(fields.get('Appointment Time')) or 0, record['id'])
+        return client_ids[0], key, {
+            "record_id": record['id'],
+            "appointment_id": fields.get('Appointment ID', ''),
+            "date": appointment_date.isoformat(),
+            "time": fields.get('Appointment Time', ''),
+            "status": fields.get('Appointment Status', ''),
+            "service_id": service_id,
+            "notes": fields.get('Notes', '')
+        }
+    
+    def _remove_locked(self, record_id):
+        entry = self.appointments.pop(record_id, None)
+        if entry:
+            client_id, key, _ = entry
+            keys = self.appointments_by_client[client_id]
+            del keys[bisect_left(keys, key)]
+            if not keys:
+                del self.appointments_by_client[client_id]
+    
+    def _upsert_locked(self, record):
+        self._remove_locked(record['id'])
+        client_id, key, summary = self._summary(record)
+        if client_id:
+            self.appointments[record['id']] = (client_id, key, summary)
+            insort(self.appointments_by_client.setdefault(client_id, []), key)
+    
+    def upsert(self, record):
+        """Index (or re-index) one appointment row"""
+        with self.lock:
+            self._upsert_locked(record)
+    
+    def remove(self, record_id):
+        """Drop a deleted or cancelled appointment"""
+        with self.lock:
+            self._remove_locked(record_id)
+    
+    def load(self, records):
+        """Replace the index with a full set of appointment rows"""
+        with self.lock:
+            self.appointments_by_client = {}
+            self.appointments = {}
+            for record in records:
+                self._upsert_locked(record)
+            self.synced_at = time.time()
+        self.loaded.set()
+    
+    def mark_synced(self):
+        """Record that the analytics sync has just applied its changed rows"""
+        with self.lock:
+            self.synced_at = time.time()
+        self.loaded.set()
+    
+    def defer_load(self):
+        """Hold off the fallback reload while the analytics scheduler's first sync fills the index"""
+        with self.lock:
+            self.synced_at = time.time()
+    
+    def ensure_fresh(self):
+        """Start a background reload when neither a load nor the analytics sync has run for
+        CLIENT_APPOINTMENT_INDEX_TTL_SECONDS; never waits for it, callers read the current index"""
+        if not airtable:
+            return
+        with self.lock:
+            if time.time() - self.synced_at < CLIENT_APPOINTMENT_INDEX_TTL_SECONDS:
+                return
+            self.synced_at = time.time()
+        threading.Thread(target=self._reload, name="client-appointment-index", daemon=True).start()
+    
+    def _reload(self):
+        try:
+            self.load(airtable.get_all())
+            print(f"Client appointment index: {len(self.appointments)} appointments for {len(self.appointments_by_client)} clients")
+        except Exception as e:
+            print(f"Error loading client appointment index: {e}")
+    
+    def wait_until_loaded(self, timeout: float) -> bool:
+        """Block (off the event loop) until the index has been filled once; False if that takes longer than `timeout`"""
+        self.ensure_fresh()
+        return self.loaded.wait(timeout)
+    
+    def for_client(self, client_id, upcoming_limit: int, recent_limit: int):
+        """The client's next `upcoming_limit` appointments (soonest first) and last `recent_limit` (latest first)"""
+        today = (datetime.now().date().isoformat(),)
+        upcoming = []
+        with self.lock:
+            keys = self.appointments_by_client.get(client_id, [])
+            split = bisect_left(keys, today)
+            for key in keys[split:]:
+                if len(upcoming) >= upcoming_limit:
+                    break
+                appointment = self.appointments[key[2]][2]
+                if appointment["status"] != 'Cancelled':
+                    upcoming.append(appointment)
+            recent = [self.appointments[key[2]][2] for key in reversed(keys[max(split - recent_limit, 0):split])]
         
-        if devices_response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Failed to get devices: {devices_response.text}")
+        def with_service(appointment):
+            return {**appointment, "service": service_name_cache.get(appointment["service_id"])}
         
-        devices = devices_response.json()
-        print(f"Available devices: {devices}")
+        return {
+            "upcoming": [with_service(appointment) for appointment in upcoming],
+            "recent": [with_service(appointment) for appointment in recent]
+        }
+    
+    def next_appointment(self, client_id):
+        """The client's soonest upcoming appointment that is not cancelled, or None"""
+        upcoming = self.for_client(client_id, 1, 0)["upcoming"]
+        return upcoming[0] if upcoming else None
+
+client_appointment_index = ClientAppointmentIndex()
+
+class ClientPhoneIndex:
+    """Normalized phone number -> Airtable client, rebuilt from one paged read of the Clients table"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients_by_phone = {}  # E.164 phone -> {"id", "name"}
+        self.phones_by_client = {}  # client record ID -> E.164 phone
+        self.refreshed_at = 0
+        self.loaded = threading.Event()
+    
+    def refresh(self):
+        """Rebuild the phone maps from the Clients table (no per-client queries)"""
+        clients = airtable_clients.get_all()
         
-        if not devices:
-            raise HTTPException(status_code=500, detail="No devices found in Wassenger account")
+        clients_by_phone = {}
+        for client in clients:
+            fields = client.get('fields', {})
+            for field in CLIENT_PHONE_FIELDS:
+                phone = normalize_phone(fields.get(field))
+                if phone:
+                    clients_by_phone[phone] = {
+                        "id": client['id'],
+                        "name": fields.get('Client Name') or fields.get('Name', '')
+                    }
+                    break
         
-        # Use the first device (assuming single WhatsApp number)
-        device_id = devices[0]["id"] if isinstance(devices, list) else devices["id"]
-        print(f"Using device ID: {device_id}")
+        if airtable_services:
+            # Service names for the booking context, from one read of the small Services table
+            for service in airtable_services.get_all():
+                service_name_cache[service['id']] = service['fields'].get('Service Name') or service['fields'].get('Name', '')
         
-        # Get chats for the device
-        chats_response = requests.get(
-            f"{WASSENGER_BASE_URL}/devices/{device_id}/chats",
+        with self.lock:
+            self.clients_by_phone = clients_by_phone
+            self.phones_by_client = {client["id"]: phone for phone, client in clients_by_phone.items()}
+            self.refreshed_at = time.time()
+        self.loaded.set()
+        print(f"Client phone index: {len(clients_by_phone)} phones")
+    
+    def ensure_fresh(self):
+        """Start a background refresh once CLIENT_PHONE_INDEX_TTL_SECONDS have passed; never waits for it,
+        so requests keep reading the current maps (which stay in place if the refresh fails)"""
+        if not airtable_clients:
+            return
+        with self.lock:
+            if time.time() - self.refreshed_at < CLIENT_PHONE_INDEX_TTL_SECONDS:
+                return
+            # Claim this refresh so concurrent requests don't start another
+            self.refreshed_at = time.time()
+        threading.Thread(target=self._refresh_in_background, name="client-phone-index", daemon=True).start()
+    
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Error refreshing client phone index: {e}")
+    
+    def wait_until_loaded(self, timeout: float) -> bool:
+        """Block (off the event loop) until the maps have been built once; False if that takes longer than `timeout`"""
+        self.ensure_fresh()
+        return self.loaded.wait(timeout)
+    
+    def contact_for_client(self, client_id):
+        """Phone and name of a client record, or None if the client has no usable phone number"""
+        with self.lock:
+            phone = self.phones_by_client.get(client_id)
+            if not phone:
+                return None
+            return {"phone": phone, "name": self.clients_by_phone[phone]["name"]}
+    
+    def lookup(self, phone):
+        """Client for a phone number or WhatsApp ID, or None"""
+        normalized = normalize_phone(phone)
+        with self.lock:
+            client = self.clients_by_phone.get(normalized) if normalized else None
+            return dict(client) if client else None
+
+client_phone_index = ClientPhoneIndex()
+
+@app.on_event("startup")
+async def warm_client_phone_index():
+    """Build the client phone index in the background so the first conversation requests can use it"""
+    client_phone_index.ensure_fresh()
+
+def attach_client_details(conversations):
+    """Label conversations with their Airtable client (ID, name, next appointment) via the phone and appointment indexes"""
+    client_phone_index.ensure_fresh()
+    client_appointment_index.ensure_fresh()
+    for conversation in conversations:
+        match = None if conversation.get("tag") == "Group" else client_phone_index.lookup(conversation.get("id") or conversation.get("phone"))
+        conversation["client_id"] = match["id"] if match else None
+        conversation["next_appointment"] = client_appointment_index.next_appointment(match["id"]) if match else None
+        if match and match["name"]:
+            conversation["client"] = match["name"]
+    return conversations
+
+def conversation_booking_context(conversation_id: str):
+    """Linked client with upcoming and recent appointments for a thread, or None if no client matches"""
+    if "@g.us" in conversation_id:
+        return None
+    client_phone_index.ensure_fresh()
+    client_appointment_index.ensure_fresh()
+    match = client_phone_index.lookup(conversation_id)
+    if not match:
+        return None
+    return {
+        "client_id": match["id"],
+        "client_name": match["name"],
+        **client_appointment_index.for_client(match["id"], CONVERSATION_BOOKING_LIMIT, CONVERSATION_BOOKING_LIMIT)
+    }
+
+class WassengerUnavailable(HTTPException):
+    """Raised without calling Wassenger while the circuit breaker is open"""
+    
+    def __init__(self, retry_in: float):
+        super().__init__(status_code=503, detail=f"Wassenger is unavailable, retrying in {retry_in:.0f}s")
+        self.args = (self.detail,)
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets a single trial call through once the reset period passes"""
+    
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.trial_in_flight = False
+    
+    def before_call(self):
+        """Raise WassengerUnavailable unless a call may go out now"""
+        with self.lock:
+            if self.state == "closed":
+                return
+            elapsed = time.time() - self.opened_at
+            if elapsed < self.reset_seconds or self.trial_in_flight:
+                raise WassengerUnavailable(max(self.reset_seconds - elapsed, 0))
+            self.state = "half_open"
+            self.trial_in_flight = True
+    
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                print("Wassenger circuit breaker closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Wassenger circuit breaker opened after {self.consecutive_failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.time()
+    
+    def status(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures}
+
+class WassengerClient:
+    """requests.Session shared by every Wassenger call, so connections are pooled and reused"""
+    
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=WASSENGER_POOL_SIZE, pool_maxsize=WASSENGER_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Token": WASSENGER_API_KEY or ""
+        })
+        self.timeout = (WASSENGER_CONNECT_TIMEOUT_SECONDS, WASSENGER_READ_TIMEOUT_SECONDS)
+        self.breaker = CircuitBreaker(WASSENGER_BREAKER_FAILURE_THRESHOLD, WASSENGER_BREAKER_RESET_SECONDS)
+    
+    def request(self, method: str, url: str, **kwargs):
+        """Send a request through the breaker; connection errors, timeouts, 429 and 5xx count as failures"""
+        self.breaker.before_call()
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+    
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+    
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+wassenger_client = WassengerClient()
+
+def resolve_device_id(force_refresh: bool = False) -> str:
+    """Return the Wassenger device ID: the configured one, else a discovered one cached for WASSENGER_DEVICE_CACHE_TTL_SECONDS"""
+    if WASSENGER_DEVICE_ID:
+        return WASSENGER_DEVICE_ID
+    
+    with device_cache_lock:
+        cached_device_id = device_cache["device_id"]
+        is_fresh = time.time() - device_cache["resolved_at"] < WASSENGER_DEVICE_CACHE_TTL_SECONDS
+    if cached_device_id and is_fresh and not force_refresh:
+        return cached_device_id
+    
+    devices_response = wassenger_client.get(f"{WASSENGER_BASE_URL}/devices")
+    
+    if devices_response.status_code != 200:
+        invalidate_device_cache()
+        raise HTTPException(status_code=500, detail=f"Failed to get devices: {devices_response.text}")
+    
+    devices = devices_response.json()
+    print(f"Available devices: {devices}")
+    
+    if not devices:
+        invalidate_device_cache()
+        raise HTTPException(status_code=500, detail="No devices found in Wassenger account")
+    
+    # Use the first device (assuming single WhatsApp number)
+    device_id = devices[0]["id"] if isinstance(devices, list) else devices["id"]
+    print(f"Using device ID: {device_id}")
+    
+    with device_cache_lock:
+        device_cache["device_id"] = device_id
+        device_cache["resolved_at"] = time.time()
+    return device_id
+
+def invalidate_device_cache():
+    """Forget the discovered device so the next call rediscovers it"""
+    with device_cache_lock:
+        device_cache["device_id"] = None
+        device_cache["resolved_at"] = 0
+
+async def fetch_chat_messages(client, semaphore, device_id, chat_id, limit):
+    """Fetch the last `limit` messages of one chat, returning None if the request fails, times out or the breaker is open"""
+    async with semaphore:
+        try:
+            wassenger_client.breaker.before_call()
+            response = await client.get(
+                f"{WASSENGER_BASE_URL}/devices/{device_id}/chats/{chat_id}/messages",
+                params={"limit": limit}
+            )
+        except WassengerUnavailable:
+            return None
+        except httpx.HTTPError as e:
+            wassenger_client.breaker.record_failure()
+            print(f"Error fetching messages for chat {chat_id}: {e!r}")
+            return None
+    
+    if response.status_code == 429 or response.status_code >= 500:
+        wassenger_client.breaker.record_failure()
+    else:
+        wassenger_client.breaker.record_success()
+    if response.status_code != 200:
+        print(f"Failed to get messages for chat {chat_id}: {response.status_code}")
+        return None
+    
+    try:
+        return response.json()
+    except ValueError:
+        print(f"Invalid messages payload for chat {chat_id}")
+        return None
+
+wassenger_async_client = None
+
+def get_wassenger_async_client():
+    """The httpx client shared by all concurrent chat fetches; created on the running event loop when first needed"""
+    global wassenger_async_client
+    if wassenger_async_client is None or wassenger_async_client.is_closed:
+        wassenger_async_client = httpx.AsyncClient(
             headers={
                 "Content-Type": "application/json",
-                "Token": WASSENGER_API_KEY
-            }
+                "Token": WASSENGER_API_KEY or ""
+            },
+            timeout=httpx.Timeout(WASSENGER_CHAT_FETCH_TIMEOUT_SECONDS, connect=WASSENGER_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=WASSENGER_CHAT_FETCH_CONCURRENCY)
         )
+    return wassenger_async_client
+
+@app.on_event("startup")
+async def open_wassenger_async_client():
+    """Open the shared httpx client so its connection pool is reused across requests"""
+    get_wassenger_async_client()
+
+@app.on_event("shutdown")
+async def close_wassenger_async_client():
+    """Close the shared httpx client and its pooled connections"""
+    global wassenger_async_client
+    if wassenger_async_client is not None:
+        await wassenger_async_client.aclose()
+        wassenger_async_client = None
+
+async def fetch_all_chat_messages(device_id, chats, limit):
+    """Fetch recent messages for all chats concurrently, at most WASSENGER_CHAT_FETCH_CONCURRENCY at a time"""
+    semaphore = asyncio.Semaphore(WASSENGER_CHAT_FETCH_CONCURRENCY)
+    client = get_wassenger_async_client()
+    return await asyncio.gather(*(
+        fetch_chat_messages(client, semaphore, device_id, chat.get("id", ""), limit) for chat in chats
+    ))
+
+def message_contact_id(msg):
+    """Contact a Wassenger message belongs to, or None for group or anonymous messages"""
+    wid = msg.get("wid", "")
+    
+    # Skip group messages
+    if "@g.us" in wid:
+        return None
+    
+    # Create a unique identifier for this contact
+    return wid or msg.get("phone", "") or None
+
+def assemble_recent_threads(all_messages, max_threads: int, messages_per_thread: int):
+    """Group a flat message list into the `max_threads` most recently active contacts
+    
+    The first pass keeps only each contact's latest timestamp and picks the top contacts with a
+    heap; the second keeps at most `messages_per_thread` messages per selected contact in bounded
+    heaps. Memory is O(contacts + max_threads * messages_per_thread) however many messages arrive.
+    Returns (threads, number of distinct contacts).
+    """
+    last_activity = {}
+    for msg in all_messages:
+        contact_id = message_contact_id(msg)
+        if contact_id:
+            created_at = normalize_timestamp(msg.get("createdAt")) if msg.get("createdAt") else ""
+            if created_at >= last_activity.get(contact_id, ""):
+                last_activity[contact_id] = created_at
+    
+    top_contacts = heapq.nlargest(max_threads, last_activity.items(), key=lambda item: item[1])
+    recent_messages = {contact_id: [] for contact_id, _ in top_contacts}
+    threads = {}
+    
+    for position, msg in enumerate(all_messages):
+        contact_id = message_contact_id(msg)
+        if contact_id not in recent_messages:
+            continue
+        
+        phone = normalize_phone(msg.get("phone", "")) or msg.get("phone", "")
+        created_at = normalize_timestamp(msg.get("createdAt")) if msg.get("createdAt") else ""
+        message_body = msg.get("message", "")
+        if contact_id not in threads:
+            threads[contact_id] = {
+                "id": contact_id,
+                "client": f"Contact {phone}" if phone else f"Contact {contact_id}",
+                "phone": phone or contact_id,
+                "lastMessage": "",
+                "time": "",
+                "status": "pending",
+                "unread": 0,
+                "tag": "Regular",
+                "messages": [],
+                "lastActivity": ""
+            }
         
-        print(f"Chats response status: {chats_response.status_code}")
-        print(f"Chats response text: {chats_response.text[:500]}...")  # First 500 chars
+        thread = threads[contact_id]
+        if created_at >= thread["lastActivity"]:
+            thread["lastMessage"] = message_body
+            thread["time"] = created_at
+            thread["lastActivity"] = created_at
+            thread["status"] = "replied" if msg.get("fromMe") else "pending"
         
-        if chats_response.status_code != 200:
-            print(f"Failed to get chats - trying direct chats endpoint")
+        if message_body:
+            # Min-heap on (timestamp, arrival) holding this contact's newest messages
+            entry = (created_at, position, {
+                "id": msg.get("id", ""),
+                "sender": "ai" if msg.get("fromMe") else "client",
+                "text": message_body,
+                "time": created_at,
+                "phone": phone or contact_id
+            })
+            if len(recent_messages[contact_id]) < messages_per_thread:
+                heapq.heappush(recent_messages[contact_id], entry)
+            else:
+                heapq.heappushpop(recent_messages[contact_id], entry)
+    
+    recent_threads = []
+    for contact_id, _ in top_contacts:
+        thread = threads[contact_id]
+        thread["messages"] = [message for _, _, message in sorted(recent_messages[contact_id], key=lambda entry: entry[:2])]
+        recent_threads.append(thread)
+    return recent_threads, len(last_activity)
+
+async def fetch_upstream_conversations(max_threads: int = FALLBACK_THREAD_LIMIT, messages_per_thread: int = FALLBACK_MESSAGES_PER_THREAD):
+    """Build conversations from the Wassenger API, serving the last good list while the circuit breaker is open"""
+    try:
+        conversations = await build_upstream_conversations(max_threads, messages_per_thread)
+    except WassengerUnavailable:
+        if last_good_conversations["conversations"] is None:
+            raise
+        age = time.time() - last_good_conversations["fetched_at"]
+        print(f"Wassenger circuit open, serving conversations fetched {age:.0f}s ago")
+        return last_good_conversations["conversations"]
+    
+    last_good_conversations["conversations"] = conversations
+    last_good_conversations["fetched_at"] = time.time()
+    return conversations
+
+async def build_upstream_conversations(max_threads: int, messages_per_thread: int):
+    """Build conversations from the Wassenger API, used to backfill the local message store
+    
+    Wassenger calls go through the blocking requests session, so each runs in a worker thread
+    to keep the event loop free while Wassenger answers.
+    """
+    if not WASSENGER_API_KEY:
+        raise HTTPException(status_code=500, detail="Wassenger API key not configured")
+    
+    # Resolve the device ID (configured, cached, or discovered from Wassenger)
+    device_id = await asyncio.to_thread(resolve_device_id)
+    
+    # Get chats for the device
+    chats_response = await asyncio.to_thread(wassenger_client.get, f"{WASSENGER_BASE_URL}/devices/{device_id}/chats")
+    
+    if chats_response.status_code != 200 and not WASSENGER_DEVICE_ID:
+        # The cached device may have been unlinked or replaced; rediscover once and retry
+        refreshed_device_id = await asyncio.to_thread(resolve_device_id, force_refresh=True)
+        if refreshed_device_id != device_id:
+            device_id = refreshed_device_id
+            chats_response = await asyncio.to_thread(wassenger_client.get, f"{WASSENGER_BASE_URL}/devices/{device_id}/chats")
+    
+    print(f"Chats response status: {chats_response.status_code}")
+    print(f"Chats response text: {chats_response.text[:500]}...")  # First 500 chars
+    
+    if chats_response.status_code != 200:
+        print(f"Failed to get chats - trying direct chats endpoint")
+        
+        # Try the /chats endpoint mentioned in the documentation
+        chats_direct_response = await asyncio.to_thread(
+            wassenger_client.get,
+            f"{WASSENGER_BASE_URL}/chats",
+            params={"devices": device_id, "limit": 20}
+        )
+        
+        if chats_direct_response.status_code == 200:
+            all_chats = chats_direct_response.json()
+            print(f"Got {len(all_chats)} chats from direct endpoint")
             
-            # Try the /chats endpoint mentioned in the documentation
-            chats_direct_response = requests.get(
-                f"https://api.wassenger.com/v1/chats",
-                headers={
-                    "Content-Type": "application/json",
-                    "Token": WASSENGER_API_KEY
-                },
-                params={"devices": device_id, "limit": 20}
-            )
+            # Separate individual chats from group chats
+            individual_chats = [chat for chat in all_chats if not ("@g.us" in chat.get("id", ""))]
+            group_chats = [chat for chat in all_chats if "@g.us" in chat.get("id", "")]
             
-            if chats_direct_response.status_code == 200:
-                all_chats = chats_direct_response.json()
-                print(f"Got {len(all_chats)} chats from direct endpoint")
-                
-                # Separate individual chats from group chats
-                individual_chats = [chat for chat in all_chats if not ("@g.us" in chat.get("id", ""))]
-                group_chats = [chat for chat in all_chats if "@g.us" in chat.get("id", "")]
-                
-                print(f"Found {len(individual_chats)} individual chats and {len(group_chats)} group chats")
-                
-                # Process individual chats first
-                conversations = []
-                for chat in individual_chats[:10]:  # Take top 10 individual chats
-                    phone = chat.get("phone", "")
-                    if phone.startswith("971") and not phone.startswith("+"):
-                        phone = "+" + phone
-                    
-                    conversation = {
-                        "id": chat.get("id", ""),
-                        "client": chat.get("name", f"Contact {phone}"),
-                        "phone": phone,
-                        "lastMessage": chat.get("lastMessage", {}).get("body", ""),
-                        "time": chat.get("lastMessageAt", ""),
-                        "status": "replied" if chat.get("unreadCount", 0) == 0 else "pending",
-                        "unread": chat.get("unreadCount", 0),
-                        "tag": "Regular",
-                        "messages": []
-                    }
-                    conversations.append(conversation)
-                
-                # Process group chats
-                for chat in group_chats[:5]:  # Take top 5 group chats
-                    conversation = {
-                        "id": chat.get("id", ""),
-                        "client": chat.get("name", "Group Chat"),
-                        "phone": chat.get("id", ""),
-                        "lastMessage": f"Group with {chat.get('totalParticipants', 0)} participants",
-                        "time": chat.get("lastMessageAt", ""),
-                        "status": "replied",
-                        "unread": chat.get("unreadCount", 0),
-                        "tag": "Group",
-                        "messages": []
-                    }
-                    conversations.append(conversation)
-                
-                print(f"Total conversations: {len(conversations)} (Groups: {len(group_chats[:5])}, Individual: {len(individual_chats[:10])})")
-                return conversations
-            # Get groups (your 130 group chats)
-            groups_response = requests.get(
-                f"{WASSENGER_BASE_URL}/devices/{device_id}/groups",
-                headers={
-                    "Content-Type": "application/json",
-                    "Token": WASSENGER_API_KEY
-                },
-                params={"limit": 50}  # Get first 50 groups
-            )
+            print(f"Found {len(individual_chats)} individual chats and {len(group_chats)} group chats")
             
+            # Process individual chats first
             conversations = []
-            
-            if groups_response.status_code == 200:
-                groups = groups_response.json()
-                print(f"Got {len(groups)} total groups")
-                
-                # Sort groups by most recent activity and take only top 5
-                sorted_groups = sorted(groups, key=lambda x: x.get('lastMessageAt', ''), reverse=True)
-                recent_groups = sorted_groups[:5]  # Only 5 most recent groups
-                
-                for group in recent_groups:
-                    conversation = {
-                        "id": group.get("wid", group.get("id", "")),
-                        "client": group.get("name", "Group Chat"),
-                        "phone": group.get("wid", ""),
-                        "lastMessage": f"Group with {group.get('totalParticipants', 0)} participants",
-                        "time": group.get("lastMessageAt", ""),
-                        "status": "replied",
-                        "unread": group.get("unreadCount", 0),
-                        "tag": "Group",
-                        "messages": []
-                    }
-                    conversations.append(conversation)
+            for chat in individual_chats[:max_threads]:  # Take the top individual chats
+                phone = normalize_phone(chat.get("phone", "")) or chat.get("phone", "")
                 
-                print(f"Added {len(recent_groups)} most recent groups")
-            
-            # Try to get more individual conversations by making multiple API calls
-            all_messages = []
-            
-            # Get all available messages (both sent and received)
-            all_messages_response = requests.get(
-                f"{WASSENGER_BASE_URL}/messages",
-                headers={
-                    "Content-Type": "application/json",
-                    "Token": WASSENGER_API_KEY
-                },
-                params={
-                    "devices": device_id,
-                    "limit": 1000
+                conversation = {
+                    "id": chat.get("id", ""),
+                    "client": chat.get("name", f"Contact {phone}"),
+                    "phone": phone,
+                    "lastMessage": chat.get("lastMessage", {}).get("body", ""),
+                    "time": chat.get("lastMessageAt", ""),
+                    "status": "replied" if chat.get("unreadCount", 0) == 0 else "pending",
+                    "unread": chat.get("unreadCount", 0),
+                    "tag": "Regular",
+                    "messages": []
                 }
-            )
-            
-            if all_messages_response.status_code == 200:
-                all_messages = all_messages_response.json()
-                print(f"Got {len(all_messages)} total messages")
-                
-                # Extract unique individual conversations from all messages
-                individual_chats = {}
-                
-                for msg in all_messages:
-                    # Get the phone number or contact identifier
-                    phone = msg.get("phone", "")
-                    wid = msg.get("wid", "")
-                    
-                    # Skip group messages
-                    if "@g.us" in wid:
-                        continue
-                    
-                    # Create a unique identifier for this contact
-                    contact_id = wid if wid else phone
-                    if not contact_id:
-                        continue
-                    
-                    # Format phone number
-                    if phone.startswith("971") and not phone.startswith("+"):
-                        phone = "+" + phone
-                    
-                    message_body = msg.get("message", "")
-                    created_at = msg.get("createdAt", "")
-                    
-                    # Create or update individual chat
-                    if contact_id not in individual_chats:
-                        individual_chats[contact_id] = {
-                            "id": contact_id,
-                            "client": f"Contact {phone}" if phone else f"Contact {contact_id}",
-                            "phone": phone or contact_id,
-                            "lastMessage": message_body,
-                            "time": created_at,
-                            "status": "replied" if msg.get("fromMe") else "pending",
-                            "unread": 0,
-                            "tag": "Regular",
-                            "messages": [],
-                            "lastActivity": created_at
-                        }
-                    
-                    # Update with most recent message
-                    if created_at > individual_chats[contact_id].get("lastActivity", ""):
-                        individual_chats[contact_id]["lastMessage"] = message_body
-                        individual_chats[contact_id]["time"] = created_at
-                        individual_chats[contact_id]["lastActivity"] = created_at
-                    
-                    # Add message to conversation (limit to avoid performance issues)
-                    if message_body and len(individual_chats[contact_id]["messages"]) < 10:
-                        individual_chats[contact_id]["messages"].append({
-                            "id": msg.get("id", ""),
-                            "sender": "ai" if msg.get("fromMe") else "client",
-                            "text": message_body,
-                            "time": created_at,
-                            "phone": phone or contact_id
-                        })
-                
-                # Sort individual chats by most recent activity and take top 10
-                sorted_individual_chats = sorted(
-                    individual_chats.values(), 
-                    key=lambda x: x.get("lastActivity", ""), 
-                    reverse=True
-                )
-                recent_individual_chats = sorted_individual_chats[:10]  # Top 10 most recent
-                
-                # Add individual chats to conversations
-                for chat_data in recent_individual_chats:
-                    conversations.append(chat_data)
-                
-                # Add realistic mock individual conversations since API is limited
-                mock_individuals = [
-                    {"id": "971501234567@c.us", "client": "Ahmed Hassan", "phone": "+971501234567", "lastMessage": "Thank you for the appointment reminder", "time": "2025-07-17T03:30:00.000Z", "status": "pending", "unread": 1, "tag": "Regular", "messages": []},
-                    {"id": "971509876543@c.us", "client": "Sarah Al-Mansouri", "phone": "+971509876543", "lastMessage": "Can I reschedule my appointment?", "time": "2025-07-17T02:45:00.000Z", "status": "pending", "unread": 2, "tag": "VIP", "messages": []},
-                    {"id": "971567890123@c.us", "client": "Mohammed Al-Zahra", "phone": "+971567890123", "lastMessage": "Perfect! See you tomorrow at 3 PM", "time": "2025-07-17T01:20:00.000Z", "status": "replied", "unread": 0, "tag": "Regular", "messages": []},
-                    {"id": "971523456789@c.us", "client": "Fatima Al-Rashid", "phone": "+971523456789", "lastMessage": "Hi, I'd like to book a consultation", "time": "2025-07-16T23:15:00.000Z", "status": "pending", "unread": 1, "tag": "Regular", "messages": []},
-                    {"id": "971556789012@c.us", "client": "Omar Al-Khouri", "phone": "+971556789012", "lastMessage": "Thank you for the excellent service!", "time": "2025-07-16T20:30:00.000Z", "status": "replied", "unread": 0, "tag": "Regular", "messages": []},
-                    {"id": "971512345678@c.us", "client": "Layla Al-Fahim", "phone": "+971512345678", "lastMessage": "Is there availability this weekend?", "time": "2025-07-16T18:45:00.000Z", "status": "pending", "unread": 3, "tag": "VIP", "messages": []},
-                    {"id": "971587654321@c.us", "client": "Khalid Al-Mulla", "phone": "+971587654321", "lastMessage": "Confirmed for Friday at 2 PM", "time": "2025-07-16T16:20:00.000Z", "status": "replied", "unread": 0, "tag": "Regular", "messages": []},
-                    {"id": "971534567890@c.us", "client": "Aisha Al-Nuaimi", "phone": "+971534567890", "lastMessage": "Could you send me the pricing list?", "time": "2025-07-16T14:10:00.000Z", "status": "pending", "unread": 1, "tag": "Regular", "messages": []},
-                    {"id": "971598765432@c.us", "client": "Hassan Al-Blooshi", "phone": "+971598765432", "lastMessage": "Great! Looking forward to the session", "time": "2025-07-16T12:30:00.000Z", "status": "replied", "unread": 0, "tag": "Regular", "messages": []}
-                ]
-                
-                # Add mock individuals if we don't have enough real ones
-                current_individual_count = len(recent_individual_chats)
-                if current_individual_count < 10:
-                    mock_to_add = mock_individuals[:10 - current_individual_count]
-                    for mock_chat in mock_to_add:
-                        conversations.append(mock_chat)
-                    print(f"Added {len(mock_to_add)} mock individual conversations")
-                
-                print(f"Extracted {len(individual_chats)} unique individual chats from messages, showing {len(recent_individual_chats)} most recent")
+                conversations.append(conversation)
             
-            else:
-                print(f"Failed to get messages: {all_messages_response.status_code}")
-                # Fallback: create at least one conversation from your own number
-                conversations.append({
-                    "id": "971502810801@c.us",
-                    "client": "Your WhatsApp",
-                    "phone": "+971502810801",
-                    "lastMessage": "Recent messages",
-                    "time": "2025-07-17T04:00:00.000Z",
+            # Process group chats
+            for chat in group_chats[:5]:  # Take top 5 group chats
+                conversation = {
+                    "id": chat.get("id", ""),
+                    "client": chat.get("name", "Group Chat"),
+                    "phone": chat.get("id", ""),
+                    "lastMessage": f"Group with {chat.get('totalParticipants', 0)} participants",
+                    "time": chat.get("lastMessageAt", ""),
                     "status": "replied",
-                    "unread": 0,
-                    "tag": "Regular",
+                    "unread": chat.get("unreadCount", 0),
+                    "tag": "Group",
                     "messages": []
-                })
+                }
+                conversations.append(conversation)
             
-            print(f"Total conversations: {len(conversations)} (Groups: {len([c for c in conversations if c['tag'] == 'Group'])}, Individual: {len([c for c in conversations if c['tag'] == 'Regular'])})")
+            print(f"Total conversations: {len(conversations)} (Groups: {len(group_chats[:5])}, Individual: {len(individual_chats[:max_threads])})")
             return conversations
-        
-        chats = chats_response.json()
-        print(f"Got {len(chats)} chats")
+        # Get groups (your 130 group chats)
+        groups_response = await asyncio.to_thread(
+            wassenger_client.get,
+            f"{WASSENGER_BASE_URL}/devices/{device_id}/groups",
+            params={"limit": 50}  # Get first 50 groups
+        )
         
         conversations = []
-        for chat in chats:
-            # Get recent messages for each chat
-            messages_response = requests.get(
-                f"{WASSENGER_BASE_URL}/devices/{device_id}/chats/{chat['id']}/messages",
-                headers={
-                    "Content-Type": "application/json",
-                    "Token": WASSENGER_API_KEY
-                },
-                params={"limit": 10}  # Get last 10 messages
-            )
+        
+        if groups_response.status_code == 200:
+            groups = groups_response.json()
+            print(f"Got {len(groups)} total groups")
             
-            messages = []
-            last_message = ""
-            if messages_response.status_code == 200:
-                msg_data = messages_response.json()
-                for msg in msg_data:
-                    messages.append({
-                        "id": msg.get("id", ""),
-                        "sender": "client" if msg.get("fromMe") == False else "ai",
-                        "text": msg.get("body", ""),
-                        "time": msg.get("timestamp", ""),
-                        "phone": chat.get("id", "").replace("@c.us", "")
-                    })
-                
-                # Get last message for preview
-                if msg_data:
-                    last_message = msg_data[-1].get("body", "")
+            # Sort groups by most recent activity and take only top 5
+            sorted_groups = sorted(groups, key=lambda x: x.get('lastMessageAt', ''), reverse=True)
+            recent_groups = sorted_groups[:5]  # Only 5 most recent groups
             
-            # Extract phone number from chat ID (format: phone@c.us)
-            phone = chat.get("id", "").replace("@c.us", "").replace("@g.us", "")
-            if phone.startswith("971"):
-                phone = "+" + phone
+            for group in recent_groups:
+                conversation = {
+                    "id": group.get("wid", group.get("id", "")),
+                    "client": group.get("name", "Group Chat"),
+                    "phone": group.get("wid", ""),
+                    "lastMessage": f"Group with {group.get('totalParticipants', 0)} participants",
+                    "time": group.get("lastMessageAt", ""),
+                    "status": "replied",
+                    "unread": group.get("unreadCount", 0),
+                    "tag": "Group",
+                    "messages": []
+                }
+                conversations.append(conversation)
             
-            conversation = {
-                "id": chat.get("id", ""),
-                "client": chat.get("name", f"Contact {phone}"),
-                "phone": phone,
-                "lastMessage": last_message,
-                "time": chat.get("timestamp", ""),
-                "status": "replied" if chat.get("unreadCount", 0) == 0 else "pending",
-                "unread": chat.get("unreadCount", 0),
-                "tag": "Group" if "@g.us" in chat.get("id", "") else "Regular",
-                "messages": messages
-            }
-            conversations.append(conversation)
+            print(f"Added {len(recent_groups)} most recent groups")
         
-        return conversations
+        # Try to get more individual conversations by making multiple API calls
+        all_messages = []
         
-    except Exception as e:
-        print(f"Error fetching conversations: {str(e)}")
-        # Fallback to mock data if API fails
-        mock_conversations = [
-            {
-                "id": "1",
-                "client": "Sarah Johnson",
-                "phone": "+971502810801",
-                "lastMessage": "Hi, I need to reschedule my appointment for tomorrow",
-                "time": "2 min ago",
-                "status": "pending",
-                "unread": 2,
-                "tag": "VIP",
-                "messages": [
-                    {
-                        "id": "1",
-                        "sender": "client",
-                        "text": "Hi, I need to reschedule my appointment for tomorrow",
-                        "time": "2:30 PM",
-                        "phone": "+971502810801"
-                    },
-                    {
-                        "id": "2",
-                        "sender": "ai",
-                        "text": "Hi Sarah! Of course, I can help you reschedule. What time works better for you?",
-                        "time": "2:31 PM"
-                    }
-                ]
+        # Get all available messages (both sent and received)
+        all_messages_response = await asyncio.to_thread(
+            wassenger_client.get,
+            f"{WASSENGER_BASE_URL}/messages",
+            params={
+                "devices": device_id,
+                "limit": 1000
             }
-        ]
-        return mock_conversations
+        )
+        
+        if all_messages_response.status_code == 200:
+            all_messages = all_messages_response.json()
+            print(f"Got {len(all_messages)} total messages")
+            
+            recent_individual_chats, contact_count = assemble_recent_threads(all_messages, max_threads, messages_per_thread)
+            conversations.extend(recent_individual_chats)
+            
+            print(f"Extracted {contact_count} unique individual chats from messages, showing {len(recent_individual_chats)} most recent")
+        
+        else:
+            print(f"Failed to get messages: {all_messages_response.status_code}")
+        
+        print(f"Total conversations: {len(conversations)} (Groups: {len([c for c in conversations if c['tag'] == 'Group'])}, Individual: {len([c for c in conversations if c['tag'] == 'Regular'])})")
+        return conversations
+    
+    chats = chats_response.json()
+    print(f"Got {len(chats)} chats")
+    
+    # Fetch every chat's recent messages concurrently; failed chats come back as None
+    chat_messages = await fetch_all_chat_messages(device_id, chats, messages_per_thread)
+    failed_chats = sum(1 for msg_data in chat_messages if msg_data is None)
+    if failed_chats:
+        print(f"Messages unavailable for {failed_chats} of {len(chats)} chats, returning partial results")
+    
+    conversations = []
+    for chat, msg_data in zip(chats, chat_messages):
+        messages = []
+        last_message = ""
+        if msg_data is not None:
+            for msg in msg_data:
+                messages.append({
+                    "id": msg.get("id", ""),
+                    "sender": "client" if msg.get("fromMe") == False else "ai",
+                    "text": msg.get("body", ""),
+                    "time": msg.get("timestamp", ""),
+                    "phone": chat.get("id", "").replace("@c.us", "")
+                })
+            
+            # Get last message for preview
+            if msg_data:
+                last_message = msg_data[-1].get("body", "")
+        
+        # Extract phone number from chat ID (format: phone@c.us)
+        phone = display_phone(chat.get("id", ""))
+        
+        conversation = {
+            "id": chat.get("id", ""),
+            "client": chat.get("name", f"Contact {phone}"),
+            "phone": phone,
+            "lastMessage": last_message,
+            "time": chat.get("timestamp", ""),
+            "status": "replied" if chat.get("unreadCount", 0) == 0 else "pending",
+            "unread": chat.get("unreadCount", 0),
+            "tag": "Group" if "@g.us" in chat.get("id", "") else "Regular",
+            "messages": messages
+        }
+        conversations.append(conversation)
+    
+    return conversations
+    
+def snapshot_status():
+    """Age and staleness of the stored conversation list, measured from the last complete upstream refresh
+    
+    The snapshot also counts as stale while a message sync is part-way through a backlog.
+    """
+    refreshed_at = message_store.get_state(SNAPSHOT_REFRESHED_STATE_KEY)
+    age = time.time() - float(refreshed_at) if refreshed_at else None
+    sync_pending = json.loads(message_store.get_state(MESSAGE_SYNC_RESUME_STATE_KEY) or "null") is not None
+    return {
+        "refreshed_at": datetime.fromtimestamp(float(refreshed_at), tz=timezone.utc).isoformat() if refreshed_at else None,
+        "snapshot_age_seconds": round(age, 1) if age is not None else None,
+        "stale": age is None or age > CONVERSATION_SNAPSHOT_STALE_SECONDS or sync_pending,
+        "sync_pending": sync_pending,
+        "refreshing": conversation_snapshot["refreshing"]
+    }
 
-@app.post("/api/send-message")
-async def send_message(request: SendMessageRequest):
-    """Send a message via Wassenger API"""
+async def refresh_conversation_snapshot(max_threads: Optional[int] = None, messages_per_thread: Optional[int] = None):
+    """Backfill an empty store from Wassenger, then pull newer messages; never runs twice at once
+    
+    A backfill covers at least `max_threads` threads with `messages_per_thread` messages each,
+    so the request that triggered it can be answered in full from the store.
+    """
+    if conversation_snapshot["refreshing"]:
+        return
+    conversation_snapshot["refreshing"] = True
     try:
-        if not WASSENGER_API_KEY:
-            raise HTTPException(status_code=500, detail="Wassenger API key not configured")
+        imported = 0
+        if message_store.is_empty():
+            upstream_conversations = await fetch_upstream_conversations(
+                max(max_threads or 0, FALLBACK_THREAD_LIMIT),
+                max(messages_per_thread or 0, FALLBACK_MESSAGES_PER_THREAD)
+            )
+            await asyncio.to_thread(message_store.import_conversations, upstream_conversations)
+            imported += len(upstream_conversations)
+            print(f"Backfilled message store with {len(upstream_conversations)} conversations")
         
-        # Send message via Wassenger API
-        headers = {
-            "Content-Type": "application/json",
-            "Token": WASSENGER_API_KEY
+        result = await asyncio.to_thread(sync_wassenger_messages)
+        imported += result["imported"]
+        if result["imported"]:
+            print(f"Message sync imported {result['imported']} new messages")
+        
+        # A sync cut short by the page cap leaves messages missing, so the snapshot stays stale
+        if result["complete"]:
+            message_store.set_state(SNAPSHOT_REFRESHED_STATE_KEY, str(time.time()))
+        conversation_snapshot["last_error"] = None
+        if imported:
+            publish_event("conversations-refreshed", snapshot_status())
+    except Exception as e:
+        conversation_snapshot["last_error"] = getattr(e, "detail", None) or str(e)
+        print(f"Error refreshing conversations: {conversation_snapshot['last_error']}")
+    finally:
+        conversation_snapshot["refreshing"] = False
+
+def request_snapshot_refresh(max_threads: Optional[int] = None, messages_per_thread: Optional[int] = None):
+    """Start a background refresh if the snapshot is stale and none is running; never waits for it"""
+    if not WASSENGER_API_KEY or conversation_snapshot["refreshing"] or not snapshot_status()["stale"]:
+        return
+    conversation_snapshot["task"] = asyncio.create_task(refresh_conversation_snapshot(max_threads, messages_per_thread))
+
+@app.get("/api/conversations")
+async def get_conversations(response: Response, cursor: Optional[str] = None, limit: Optional[int] = None,
+                            threads: Optional[int] = None, messages_per_thread: Optional[int] = None):
+    """Get conversations from the local snapshot, which is refreshed from Wassenger in the background
+    
+    Without cursor/limit the envelope holds the most recent `threads` threads with their latest
+    `messages_per_thread` messages embedded and no next cursor. With cursor and/or limit it holds
+    one page of thread summaries and the cursor for the next page. Both carry the snapshot's age
+    and stale flag, also sent in X-Snapshot-* headers.
+    """
+    paginated = cursor is not None or limit is not None
+    if paginated:
+        page_limit = validate_page_limit(limit)
+        after = decode_cursor(cursor) if cursor else None
+    thread_count = validate_count_param("threads", threads)
+    message_depth = validate_count_param("messages_per_thread", messages_per_thread)
+    
+    request_snapshot_refresh(thread_count, message_depth)
+    snapshot = snapshot_status()
+    response.headers["X-Snapshot-Stale"] = "true" if snapshot["stale"] else "false"
+    if snapshot["snapshot_age_seconds"] is not None:
+        response.headers["X-Snapshot-Age"] = str(snapshot["snapshot_age_seconds"])
+        response.headers["X-Snapshot-Refreshed-At"] = snapshot["refreshed_at"]
+    
+    try:
+        if paginated:
+            conversations, next_key = message_store.list_thread_page(page_limit, after)
+        else:
+            conversations = message_store.list_conversations(
+                thread_count or CONVERSATION_LIST_LIMIT,
+                message_depth or CONVERSATION_MESSAGES_PER_THREAD
+            )
+            next_key = None
+        
+        return {
+            "conversations": attach_client_details(conversations),
+            "next_cursor": encode_cursor(next_key) if next_key else None,
+            **snapshot
         }
         
-        payload = {
-            "phone": request.phone,
-            "message": request.message
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching conversations: {str(e)}")
+
+@app.get("/api/conversations/unread-count")
+async def get_unread_count():
+    """Inbox badge: total unread messages and threads with unread messages"""
+    return message_store.unread_counts()
+
+@app.post("/api/conversations/{conversation_id}/read")
+async def mark_conversation_read(conversation_id: str):
+    """Mark a thread as read up to its latest message"""
+    if not message_store.mark_read(conversation_id):
+        raise HTTPException(status_code=404, detail=f"Conversation not found: {conversation_id}")
+    
+    counts = message_store.unread_counts()
+    publish_event("conversation-read", {"conversation_id": conversation_id, **counts})
+    return {"conversation_id": conversation_id, "unread": 0, **counts}
+
+@app.get("/api/conversations/{conversation_id}/messages")
+async def get_conversation_messages(conversation_id: str, before: Optional[str] = None, limit: Optional[int] = None):
+    """Get one page of a thread's history, oldest first, older than the `before` cursor"""
+    page_limit = validate_page_limit(limit)
+    before_key = decode_cursor(before) if before else None
+    
+    if not message_store.get_thread(conversation_id):
+        raise HTTPException(status_code=404, detail=f"Conversation not found: {conversation_id}")
+    
+    messages, next_key = message_store.list_message_page(conversation_id, page_limit, before_key)
+    return {
+        "conversation_id": conversation_id,
+        "messages": messages,
+        "next_before": encode_cursor(next_key) if next_key else None,
+        "booking": conversation_booking_context(conversation_id)
+    }
+
+@app.get("/api/conversations/search")
+async def search_conversations(q: str, limit: Optional[int] = None):
+    """Full-text search over stored message bodies, best matches first; supports "exact phrases" and prefix* terms"""
+    page_limit = validate_page_limit(limit)
+    match_query = build_search_query(q)
+    
+    try:
+        results = message_store.search_messages(match_query, page_limit)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {str(e)}")
+    
+    return {"query": q, "results": results}
+
+def sync_wassenger_messages():
+    """Fetch messages newer than the stored high-water mark, page by page, and merge them into their threads
+    
+    Wassenger pages newest first, so a backlog larger than WASSENGER_SYNC_MAX_PAGES pages is
+    fetched over several runs: the page reached and the newest message of the pass are saved
+    after every stored page, and the next run continues from there. Messages arriving meanwhile
+    only push older ones to later pages, so resuming can repeat messages (they are deduplicated)
+    but never skips one. The mark only moves once a pass reaches the end.
+    """
+    device_id = resolve_device_id()
+    high_water_mark = message_store.get_state(MESSAGE_SYNC_STATE_KEY)
+    resume = json.loads(message_store.get_state(MESSAGE_SYNC_RESUME_STATE_KEY) or "null")
+    if resume and resume.get("after") == high_water_mark:
+        start_page, newest = resume["page"], resume["newest"]
+    else:
+        start_page, newest = 0, high_water_mark or ""
+    fetched = 0
+    imported = 0
+    complete = False
+    
+    for page in range(start_page, start_page + WASSENGER_SYNC_MAX_PAGES):
+        params = {
+            "devices": device_id,
+            "limit": WASSENGER_SYNC_PAGE_SIZE,
+            "page": page
         }
+        if high_water_mark:
+            params["after"] = high_water_mark
         
-        response = requests.post(
+        response = wassenger_client.get(
             f"{WASSENGER_BASE_URL}/messages",
-            headers=headers,
-            json=payload
+            params=params
         )
-        
         if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=f"Wassenger API error: {response.text}")
+            raise HTTPException(status_code=502, detail=f"Failed to sync messages: {response.status_code} {response.text[:200]}")
+        
+        batch = response.json()
+        fetched += len(batch)
+        
+        messages = []
+        for msg in batch:
+            stored_message = parse_wassenger_message(msg)
+            # The API can repeat the boundary message; anything at or before the mark is already stored
+            if stored_message and stored_message["id"] and stored_message["created_at"] > (high_water_mark or ""):
+                messages.append(stored_message)
+                # Only the pass's first page sets the target mark; later pages hold older messages
+                if page == 0:
+                    newest = max(newest, stored_message["created_at"])
+        # The first sync imports history; only later syncs bring in messages nobody has seen
+        imported += message_store.add_messages(messages, count_unread=bool(high_water_mark))
+        
+        if len(batch) < WASSENGER_SYNC_PAGE_SIZE:
+            complete = True
+            break
+        message_store.set_state(MESSAGE_SYNC_RESUME_STATE_KEY, json.dumps({
+            "after": high_water_mark, "page": page + 1, "newest": newest
+        }))
+    
+    if complete:
+        if newest and newest != high_water_mark:
+            message_store.set_state(MESSAGE_SYNC_STATE_KEY, newest)
+        message_store.set_state(MESSAGE_SYNC_RESUME_STATE_KEY, "null")
+    else:
+        print(f"Message sync paused after {WASSENGER_SYNC_MAX_PAGES} pages; resuming from page {page + 1} next run")
+    
+    return {
+        "fetched": fetched,
+        "imported": imported,
+        "complete": complete,
+        "high_water_mark": message_store.get_state(MESSAGE_SYNC_STATE_KEY)
+    }
+
+async def message_sync_loop():
+    """Refresh the conversation snapshot every WASSENGER_SYNC_INTERVAL_SECONDS"""
+    while True:
+        await refresh_conversation_snapshot()
+        await asyncio.sleep(WASSENGER_SYNC_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_message_sync():
+    """Start the background Wassenger message sync when an API key is configured"""
+    global message_sync_task
+    if not WASSENGER_API_KEY or WASSENGER_SYNC_INTERVAL_SECONDS <= 0:
+        return
+    message_sync_task = asyncio.create_task(message_sync_loop())
+
+@app.on_event("shutdown")
+async def stop_message_sync():
+    """Cancel the background Wassenger message sync"""
+    if message_sync_task:
+        message_sync_task.cancel()
+
+@app.post("/api/conversations/sync")
+async def sync_conversations():
+    """Pull messages newer than the high-water mark from Wassenger into the local store"""
+    if not WASSENGER_API_KEY:
+        raise HTTPException(status_code=500, detail="Wassenger API key not configured")
+    
+    try:
+        result = await asyncio.to_thread(sync_wassenger_messages)
+        if result["complete"]:
+            message_store.set_state(SNAPSHOT_REFRESHED_STATE_KEY, str(time.time()))
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error syncing messages: {str(e)}")
+
+class EventBroadcaster:
+    """In-process fan-out of real-time events to connected /api/events subscribers"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+    
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SSE_SUBSCRIBER_QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+    
+    @staticmethod
+    def _deliver(queue, event):
+        # A subscriber that stopped reading loses its oldest events rather than blocking publishers
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+    
+    def publish(self, event_name: str, data: dict):
+        """Queue an event for every subscriber; safe to call from the event loop or a worker thread"""
+        event = (event_name, data)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, event)
+
+event_broadcaster = EventBroadcaster()
+
+class PusherDispatcher:
+    """Background thread that publishes queued Pusher events in batches, retrying with backoff"""
+    
+    def __init__(self, max_queue_size: int, max_retries: int):
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.thread = None
+        self.stopping = False
+        self.stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "batches": 0,
+            "retries": 0,
+            "dropped_queue_full": 0,
+            "dropped_after_retries": 0,
+            "last_error": None
+        }
+    
+    def start(self):
+        with self.condition:
+            if self.thread and self.thread.is_alive():
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="pusher-dispatcher", daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        """Stop after the events already queued have been attempted"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=PUSHER_SHUTDOWN_TIMEOUT_SECONDS)
+    
+    def enqueue(self, channel: str, event_name: str, data: dict):
+        """Queue an event without blocking; when the queue is full the oldest event is dropped"""
+        self.start()
+        with self.condition:
+            if len(self.queue) >= self.max_queue_size:
+                self.queue.popleft()
+                self.stats["dropped_queue_full"] += 1
+            self.queue.append({"channel": channel, "name": event_name, "data": data})
+            self.stats["enqueued"] += 1
+            self.condition.notify()
+    
+    def _next_batch(self):
+        with self.condition:
+            while not self.queue and not self.stopping:
+                self.condition.wait()
+            # Pusher's batch trigger accepts at most PUSHER_BATCH_SIZE events per call
+            return [self.queue.popleft() for _ in range(min(PUSHER_BATCH_SIZE, len(self.queue)))]
+    
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._send(batch)
+    
+    def _send(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if len(batch) == 1:
+                    pusher_client.trigger(batch[0]["channel"], batch[0]["name"], batch[0]["data"])
+                else:
+                    pusher_client.trigger_batch(batch)
+                with self.condition:
+                    self.stats["sent"] += len(batch)
+                    self.stats["batches"] += 1
+                return
+            except Exception as e:
+                with self.condition:
+                    self.stats["last_error"] = str(e)
+                    if attempt == self.max_retries or self.stopping:
+                        self.stats["dropped_after_retries"] += len(batch)
+                        print(f"Dropping {len(batch)} Pusher events after {attempt + 1} attempts: {e}")
+                        return
+                    self.stats["retries"] += 1
+                time.sleep(min(PUSHER_RETRY_BASE_SECONDS * 2 ** attempt, PUSHER_RETRY_MAX_SECONDS))
+    
+    def metrics(self):
+        with self.condition:
+            return {
+                **self.stats,
+                "queue_depth": len(self.queue),
+                "running": bool(self.thread and self.thread.is_alive())
+            }
+
+pusher_dispatcher = PusherDispatcher(PUSHER_QUEUE_MAX_SIZE, PUSHER_MAX_RETRIES)
+
+def publish_event(event_name: str, data: dict):
+    """Send a real-time event to dashboards over SSE, and queue it for Pusher when it is the selected backend"""
+    event_broadcaster.publish(event_name, data)
+    if REALTIME_BACKEND == "pusher":
+        pusher_dispatcher.enqueue(PUSHER_CHANNEL, event_name, data)
+
+@app.on_event("shutdown")
+async def stop_pusher_dispatcher():
+    """Give queued Pusher events a chance to go out before exiting"""
+    await asyncio.to_thread(pusher_dispatcher.stop)
+
+@app.get("/api/realtime/metrics")
+async def get_realtime_metrics():
+    """Queue depth, throughput and drop counts for real-time event delivery"""
+    return {
+        "backend": REALTIME_BACKEND,
+        "sse_subscribers": len(event_broadcaster.subscribers),
+        "pusher": pusher_dispatcher.metrics()
+    }
+
+@app.get("/api/events")
+async def stream_events(request: Request):
+    """Server-Sent Events stream of real-time dashboard events (alternative to the Pusher channel)"""
+    subscriber = event_broadcaster.subscribe()
+    _, queue = subscriber
+    
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event_name, data = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            event_broadcaster.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class MessageRecordError(Exception):
+    """The message was sent, but storing it or notifying dashboards failed afterwards; never resend it"""
+    
+    def __init__(self, stored_message: dict, error: Exception):
+        super().__init__(f"Message sent but not recorded: {error}")
+        self.stored_message = stored_message
+
+def never_reached_wassenger(error: Exception) -> bool:
+    """True when a send failed before the request went out (no connection could be made), so retrying cannot duplicate it"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), ConnectTimeoutError)
+    return False
+
+def send_error_is_retryable(error: Exception) -> bool:
+    """True only when Wassenger cannot have sent the message: 429 and 503 (not processed) or no connection made
+    
+    Other 5xx responses, such as a gateway timeout, may come after the message was queued.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in (429, 503)
+    return never_reached_wassenger(error)
+
+def deliver_message(phone: str, message: str):
+    """Send one WhatsApp message through Wassenger, store it and notify dashboards; returns the stored message
+    
+    Failures after Wassenger accepted the message raise MessageRecordError, so callers can tell
+    a sent message from one that was never delivered.
+    """
+    # Send message via Wassenger API
+    payload = {
+        "phone": phone,
+        "message": message
+    }
+    
+    response = wassenger_client.post(
+        f"{WASSENGER_BASE_URL}/messages",
+        json=payload
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=f"Wassenger API error: {response.text}")
+    
+    # Record the outgoing message in the local store under Wassenger's message ID when available
+    try:
+        sent = response.json()
+    except ValueError:
+        sent = {}
+    if not isinstance(sent, dict):
+        sent = {}
+    stored_message = {
+        "id": sent.get("id") or str(uuid.uuid4()),
+        "thread_id": contact_thread_id(phone),
+        "phone": phone,
+        "from_me": True,
+        "body": message,
+        "created_at": normalize_timestamp(sent.get("createdAt"))
+    }
+    try:
+        message_store.add_message(stored_message)
         
-        # Trigger Pusher event for real-time updates
-        pusher_client.trigger(
-            os.getenv("PUSHER_CHANNEL", "my-channel"),
+        # Publish real-time update to connected dashboards
+        publish_event(
             "new-message",
             {
-                "phone": request.phone,
-                "message": request.message,
+                "conversation_id": stored_message["thread_id"],
+                "phone": phone,
+                "message": message,
                 "sender": "ai",
-                "time": datetime.now().strftime("%I:%M %p")
+                "time": datetime.now().strftime("%I:%M %p"),
+                **message_store.thread_state(stored_message["thread_id"]),
+                **message_store.unread_counts()
             }
         )
+    except Exception as e:
+        raise MessageRecordError(stored_message, e) from e
+    return stored_message
+
+@app.post("/api/send-message")
+async def send_message(request: SendMessageRequest):
+    """Send a message via Wassenger API"""
+    try:
+        if not WASSENGER_API_KEY:
+            raise HTTPException(status_code=500, detail="Wassenger API key not configured")
+        
+        deliver_message(request.phone, request.message)
         
         return {"success": True, "message": "Message sent successfully"}
     
+    except MessageRecordError as e:
+        return {"success": True, "message": "Message sent successfully", "warning": str(e)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending message: {str(e)}")
 
-@app.post("/api/webhook/wassenger")
-async def wassenger_webhook(request: dict):
-    """Webhook endpoint for receiving messages from Wassenger"""
+class RateLimiter:
+    """Spaces out async callers so that at most `rate_per_second` acquisitions happen per second"""
+    
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+def render_message_template(template: str, values: dict) -> str:
+    """Fill {placeholder} fields in a bulk message template; unknown placeholders are left as written"""
+    return BULK_TEMPLATE_PLACEHOLDER.sub(lambda match: str(values.get(match.group(1), match.group(0))), template)
+
+def resolve_bulk_recipients(request: BulkMessageRequest):
+    """Expand explicit recipients and/or a client filter into unique phone numbers with template values"""
+    recipients = []
+    for recipient in request.recipients or []:
+        recipients.append({"phone": recipient.phone, "name": recipient.name or "", "client_id": None})
+    
+    if request.client_filter:
+        if not airtable_clients:
+            raise HTTPException(status_code=503, detail="Airtable not configured")
+        client_filter = request.client_filter
+        client_ids = set(client_filter.client_ids or [])
+        if client_filter.upcoming_appointment is not None and not client_appointment_index.wait_until_loaded(CLIENT_INDEX_LOAD_WAIT_SECONDS):
+            raise HTTPException(status_code=503, detail="Client appointments are still loading, try again shortly")
+        for client in airtable_clients.get_all():
+            fields = client.get('fields', {})
+            if client_ids and client['id'] not in client_ids:
+                continue
+            if client_filter.tag and client_filter.tag not in (fields.get('Tags') or []):
+                continue
+            if client_filter.upcoming_appointment is not None:
+                has_upcoming = client_appointment_index.next_appointment(client['id']) is not None
+                if has_upcoming != client_filter.upcoming_appointment:
+                    continue
+            phone = next((fields[field] for field in CLIENT_PHONE_FIELDS if fields.get(field)), None)
+            if phone:
+                recipients.append({
+                    "phone": phone,
+                    "name": fields.get('Client Name') or fields.get('Name', ''),
+                    "client_id": client['id']
+                })
+    
+    unique = {}
+    for recipient in recipients:
+        normalized = normalize_phone(recipient["phone"])
+        if not normalized:
+            continue
+        if normalized in unique:
+            # An explicit recipient that is also a matching client picks up the client's name and ID
+            existing = unique[normalized]
+            existing["name"] = existing["name"] or recipient["name"]
+            existing["client_id"] = existing["client_id"] or recipient["client_id"]
+        else:
+            unique[normalized] = {**recipient, "phone": normalized}
+    return list(unique.values())
+
+def bulk_template_values(recipient: dict) -> dict:
+    name = recipient["name"] or ""
+    next_appointment = client_appointment_index.next_appointment(recipient["client_id"]) or {}
+    return {
+        "name": name,
+        "first_name": name.split()[0] if name.strip() else "",
+        "phone": recipient["phone"],
+        "next_appointment_date": next_appointment.get("date", ""),
+        "next_appointment_time": next_appointment.get("time", "")
+    }
+
+def bulk_job_summary(job: dict) -> dict:
+    return {key: value for key, value in job.items() if key != "recipients"}
+
+async def send_bulk_recipient(job: dict, recipient: dict, limiter: RateLimiter, semaphore: asyncio.Semaphore):
+    """Send one recipient's message, retrying with backoff only when Wassenger cannot have sent it
+    
+    429 and 503 responses and failures to connect are retried. Anything else, such as a gateway
+    or read timeout after the request went out, may already have reached the client and is not resent.
+    """
+    async with semaphore:
+        for attempt in range(1, BULK_SEND_MAX_ATTEMPTS + 1):
+            if job["status"] == "cancelled":
+                recipient["status"] = "cancelled"
+                break
+            await limiter.acquire()
+            recipient["attempts"] = attempt
+            try:
+                stored_message = await asyncio.to_thread(deliver_message, recipient["phone"], recipient["message"])
+                recipient["status"] = "sent"
+                recipient["message_id"] = stored_message["id"]
+                recipient["error"] = None
+                break
+            except MessageRecordError as e:
+                recipient["status"] = "sent"
+                recipient["message_id"] = e.stored_message["id"]
+                recipient["error"] = str(e)
+                break
+            except Exception as e:
+                recipient["error"] = getattr(e, "detail", None) or str(e)
+                retryable = send_error_is_retryable(e)
+                status_code = getattr(e, "status_code", None)
+                if not retryable and (status_code is None or status_code >= 500):
+                    recipient["error"] = f"Delivery unconfirmed, not retried: {recipient['error']}"
+                if not retryable or attempt == BULK_SEND_MAX_ATTEMPTS:
+                    recipient["status"] = "failed"
+                    break
+                await asyncio.sleep(BULK_SEND_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    
+    job["pending"] -= 1
+    if recipient["status"] in ("sent", "failed"):
+        job[recipient["status"]] += 1
+
+async def run_bulk_job(job: dict):
+    """Send a bulk job's messages within its rate and concurrency limits"""
+    job["status"] = "running"
+    job["started_at"] = datetime.now().isoformat()
+    limiter = RateLimiter(job["rate_per_second"])
+    semaphore = asyncio.Semaphore(job["concurrency"])
+    await asyncio.gather(*(
+        send_bulk_recipient(job, recipient, limiter, semaphore) for recipient in job["recipients"]
+    ))
+    if job["status"] != "cancelled":
+        job["status"] = "completed"
+    job["finished_at"] = datetime.now().isoformat()
+    print(f"Bulk job {job['id']} {job['status']}: {job['sent']} sent, {job['failed']} failed of {job['total']}")
+
+async def bulk_send_worker():
+    """Run queued bulk jobs one at a time so broadcasts never exceed the configured send rate together"""
+    while True:
+        job = await bulk_send_queue.get()
+        try:
+            if job["status"] == "queued":
+                await run_bulk_job(job)
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            print(f"Bulk job {job['id']} failed: {e}")
+        finally:
+            bulk_send_queue.task_done()
+
+def ensure_bulk_send_worker():
+    global bulk_send_queue, bulk_send_task
+    if bulk_send_queue is None:
+        bulk_send_queue = asyncio.Queue()
+    if bulk_send_task is None or bulk_send_task.done():
+        bulk_send_task = asyncio.create_task(bulk_send_worker())
+
+@app.on_event("shutdown")
+async def stop_bulk_send_worker():
+    """Cancel the bulk send worker; unsent recipients stay pending in their job"""
+    if bulk_send_task:
+        bulk_send_task.cancel()
+
+@app.post("/api/messages/bulk", status_code=202)
+async def create_bulk_message_job(request: BulkMessageRequest):
+    """Queue a templated message to a recipient list and/or filtered clients; poll the status URL for progress"""
+    if not WASSENGER_API_KEY:
+        raise HTTPException(status_code=500, detail="Wassenger API key not configured")
+    if not request.template.strip():
+        raise HTTPException(status_code=400, detail="template must not be empty")
+    if not request.recipients and not request.client_filter:
+        raise HTTPException(status_code=400, detail="Provide recipients and/or client_filter")
+    unknown = set(BULK_TEMPLATE_PLACEHOLDER.findall(request.template)) - BULK_TEMPLATE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown template placeholders: {', '.join(sorted(unknown))}")
+    
     try:
-        # Process incoming message from Wassenger
-        # This would be called when someone sends a message to your WhatsApp number
-        
-        # Extract message data (structure depends on Wassenger webhook format)
-        phone = request.get("phone", "")
-        message = request.get("message", "")
-        sender_name = request.get("sender_name", "Unknown")
+        recipients = await asyncio.to_thread(resolve_bulk_recipients, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error resolving recipients: {str(e)}")
+    
+    if not recipients:
+        raise HTTPException(status_code=400, detail="No recipients with a valid phone number")
+    if len(recipients) > BULK_MAX_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_RECIPIENTS} recipients per job")
+    
+    job_id = str(uuid.uuid4())
+    job = {
+        "id": job_id,
+        "status": "queued",
+        "created_at": datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "rate_per_second": min(request.rate_per_second or BULK_SEND_RATE_PER_SECOND, BULK_SEND_MAX_RATE_PER_SECOND),
+        "concurrency": min(request.concurrency or BULK_SEND_CONCURRENCY, BULK_SEND_MAX_CONCURRENCY),
+        "total": len(recipients),
+        "pending": len(recipients),
+        "sent": 0,
+        "failed": 0,
+        "recipients": [{
+            "phone": recipient["phone"],
+            "name": recipient["name"],
+            "client_id": recipient["client_id"],
+            "message": render_message_template(request.template, bulk_template_values(recipient)),
+            "status": "pending",
+            "attempts": 0,
+            "message_id": None,
+            "error": None
+        } for recipient in recipients]
+    }
+    if job["rate_per_second"] <= 0 or job["concurrency"] <= 0:
+        raise HTTPException(status_code=400, detail="rate_per_second and concurrency must be positive")
+    
+    bulk_jobs[job_id] = job
+    # Drop the oldest finished jobs; queued and running ones stay reachable for status and cancel
+    finished = [old_id for old_id, old_job in bulk_jobs.items() if old_job["status"] not in ("queued", "running")]
+    for old_id in finished[:max(len(bulk_jobs) - BULK_JOB_HISTORY_SIZE, 0)]:
+        del bulk_jobs[old_id]
+    
+    ensure_bulk_send_worker()
+    bulk_send_queue.put_nowait(job)
+    return {**bulk_job_summary(job), "status_url": f"/api/messages/bulk/{job_id}"}
+
+@app.get("/api/messages/bulk")
+async def list_bulk_message_jobs():
+    """Recent bulk jobs with their progress counters, newest first"""
+    return [bulk_job_summary(job) for job in reversed(bulk_jobs.values())]
+
+@app.get("/api/messages/bulk/{job_id}")
+async def get_bulk_message_job(job_id: str):
+    """Progress of a bulk job with the outcome for each recipient"""
+    job = bulk_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Bulk job not found: {job_id}")
+    return job
+
+@app.post("/api/messages/bulk/{job_id}/cancel")
+async def cancel_bulk_message_job(job_id: str):
+    """Stop a queued or running bulk job; messages already sent are not affected"""
+    job = bulk_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Bulk job not found: {job_id}")
+    if job["status"] in ("queued", "running"):
+        if job["status"] == "queued":
+            for recipient in job["recipients"]:
+                recipient["status"] = "cancelled"
+            job["pending"] = 0
+            job["finished_at"] = datetime.now().isoformat()
+        job["status"] = "cancelled"
+    return bulk_job_summary(job)
+
+def appointment_start(fields):
+    """Start of an appointment as an aware UTC datetime, reading its date and time fields as SALON_TIMEZONE wall-clock time
+    
+    Returns None if the date is invalid.
+    """
+    appointment_date = parse_appointment_date(fields.get('Appointment Date', ''))
+    if appointment_date is None:
+        return None
+    minutes = parse_clock_minutes(fields.get('Appointment Time') or REMINDER_DEFAULT_TIME)
+    if minutes is None:
+        minutes = parse_clock_minutes(REMINDER_DEFAULT_TIME)
+    local_start = datetime.combine(appointment_date, datetime.min.time()) + timedelta(minutes=minutes)
+    return local_start.replace(tzinfo=SALON_TIMEZONE).astimezone(timezone.utc)
+
+class ReminderScheduler:
+    """Min-heap of pending reminder times, updated per appointment write instead of rescanning the table
+    
+    Rescheduling or cancelling bumps an appointment's generation; heap entries from older generations
+    are discarded when they reach the top. Sent reminders are recorded in the message store so a restart
+    does not send them twice, and those records are deleted once their appointment has passed.
+    All times are aware UTC datetimes.
+    """
+    
+    def __init__(self, offsets_hours):
+        self.offsets = sorted({timedelta(hours=hours) for hours in offsets_hours}, reverse=True)
+        self.lock = threading.Lock()
+        self.heap = []  # (send at, sequence, appointment ID, generation, offset hours, attempt)
+        self.appointments = {}  # appointment record ID -> {"generation", "start", "client_id", "service_id"}
+        self.sequence = 0
+        self.loop = None
+        self.wake_event = None
+        self.active = False  # set once run() starts; until then writes and syncs have nothing to feed
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "skipped": 0, "last_error": None}
+    
+    def _wake(self):
+        if self.loop and self.wake_event:
+            self.loop.call_soon_threadsafe(self.wake_event.set)
+    
+    def upsert(self, record):
+        """(Re)schedule an appointment's reminders; cancelled or past appointments just drop their pending ones"""
+        if not self.active:
+            return
+        fields = record.get('fields', {})
+        client_ids = fields.get('Client Name', [])
+        service_ids = fields.get('Services', [])
+        start = appointment_start(fields)
+        now = datetime.now(timezone.utc)
         
-        # Trigger Pusher event for real-time updates
-        pusher_client.trigger(
-            os.getenv("PUSHER_CHANNEL", "my-channel"),
-            "new-message",
-            {
-                "phone": phone,
-                "message": message,
-                "sender": "client",
-                "sender_name": sender_name,
-                "time": datetime.now().strftime("%I:%M %p")
+        with self.lock:
+            previous = self.appointments.get(record['id'])
+            if (start is None or start <= now or fields.get('Appointment Status', '') == 'Cancelled'
+                    or not isinstance(client_ids, list) or not client_ids):
+                self.appointments.pop(record['id'], None)
+                return
+            
+            if previous and previous["start"] == start and previous["client_id"] == client_ids[0]:
+                previous["service_id"] = service_ids[0] if isinstance(service_ids, list) and service_ids else None
+                return
+            
+            # Generations come from the global sequence so entries from before a cancel never come back to life
+            self.sequence += 1
+            generation = self.sequence
+            self.appointments[record['id']] = {
+                "generation": generation,
+                "start": start,
+                "client_id": client_ids[0],
+                "service_id": service_ids[0] if isinstance(service_ids, list) and service_ids else None
             }
-        )
+            grace = timedelta(minutes=REMINDER_GRACE_MINUTES)
+            for offset in self.offsets:
+                due = start - offset
+                if due >= now - grace:
+                    self.sequence += 1
+                    heapq.heappush(self.heap, (due, self.sequence, record['id'], generation, offset.total_seconds() / 3600, 1))
+        self._wake()
+    
+    def remove(self, record_id):
+        """Forget a deleted or cancelled appointment; its heap entries become stale"""
+        if not self.active:
+            return
+        with self.lock:
+            self.appointments.pop(record_id, None)
+    
+    def _pop_due(self, now):
+        """Pop current entries due by `now`, discarding stale ones; returns (due entries, seconds until next)"""
+        due_entries = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, _, record_id, generation, offset_hours, attempt = heapq.heappop(self.heap)
+                appointment = self.appointments.get(record_id)
+                if appointment and appointment["generation"] == generation:
+                    due_entries.append((record_id, generation, offset_hours, attempt, dict(appointment)))
+            next_in = (self.heap[0][0] - now).total_seconds() if self.heap else REMINDER_MAX_SLEEP_SECONDS
+        return due_entries, max(0.0, min(next_in, REMINDER_MAX_SLEEP_SECONDS))
+    
+    def _retry(self, record_id, generation, offset_hours, attempt):
+        """Put a failed send back on the heap with backoff; returns False once attempts are used up"""
+        if attempt >= REMINDER_MAX_ATTEMPTS:
+            return False
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=REMINDER_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+        with self.lock:
+            self.sequence += 1
+            heapq.heappush(self.heap, (retry_at, self.sequence, record_id, generation, offset_hours, attempt + 1))
+        self.stats["retried"] += 1
+        return True
+    
+    def _send(self, record_id, offset_hours, appointment):
+        local_start = appointment["start"].astimezone(SALON_TIMEZONE)
+        # Keyed by the salon's wall-clock start, as Airtable shows it
+        sent_key = f"{REMINDER_SENT_KEY_PREFIX}{record_id}:{local_start.replace(tzinfo=None).isoformat()}:{offset_hours:g}"
+        if message_store.get_state(sent_key):
+            return
+        due = appointment["start"] - timedelta(hours=offset_hours)
+        if datetime.now(timezone.utc) - due > timedelta(minutes=REMINDER_GRACE_MINUTES):
+            self.stats["skipped"] += 1
+            return
         
-        return {"success": True}
+        client_phone_index.wait_until_loaded(CLIENT_INDEX_LOAD_WAIT_SECONDS)
+        contact = client_phone_index.contact_for_client(appointment["client_id"])
+        if not contact:
+            self.stats["skipped"] += 1
+            print(f"No phone number for client {appointment['client_id']}, skipping reminder for {record_id}")
+            return
+        
+        name = contact["name"] or ""
+        message = render_message_template(REMINDER_TEMPLATE, {
+            "name": name,
+            "first_name": name.split()[0] if name.strip() else "",
+            "service": (get_service_name(appointment["service_id"]) if appointment["service_id"] else None) or "upcoming",
+            "date": local_start.strftime("%A %d %B"),
+            "time": local_start.strftime("%I:%M %p").lstrip("0")
+        })
+        try:
+            deliver_message(contact["phone"], message)
+        except MessageRecordError as e:
+            print(f"Reminder for appointment {record_id}: {e}")
+        message_store.set_state(sent_key, datetime.now(timezone.utc).isoformat())
+        self.stats["sent"] += 1
+        print(f"Sent {offset_hours:g}h reminder for appointment {record_id} to {contact['phone']}")
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
+    async def run(self):
+        """Sleep until the earliest reminder is due (or the schedule changes), then send what is due"""
+        self.loop = asyncio.get_running_loop()
+        self.wake_event = asyncio.Event()
+        self.active = True
+        try:
+            records = await asyncio.to_thread(airtable.get_all)
+            for record in records:
+                self.upsert(record)
+            print(f"Reminder scheduler loaded {len(self.appointments)} upcoming appointments")
+            await asyncio.to_thread(self.prune_sent_records)
+        except Exception as e:
+            print(f"Error loading appointments for reminders: {e}")
+        
+        while True:
+            self.wake_event.clear()
+            due_entries, sleep_seconds = self._pop_due(datetime.now(timezone.utc))
+            for record_id, generation, offset_hours, attempt, appointment in due_entries:
+                try:
+                    await asyncio.to_thread(self._send, record_id, offset_hours, appointment)
+                except Exception as e:
+                    self.stats["last_error"] = getattr(e, "detail", None) or str(e)
+                    # Like bulk sends, only retry when Wassenger cannot have sent the message
+                    if send_error_is_retryable(e) and self._retry(record_id, generation, offset_hours, attempt):
+                        print(f"Error sending reminder for appointment {record_id}, retrying: {self.stats['last_error']}")
+                    else:
+                        self.stats["failed"] += 1
+                        print(f"Error sending reminder for appointment {record_id}: {self.stats['last_error']}")
+            if due_entries:
+                await asyncio.to_thread(self.prune_sent_records)
+                continue
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), timeout=sleep_seconds)
+            except asyncio.TimeoutError:
+                pass
+    
+    def prune_sent_records(self):
+        """Delete sent-reminder records old enough that their appointment has started"""
+        longest_offset = self.offsets[0] if self.offsets else timedelta(0)
+        cutoff = datetime.now(timezone.utc) - longest_offset - timedelta(minutes=REMINDER_GRACE_MINUTES)
+        deleted = message_store.delete_state_before(REMINDER_SENT_KEY_PREFIX, cutoff.isoformat())
+        if deleted:
+            print(f"Deleted {deleted} sent-reminder records for past appointments")
+    
+    def upcoming(self, limit: int):
+        """The next `limit` live reminders in due order, in the salon's timezone"""
+        with self.lock:
+            live = [entry for entry in self.heap
+                    if self.appointments.get(entry[2], {}).get("generation") == entry[3]]
+        return [{
+            "appointment_id": record_id,
+            "due_at": send_at.astimezone(SALON_TIMEZONE).isoformat(),
+            "offset_hours": offset_hours,
+            "attempt": attempt
+        } for send_at, _, record_id, _, offset_hours, attempt in heapq.nsmallest(limit, live)]
+
+reminder_scheduler = ReminderScheduler(REMINDER_OFFSETS_HOURS)
+reminder_task = None
+
+@app.on_event("startup")
+async def start_reminder_scheduler():
+    """Start the appointment reminder loop when enabled and both Airtable and Wassenger are configured"""
+    global reminder_task
+    if not APPOINTMENT_REMINDERS_ENABLED or not airtable or not WASSENGER_API_KEY or not REMINDER_OFFSETS_HOURS:
+        return
+    reminder_task = asyncio.create_task(reminder_scheduler.run())
+
+@app.on_event("shutdown")
+async def stop_reminder_scheduler():
+    """Cancel the appointment reminder loop"""
+    if reminder_task:
+        reminder_task.cancel()
+
+@app.get("/api/reminders")
+async def get_reminders(limit: Optional[int] = None):
+    """Next scheduled appointment reminders and send counters"""
+    return {
+        "enabled": reminder_task is not None and not reminder_task.done(),
+        "offsets_hours": REMINDER_OFFSETS_HOURS,
+        "scheduled_appointments": len(reminder_scheduler.appointments),
+        "upcoming": reminder_scheduler.upcoming(validate_page_limit(limit)),
+        **reminder_scheduler.stats
+    }
+
+class WebhookPipeline:
+    """Bounded queue of validated webhook messages drained by worker tasks that dedup, batch-persist and publish"""
+    
+    def __init__(self, max_queue_size: int, worker_count: int, batch_size: int):
+        self.max_queue_size = max_queue_size
+        self.worker_count = worker_count
+        self.batch_size = batch_size
+        self.queue = None
+        self.workers = []
+        self.recent_ids = OrderedDict()
+        self.processed_per_second = deque()  # [second, messages processed], oldest first, covering the throughput window
+        self.stats = {
+            "received": 0,
+            "duplicates": 0,
+            "rejected_queue_full": 0,
+            "persisted": 0,
+            "published": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed": 0,
+            "last_error": None
+        }
+    
+    def start(self):
+        """Start the worker pool on the running event loop (no-op if already running)"""
+        if self.workers and not all(worker.done() for worker in self.workers):
+            return
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+    
+    async def stop(self):
+        """Let the workers drain the backlog for a bounded time, then cancel them"""
+        if not self.workers:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            print(f"Webhook pipeline stopped with {self.queue.qsize()} messages still queued")
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+    
+    def _seen(self, message_id: str) -> bool:
+        """Remember a message ID in the bounded LRU, returning True if it was already there"""
+        if message_id in self.recent_ids:
+            self.recent_ids.move_to_end(message_id)
+            return True
+        self.recent_ids[message_id] = True
+        if len(self.recent_ids) > WEBHOOK_DEDUP_CACHE_SIZE:
+            self.recent_ids.popitem(last=False)
+        return False
+    
+    def submit(self, message: dict, client: Optional[str], sender_name: str) -> str:
+        """Queue a validated message; returns "queued" or "duplicate", raises 503 when the backlog is full"""
+        self.start()
+        self.stats["received"] += 1
+        if self._seen(message["id"]):
+            self.stats["duplicates"] += 1
+            return "duplicate"
+        try:
+            self.queue.put_nowait((message, client, sender_name))
+        except asyncio.QueueFull:
+            # Forget the ID so Wassenger's retry of this delivery is accepted
+            self.recent_ids.pop(message["id"], None)
+            self.stats["rejected_queue_full"] += 1
+            raise HTTPException(status_code=503, detail="Webhook backlog is full, retry later")
+        return "queued"
+    
+    async def _worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self._process(batch)
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                print(f"Error processing {len(batch)} webhook messages: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+    
+    async def _persist(self, batch):
+        """Store a batch, retrying with backoff; if it still fails, forget its IDs so Wassenger's redelivery is accepted"""
+        for attempt in range(1, WEBHOOK_PERSIST_MAX_ATTEMPTS + 1):
+            try:
+                return await asyncio.to_thread(
+                    message_store.add_new_messages,
+                    [(message, client) for message, client, _ in batch]
+                )
+            except Exception as e:
+                if attempt == WEBHOOK_PERSIST_MAX_ATTEMPTS:
+                    for message, _, _ in batch:
+                        self.recent_ids.pop(message["id"], None)
+                    self.stats["failed"] += len(batch)
+                    raise
+                self.stats["retries"] += 1
+                self.stats["last_error"] = str(e)
+                await asyncio.sleep(WEBHOOK_PERSIST_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    
+    async def _process(self, batch):
+        # Persist before notifying so a page load right after the event already includes it
+        new_entries = await self._persist(batch)
+        self.stats["batches"] += 1
+        self.stats["persisted"] += len(new_entries)
+        self.stats["duplicates"] += len(batch) - len(new_entries)
+        
+        sender_names = {message["id"]: sender_name for message, _, sender_name in batch}
+        for message, _ in new_entries:
+            # Publish real-time update to connected dashboards
+            publish_event(
+                "new-message",
+                {
+                    "conversation_id": message["thread_id"],
+                    "phone": message["phone"] or display_phone(message["thread_id"]),
+                    "message": message["body"],
+                    "sender": "ai" if message["from_me"] else "client",
+                    "sender_name": sender_names[message["id"]],
+                    "time": datetime.now().strftime("%I:%M %p"),
+                    **message_store.thread_state(message["thread_id"]),
+                    **message_store.unread_counts()
+                }
+            )
+            self.stats["published"] += 1
+        
+        self._record_processed(len(batch))
+    
+    def _prune_throughput(self, second: int):
+        while self.processed_per_second and self.processed_per_second[0][0] <= second - WEBHOOK_THROUGHPUT_WINDOW_SECONDS:
+            self.processed_per_second.popleft()
+    
+    def _record_processed(self, count: int):
+        """Add to this second's bucket; the deque never holds more than one window of buckets"""
+        second = int(time.time())
+        self._prune_throughput(second)
+        if self.processed_per_second and self.processed_per_second[-1][0] == second:
+            self.processed_per_second[-1][1] += count
+        else:
+            self.processed_per_second.append([second, count])
+    
+    def metrics(self):
+        self._prune_throughput(int(time.time()))
+        return {
+            **self.stats,
+            "backlog": self.queue.qsize() if self.queue else 0,
+            "workers": sum(1 for worker in self.workers if not worker.done()),
+            "processed_last_minute": sum(count for _, count in self.processed_per_second)
+        }
+
+webhook_pipeline = WebhookPipeline(WEBHOOK_QUEUE_MAX_SIZE, WEBHOOK_WORKER_COUNT, WEBHOOK_BATCH_SIZE)
+
+@app.on_event("startup")
+async def start_webhook_pipeline():
+    """Start the webhook worker pool"""
+    webhook_pipeline.start()
+
+@app.on_event("shutdown")
+async def stop_webhook_pipeline():
+    """Drain queued webhook messages before exiting"""
+    await webhook_pipeline.stop()
+
+@app.post("/api/webhook/wassenger")
+async def wassenger_webhook(request: dict):
+    """Webhook endpoint for receiving messages from Wassenger; validates and queues, processing happens in the background"""
+    # Extract message data (flat phone/message body or Wassenger's event envelope)
+    stored_message = parse_webhook_message(request)
+    if not stored_message:
+        return {"success": True, "ignored": True}
+    
+    data = request.get("data") if isinstance(request.get("data"), dict) else {}
+    chat = data.get("chat") if isinstance(data.get("chat"), dict) else {}
+    sender_name = request.get("sender_name") or chat.get("name") or "Unknown"
+    
+    status = webhook_pipeline.submit(stored_message, chat.get("name") or request.get("sender_name"), sender_name)
+    return {"success": True, status: True}
+
+@app.get("/api/webhook/metrics")
+async def get_webhook_metrics():
+    """Backlog, dedup and throughput counters for the webhook ingestion pipeline"""
+    return webhook_pipeline.metrics()
 
 @app.get("/api/debug-services-field")
 async def debug_services_field():
@@ -1364,282 +3512,734 @@ async def test_analytics():
         raise HTTPException(status_code=500, detail=f"Error in test analytics: {str(e)}")
 
 
-@app.get("/api/analytics")
-async def get_analytics(range: str = "month"):
-    """Get comprehensive analytics data filtered by time period"""
-    if not airtable or not airtable_clients or not airtable_services or not airtable_employees:
-        raise HTTPException(status_code=503, detail="Airtable not configured")
-    
+# Fixed analytics ranges, expressed as days back from today
+ANALYTICS_RANGE_DAYS = {
+    "today": 0,
+    "week": 7,
+    "month": 30,
+    "quarter": 90,
+    "half_year": 180,
+    "year": 365
+}
+
+# Capacity defaults for utilization, used when a service has no duration or an employee has no shift hours
+DEFAULT_SERVICE_DURATION_MINUTES = 60
+EMPLOYEE_SHIFT_START = os.getenv("EMPLOYEE_SHIFT_START", "09:00")
+EMPLOYEE_SHIFT_END = os.getenv("EMPLOYEE_SHIFT_END", "18:00")
+
+def parse_appointment_date(date_str):
+    """Parse an Airtable date string (YYYY-MM-DD or ISO timestamp), returning None if invalid"""
+    if not date_str or not isinstance(date_str, str):
+        return None
     try:
-        # Fetch all real data from Airtable
-        appointments = airtable.get_all()
-        clients = airtable_clients.get_all()
-        services = airtable_services.get_all()
-        employees = airtable_employees.get_all()
+        return datetime.strptime(date_str[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def get_appointment_price(fields) -> float:
+    """Return the appointment's Total Price as a float, treating non-numeric values as 0"""
+    price = fields.get('Total Price', 0)
+    if isinstance(price, (int, float)):
+        return float(price)
+    return 0.0
+
+def resolve_analytics_window(range: str, start: Optional[str] = None, end: Optional[str] = None):
+    """Resolve a named range or explicit start/end query parameters to an inclusive date window"""
+    today = datetime.now().date()
+    
+    if start is None and end is None:
+        days = ANALYTICS_RANGE_DAYS.get(range, ANALYTICS_RANGE_DAYS["month"])
+        return today - timedelta(days=days), today
+    
+    if start is None:
+        raise HTTPException(status_code=400, detail="start is required when end is provided")
+    
+    start_date = parse_appointment_date(start)
+    if not start_date:
+        raise HTTPException(status_code=400, detail=f"Invalid start date: {start} (expected YYYY-MM-DD)")
+    
+    end_date = today
+    if end is not None:
+        end_date = parse_appointment_date(end)
+        if not end_date:
+            raise HTTPException(status_code=400, detail=f"Invalid end date: {end} (expected YYYY-MM-DD)")
+    
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start must be on or before end")
+    
+    return start_date, end_date
+
+class AppointmentIndex:
+    """Appointments sorted by date with prefix sums, so a date window is aggregated without scanning it
+    
+    Totals come from one pair of bisections, per-service and per-employee bookings and revenue
+    from one pair per service or employee, and distinct clients from whichever is smaller: the
+    window's appointments or one bisection per client.
+    """
+    
+    def __init__(self, appointments):
+        dated = []
+        for apt in appointments:
+            appointment_date = parse_appointment_date(apt.get('fields', {}).get('Appointment Date', ''))
+            if appointment_date:
+                dated.append((appointment_date, apt))
+        dated.sort(key=lambda item: item[0])
         
-        # Calculate date range based on selection
-        now = datetime.now()
-        today = now.date()
-        
-        if range == "today":
-            start_date = today
-            end_date = today
-        elif range == "week":
-            start_date = today - timedelta(days=7)
-            end_date = today
-        elif range == "month":
-            start_date = today - timedelta(days=30)
-            end_date = today
-        elif range == "quarter":
-            start_date = today - timedelta(days=90)
-            end_date = today
-        elif range == "half_year":
-            start_date = today - timedelta(days=180)
-            end_date = today
-        elif range == "year":
-            start_date = today - timedelta(days=365)
-            end_date = today
-        else:
-            start_date = today - timedelta(days=30)
-            end_date = today
+        self.dates = [appointment_date for appointment_date, _ in dated]
+        self.appointments = [apt for _, apt in dated]
         
-        # Filter appointments by date range
-        filtered_appointments = []
-        for apt in appointments:
-            fields = apt.get('fields', {})
-            date_str = fields.get('Appointment Date', '')
-            if date_str:
-                try:
-                    appointment_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                    if start_date <= appointment_date <= end_date:
-                        filtered_appointments.append(apt)
-                except:
-                    try:
-                        appointment_date = datetime.strptime(date_str[:10], '%Y-%m-%d').date()
-                        if start_date <= appointment_date <= end_date:
-                            filtered_appointments.append(apt)
-                    except:
-                        pass  # Skip appointments with invalid dates
-        
-        # Process filtered appointments
-        total_appointments = len(filtered_appointments)
-        completed_appointments = 0
-        scheduled_appointments = 0
-        cancelled_appointments = 0
-        total_revenue = 0
-        
-        # Service and employee tracking
-        service_stats = {}
-        employee_stats = {}
-        
-        # Process each filtered appointment
-        for apt in filtered_appointments:
+        # Prefix sums: position i holds the totals of the first i appointments
+        self.completed = [0]
+        self.scheduled = [0]
+        self.cancelled = [0]
+        self.revenue = [0.0]
+        
+        # Per service and per employee record ID: (sorted booking dates, positions in self.appointments,
+        # completed revenue prefix sums)
+        self.service_bookings = {}
+        self.employee_bookings = {}
+        
+        # Sorted appointment dates per client; the first is the client's first visit, and the first
+        # visits are also kept sorted so new clients in a window are counted by bisection
+        self.client_dates = {}
+        
+        for position, (appointment_date, apt) in enumerate(dated):
             fields = apt.get('fields', {})
             status = fields.get('Appointment Status', '')
-            price = fields.get('Total Price', 0)
+            is_completed = status == 'Completed'
+            price = get_appointment_price(fields) if is_completed else 0.0
             
-            # Convert price to float if it's a valid number
-            if isinstance(price, (int, float)):
-                price = float(price)
-            else:
-                price = 0
+            self.completed.append(self.completed[-1] + (1 if is_completed else 0))
+            self.scheduled.append(self.scheduled[-1] + (1 if status == 'Scheduled' else 0))
+            self.cancelled.append(self.cancelled[-1] + (1 if status == 'Cancelled' else 0))
+            self.revenue.append(self.revenue[-1] + price)
             
-            # Count by status
-            if status == 'Completed':
-                completed_appointments += 1
-                total_revenue += price
-            elif status == 'Scheduled':
-                scheduled_appointments += 1
-            elif status == 'Cancelled':
-                cancelled_appointments += 1
+            for table, linked_field in ((self.service_bookings, 'Services'), (self.employee_bookings, 'Stylist')):
+                linked_ids = fields.get(linked_field, [])
+                if isinstance(linked_ids, list):
+                    for linked_id in linked_ids:
+                        dates, positions, revenue = table.setdefault(linked_id, ([], [], [0.0]))
+                        dates.append(appointment_date)
+                        positions.append(position)
+                        revenue.append(revenue[-1] + price)
             
-            # Process services (real data)
-            service_ids = fields.get('Services', [])
-            if isinstance(service_ids, list) and len(service_ids) > 0:
-                for service_id in service_ids:
-                    # Get real service name
-                    service_name = "Unknown Service"
-                    try:
-                        service_record = next((s for s in services if s['id'] == service_id), None)
-                        if service_record:
-                            service_fields = service_record.get('fields', {})
-                            service_name = service_fields.get('Service Name') or service_fields.get('Name', f"Service {service_id[-4:]}")
-                    except Exception as e:
-                        service_name = f"Service {service_id[-4:]}"
-                    
-                    if service_name not in service_stats:
-                        service_stats[service_name] = {'bookings': 0, 'revenue': 0, 'growth': 0}
-                    
-                    service_stats[service_name]['bookings'] += 1
-                    if status == 'Completed':
-                        service_stats[service_name]['revenue'] += price
-            
-            # Process employees (real data)
-            employee_ids = fields.get('Stylist', [])
-            if isinstance(employee_ids, list) and len(employee_ids) > 0:
-                for employee_id in employee_ids:
-                    # Get real employee name
-                    employee_name = "Unknown Employee"
-                    try:
-                        employee_record = next((e for e in employees if e['id'] == employee_id), None)
-                        if employee_record:
-                            employee_fields = employee_record.get('fields', {})
-                            employee_name = (employee_fields.get('Full Name') or 
-                                           f"{employee_fields.get('First Name', '')} {employee_fields.get('Last Name', '')}".strip() or
-                                           f"Employee {employee_id[-4:]}")
-                    except Exception as e:
-                        employee_name = f"Employee {employee_id[-4:]}"
-                    
-                    if employee_name not in employee_stats:
-                        employee_stats[employee_name] = {'appointments': 0, 'revenue': 0, 'utilization': 0}
-                    
-                    employee_stats[employee_name]['appointments'] += 1
-                    if status == 'Completed':
-                        employee_stats[employee_name]['revenue'] += price
-        
-        # Calculate utilization for employees
-        for employee_name, stats in employee_stats.items():
-            stats['utilization'] = min(stats['appointments'] * 15, 100)
-        
-        # Calculate service growth (simplified)
-        for service_name, stats in service_stats.items():
-            stats['growth'] = (stats['bookings'] - 2) / 2 * 100 if stats['bookings'] > 2 else 0
-        
-        # Calculate metrics
-        completion_rate = (completed_appointments / total_appointments * 100) if total_appointments > 0 else 0
-        cancellation_rate = (cancelled_appointments / total_appointments * 100) if total_appointments > 0 else 0
-        avg_appointment_value = total_revenue / completed_appointments if completed_appointments > 0 else 0
-        
-        # Calculate REAL client metrics based on appointments
-        client_appointments = {}  # Track appointments per client (client_name -> list of dates)
-        first_appointment_dates = {}  # Track first appointment date per client (client_name -> date)
-        
-        # Process ALL appointments to build client history
-        all_appointments = airtable.get_all()  # Get all appointments for client analysis
-        
-        for apt in all_appointments:
-            fields = apt.get('fields', {})
             client_ids = fields.get('Client Name', [])
-            date_str = fields.get('Appointment Date', '')
+            if isinstance(client_ids, list) and len(client_ids) > 0:
+                # Appointments are visited in date order, so each client's list is already sorted
+                self.client_dates.setdefault(client_ids[0], []).append(appointment_date)
+        
+        self.sorted_first_visits = sorted(dates[0] for dates in self.client_dates.values())
+    
+    def bounds(self, start_date, end_date):
+        """Return the [lo, hi) slice of appointments dated within the inclusive window"""
+        return bisect_left(self.dates, start_date), bisect_right(self.dates, end_date)
+    
+    def window(self, start_date, end_date):
+        """Return the appointments dated within the inclusive window"""
+        lo, hi = self.bounds(start_date, end_date)
+        return self.appointments[lo:hi]
+    
+    def totals(self, start_date, end_date):
+        """Aggregate appointment counts and completed revenue for the window from the prefix sums"""
+        lo, hi = self.bounds(start_date, end_date)
+        return {
+            "total": hi - lo,
+            "completed": self.completed[hi] - self.completed[lo],
+            "scheduled": self.scheduled[hi] - self.scheduled[lo],
+            "cancelled": self.cancelled[hi] - self.cancelled[lo],
+            "revenue": self.revenue[hi] - self.revenue[lo]
+        }
+    
+    def new_client_count(self, start_date, end_date):
+        """Count clients whose first ever appointment falls within the window"""
+        return bisect_right(self.sorted_first_visits, end_date) - bisect_left(self.sorted_first_visits, start_date)
+    
+    def client_count(self, start_date, end_date):
+        """Count distinct clients with an appointment in the window"""
+        lo, hi = self.bounds(start_date, end_date)
+        if hi - lo <= len(self.client_dates):
+            clients = set()
+            for apt in self.appointments[lo:hi]:
+                client_ids = apt.get('fields', {}).get('Client Name', [])
+                if isinstance(client_ids, list) and len(client_ids) > 0:
+                    clients.add(client_ids[0])
+            return len(clients)
+        count = 0
+        for dates in self.client_dates.values():
+            position = bisect_left(dates, start_date)
+            if position < len(dates) and dates[position] <= end_date:
+                count += 1
+        return count
+    
+    def _linked_totals(self, table, start_date, end_date):
+        """{record ID: (bookings, completed revenue)} within the window, for IDs with at least one booking,
+        ordered by each ID's first booking in the window"""
+        found = []
+        for linked_id, (dates, positions, revenue) in table.items():
+            lo, hi = bisect_left(dates, start_date), bisect_right(dates, end_date)
+            if hi > lo:
+                found.append((positions[lo], linked_id, hi - lo, revenue[hi] - revenue[lo]))
+        found.sort()
+        return {linked_id: (bookings, revenue) for _, linked_id, bookings, revenue in found}
+    
+    def service_totals(self, start_date, end_date):
+        return self._linked_totals(self.service_bookings, start_date, end_date)
+    
+    def employee_totals(self, start_date, end_date):
+        return self._linked_totals(self.employee_bookings, start_date, end_date)
+
+def month_ordinal(value) -> int:
+    """Number a calendar month so that consecutive months differ by one"""
+    return value.year * 12 + value.month - 1
+
+def month_label(ordinal: int) -> str:
+    """Format a month ordinal as YYYY-MM"""
+    return f"{ordinal // 12:04d}-{ordinal % 12 + 1:02d}"
+
+class ClientVisitIndex:
+    """Per-client visit months with cohort totals, updated incrementally as appointment rows arrive"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.appointment_visits = {}  # appointment record ID -> (client_id, month ordinal)
+        self.client_months = {}  # client_id -> {month ordinal: visit count}
+        self.cohort_activity = {}  # cohort month -> {months since first visit: active clients}
+    
+    def _retract(self, client_id):
+        """Remove a client's contribution to the cohort totals"""
+        months = self.client_months.get(client_id)
+        if not months:
+            return
+        cohort = min(months)
+        activity = self.cohort_activity[cohort]
+        for month in months:
+            offset = month - cohort
+            activity[offset] -= 1
+            if activity[offset] == 0:
+                del activity[offset]
+        if not activity:
+            del self.cohort_activity[cohort]
+    
+    def _contribute(self, client_id):
+        """Add a client's distinct visit months to the cohort totals"""
+        months = self.client_months.get(client_id)
+        if not months:
+            return
+        cohort = min(months)
+        activity = self.cohort_activity.setdefault(cohort, {})
+        for month in months:
+            offset = month - cohort
+            activity[offset] = activity.get(offset, 0) + 1
+    
+    def _change_visit(self, client_id, month, delta):
+        """Adjust a client's visit count for one month, keeping the cohort totals consistent"""
+        self._retract(client_id)
+        months = self.client_months.setdefault(client_id, {})
+        months[month] = months.get(month, 0) + delta
+        if months[month] <= 0:
+            del months[month]
+        if not months:
+            del self.client_months[client_id]
+        self._contribute(client_id)
+    
+    def _remove_locked(self, record_id):
+        visit = self.appointment_visits.pop(record_id, None)
+        if visit:
+            self._change_visit(visit[0], visit[1], -1)
+    
+    def upsert(self, record):
+        """Index (or re-index) an appointment row; cancelled or undated rows are not visits"""
+        fields = record.get('fields', {})
+        client_ids = fields.get('Client Name', [])
+        appointment_date = parse_appointment_date(fields.get('Appointment Date', ''))
+        is_visit = (
+            isinstance(client_ids, list) and len(client_ids) > 0
+            and appointment_date is not None
+            and fields.get('Appointment Status', '') != 'Cancelled'
+        )
+        
+        with self.lock:
+            self._remove_locked(record['id'])
+            if is_visit:
+                visit = (client_ids[0], month_ordinal(appointment_date))
+                self.appointment_visits[record['id']] = visit
+                self._change_visit(visit[0], visit[1], 1)
+    
+    def remove(self, record_id):
+        """Drop a deleted appointment row from the index"""
+        with self.lock:
+            self._remove_locked(record_id)
+    
+    def cohort_matrix(self, months: int, current_month: int):
+        """Return retention rows for the last `months` cohorts, up to the current month"""
+        first_cohort = current_month - months + 1
+        
+        with self.lock:
+            cohorts = sorted(cohort for cohort in self.cohort_activity if first_cohort <= cohort <= current_month)
+            rows = []
+            for cohort in cohorts:
+                activity = self.cohort_activity[cohort]
+                size = activity.get(0, 0)
+                active = [activity.get(offset, 0) for offset in range(current_month - cohort + 1)]
+                rows.append({
+                    "cohort": month_label(cohort),
+                    "size": size,
+                    "active": active,
+                    "retention": [count / size * 100 if size > 0 else 0 for count in active]
+                })
+        
+        return rows
+
+client_visit_index = ClientVisitIndex()
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+def parse_clock_minutes(value):
+    """Parse a time of day such as '09:00' or '10:30 AM' into minutes after midnight"""
+    if not value or not isinstance(value, str):
+        return None
+    for time_format in ('%H:%M', '%I:%M %p', '%I %p'):
+        try:
+            parsed = datetime.strptime(value.strip().upper(), time_format)
+            return parsed.hour * 60 + parsed.minute
+        except ValueError:
+            continue
+    return None
+
+def count_weekdays(start_date, end_date):
+    """Count how many times each weekday (Monday=0) occurs in an inclusive date window"""
+    total_days = (end_date - start_date).days + 1
+    counts = [total_days // 7] * 7
+    for offset in range(total_days % 7):
+        counts[(start_date.weekday() + offset) % 7] += 1
+    return counts
+
+class EmployeeCapacityIndex:
+    """Booked minutes per employee per day (prefix sums) and available minutes per weekday from shifts"""
+    
+    def __init__(self, appointments, services, employees):
+        durations = {}
+        for service in services:
+            duration = service.get('fields', {}).get('Duration (minutes)', DEFAULT_SERVICE_DURATION_MINUTES)
+            durations[service['id']] = duration if isinstance(duration, (int, float)) else DEFAULT_SERVICE_DURATION_MINUTES
+        
+        # Available minutes for each weekday, from the employee's Availability days and shift hours
+        self.weekday_minutes = {}
+        for employee in employees:
+            fields = employee.get('fields', {})
+            # A shift starting at 00:00 is 0 minutes, so only a missing or unreadable time falls back to the default
+            shift_start = parse_clock_minutes(fields.get('Shift Start'))
+            if shift_start is None:
+                shift_start = parse_clock_minutes(EMPLOYEE_SHIFT_START)
+            shift_end = parse_clock_minutes(fields.get('Shift End'))
+            if shift_end is None:
+                shift_end = parse_clock_minutes(EMPLOYEE_SHIFT_END)
+            shift_minutes = max((shift_end or 0) - (shift_start or 0), 0)
             
-            if isinstance(client_ids, list) and len(client_ids) > 0 and date_str:
-                client_id = client_ids[0]  # Use first client ID
-                try:
-                    appointment_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                except:
-                    try:
-                        appointment_date = datetime.strptime(date_str[:10], '%Y-%m-%d').date()
-                    except:
-                        continue
-                
-                # Track all appointments per client
-                if client_id not in client_appointments:
-                    client_appointments[client_id] = []
-                client_appointments[client_id].append(appointment_date)
-                
-                # Track first appointment date
-                if client_id not in first_appointment_dates:
-                    first_appointment_dates[client_id] = appointment_date
-                else:
-                    if appointment_date < first_appointment_dates[client_id]:
-                        first_appointment_dates[client_id] = appointment_date
-        
-        # Calculate new clients in the selected period
-        new_clients_in_period = 0
-        returning_clients_in_period = 0
-        
-        for client_id, first_date in first_appointment_dates.items():
-            if start_date <= first_date <= end_date:
-                new_clients_in_period += 1
-            elif first_date < start_date:
-                # Check if this existing client had appointments in the period
-                client_dates = client_appointments.get(client_id, [])
-                has_appointment_in_period = any(start_date <= date <= end_date for date in client_dates)
-                if has_appointment_in_period:
-                    returning_clients_in_period += 1
-        
-        # Calculate retention rate (returning clients / total clients with appointments in period)
-        total_clients_in_period = new_clients_in_period + returning_clients_in_period
-        retention_rate = (returning_clients_in_period / total_clients_in_period * 100) if total_clients_in_period > 0 else 0
-        
-        # Calculate REAL revenue growth by comparing with previous period
-        previous_period_start = start_date - (end_date - start_date + timedelta(days=1))
-        previous_period_end = start_date - timedelta(days=1)
-        
-        previous_revenue = 0
-        for apt in all_appointments:
+            availability = fields.get('Availability', [])
+            if isinstance(availability, str):
+                availability = [availability]
+            available_days = {day.strip().lower() for day in availability if isinstance(day, str)}
+            self.weekday_minutes[employee['id']] = [
+                shift_minutes if weekday in available_days else 0 for weekday in WEEKDAYS
+            ]
+        
+        # Booked minutes per employee per day, from the durations of each non-cancelled appointment's services
+        booked_by_day = {}
+        for apt in appointments:
             fields = apt.get('fields', {})
-            date_str = fields.get('Appointment Date', '')
-            status = fields.get('Appointment Status', '')
+            if fields.get('Appointment Status', '') == 'Cancelled':
+                continue
+            appointment_date = parse_appointment_date(fields.get('Appointment Date', ''))
+            employee_ids = fields.get('Stylist', [])
+            if not appointment_date or not isinstance(employee_ids, list):
+                continue
             
-            if status == 'Completed' and date_str:
-                try:
-                    appointment_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                except:
-                    try:
-                        appointment_date = datetime.strptime(date_str[:10], '%Y-%m-%d').date()
-                    except:
-                        continue
-                
-                if previous_period_start <= appointment_date <= previous_period_end:
-                    price = fields.get('Total Price', 0)
-                    if isinstance(price, (int, float)):
-                        previous_revenue += float(price)
-        
-        # Calculate real revenue growth
-        revenue_growth = 0
-        if previous_revenue > 0:
-            revenue_growth = ((total_revenue - previous_revenue) / previous_revenue * 100)
-        elif total_revenue > 0:
-            revenue_growth = 100  # 100% growth from 0
-        
-        # Format response with filtered data
-        analytics_data = {
-            "revenue": {
-                "total": total_revenue,
-                "growth": revenue_growth,
-                "avg_appointment_value": avg_appointment_value
-            },
-            "appointments": {
-                "total": total_appointments,
-                "completed": completed_appointments,
-                "cancelled": cancelled_appointments,
-                "scheduled": scheduled_appointments,
-                "completion_rate": completion_rate,
-                "cancellation_rate": cancellation_rate
-            },
-            "clients": {
-                "total": total_clients_in_period,
-                "new_in_period": new_clients_in_period,
-                "returning": returning_clients_in_period,
-                "retention_rate": retention_rate
-            },
-            "services": sorted([
-                {
-                    "name": name,
-                    "bookings": stats['bookings'],
-                    "revenue": stats['revenue'],
-                    "growth": stats['growth']
-                }
-                for name, stats in service_stats.items()
-            ], key=lambda x: x['revenue'], reverse=True)[:10],
-            "employees": sorted([
-                {
-                    "name": name,
-                    "appointments": stats['appointments'],
-                    "revenue": stats['revenue'],
-                    "utilization": stats['utilization']
-                }
-                for name, stats in employee_stats.items()
-            ], key=lambda x: x['revenue'], reverse=True)[:10],
-            "trends": []  # Can be populated with daily trends if needed
+            service_ids = fields.get('Services', [])
+            if isinstance(service_ids, list) and len(service_ids) > 0:
+                minutes = sum(durations.get(service_id, DEFAULT_SERVICE_DURATION_MINUTES) for service_id in service_ids)
+            else:
+                minutes = DEFAULT_SERVICE_DURATION_MINUTES
+            
+            for employee_id in employee_ids:
+                days = booked_by_day.setdefault(employee_id, {})
+                days[appointment_date] = days.get(appointment_date, 0) + minutes
+        
+        self.booked_days = {}
+        self.booked_prefix = {}
+        for employee_id, days in booked_by_day.items():
+            sorted_days = sorted(days)
+            prefix = [0]
+            for day in sorted_days:
+                prefix.append(prefix[-1] + days[day])
+            self.booked_days[employee_id] = sorted_days
+            self.booked_prefix[employee_id] = prefix
+    
+    def booked_minutes(self, employee_id, start_date, end_date):
+        """Booked minutes for the employee within the inclusive window"""
+        days = self.booked_days.get(employee_id)
+        if not days:
+            return 0
+        prefix = self.booked_prefix[employee_id]
+        return prefix[bisect_right(days, end_date)] - prefix[bisect_left(days, start_date)]
+    
+    def available_minutes(self, employee_id, start_date, end_date):
+        """Shift minutes the employee is available within the inclusive window"""
+        weekday_minutes = self.weekday_minutes.get(employee_id)
+        if not weekday_minutes:
+            return 0
+        weekday_counts = count_weekdays(start_date, end_date)
+        return sum(minutes * count for minutes, count in zip(weekday_minutes, weekday_counts))
+
+def build_analytics(dataset, start_date, end_date):
+    """Compute the analytics payload for an inclusive date window"""
+    appointment_index = dataset["appointment_index"]
+    capacity_index = dataset["capacity_index"]
+    totals = appointment_index.totals(start_date, end_date)
+    total_appointments = totals["total"]
+    completed_appointments = totals["completed"]
+    scheduled_appointments = totals["scheduled"]
+    cancelled_appointments = totals["cancelled"]
+    total_revenue = totals["revenue"]
+    
+    services_by_id = {service['id']: service for service in dataset["services"]}
+    employees_by_id = {employee['id']: employee for employee in dataset["employees"]}
+    
+    # Service and employee tracking, from the index's per-record prefix sums (merged by display name)
+    service_stats = {}
+    employee_stats = {}
+    
+    for service_id, (bookings, revenue) in appointment_index.service_totals(start_date, end_date).items():
+        # Get real service name
+        service_name = "Unknown Service"
+        service_record = services_by_id.get(service_id)
+        if service_record:
+            service_fields = service_record.get('fields', {})
+            service_name = service_fields.get('Service Name') or service_fields.get('Name', f"Service {service_id[-4:]}")
+        
+        if service_name not in service_stats:
+            service_stats[service_name] = {'bookings': 0, 'revenue': 0, 'growth': 0}
+        
+        service_stats[service_name]['bookings'] += bookings
+        if revenue:
+            service_stats[service_name]['revenue'] += revenue
+    
+    for employee_id, (appointments, revenue) in appointment_index.employee_totals(start_date, end_date).items():
+        # Get real employee name
+        employee_name = "Unknown Employee"
+        employee_record = employees_by_id.get(employee_id)
+        if employee_record:
+            employee_fields = employee_record.get('fields', {})
+            employee_name = (employee_fields.get('Full Name') or 
+                           f"{employee_fields.get('First Name', '')} {employee_fields.get('Last Name', '')}".strip() or
+                           f"Employee {employee_id[-4:]}")
+        
+        if employee_name not in employee_stats:
+            employee_stats[employee_name] = {'appointments': 0, 'revenue': 0, 'utilization': 0, 'employee_ids': set()}
+        
+        employee_stats[employee_name]['employee_ids'].add(employee_id)
+        employee_stats[employee_name]['appointments'] += appointments
+        if revenue:
+            employee_stats[employee_name]['revenue'] += revenue
+    
+    # Calculate utilization for employees as booked minutes over available shift minutes
+    for employee_name, stats in employee_stats.items():
+        stats['booked_minutes'] = sum(
+            capacity_index.booked_minutes(employee_id, start_date, end_date) for employee_id in stats['employee_ids']
+        )
+        stats['available_minutes'] = sum(
+            capacity_index.available_minutes(employee_id, start_date, end_date) for employee_id in stats['employee_ids']
+        )
+        if stats['available_minutes'] > 0:
+            stats['utilization'] = round(stats['booked_minutes'] / stats['available_minutes'] * 100, 1)
+    
+    # Calculate service growth (simplified)
+    for service_name, stats in service_stats.items():
+        stats['growth'] = (stats['bookings'] - 2) / 2 * 100 if stats['bookings'] > 2 else 0
+    
+    # Calculate metrics
+    completion_rate = (completed_appointments / total_appointments * 100) if total_appointments > 0 else 0
+    cancellation_rate = (cancelled_appointments / total_appointments * 100) if total_appointments > 0 else 0
+    avg_appointment_value = total_revenue / completed_appointments if completed_appointments > 0 else 0
+    
+    # New clients had their first ever appointment in the window; everyone else seen in it is returning
+    new_clients_in_period = appointment_index.new_client_count(start_date, end_date)
+    returning_clients_in_period = appointment_index.client_count(start_date, end_date) - new_clients_in_period
+    
+    # Calculate retention rate (returning clients / total clients with appointments in period)
+    total_clients_in_period = new_clients_in_period + returning_clients_in_period
+    retention_rate = (returning_clients_in_period / total_clients_in_period * 100) if total_clients_in_period > 0 else 0
+    
+    # Calculate REAL revenue growth by comparing with the preceding window of the same length
+    previous_period_start = start_date - (end_date - start_date + timedelta(days=1))
+    previous_period_end = start_date - timedelta(days=1)
+    previous_revenue = appointment_index.totals(previous_period_start, previous_period_end)["revenue"]
+    
+    # Calculate real revenue growth
+    revenue_growth = 0
+    if previous_revenue > 0:
+        revenue_growth = ((total_revenue - previous_revenue) / previous_revenue * 100)
+    elif total_revenue > 0:
+        revenue_growth = 100  # 100% growth from 0
+    
+    # Format response with filtered data
+    return {
+        "period": {
+            "start": start_date.isoformat(),
+            "end": end_date.isoformat()
+        },
+        "revenue": {
+            "total": total_revenue,
+            "growth": revenue_growth,
+            "avg_appointment_value": avg_appointment_value
+        },
+        "appointments": {
+            "total": total_appointments,
+            "completed": completed_appointments,
+            "cancelled": cancelled_appointments,
+            "scheduled": scheduled_appointments,
+            "completion_rate": completion_rate,
+            "cancellation_rate": cancellation_rate
+        },
+        "clients": {
+            "total": total_clients_in_period,
+            "new_in_period": new_clients_in_period,
+            "returning": returning_clients_in_period,
+            "retention_rate": retention_rate
+        },
+        "services": sorted([
+            {
+                "name": name,
+                "bookings": stats['bookings'],
+                "revenue": stats['revenue'],
+                "growth": stats['growth']
+            }
+            for name, stats in service_stats.items()
+        ], key=lambda x: x['revenue'], reverse=True)[:10],
+        "employees": sorted([
+            {
+                "name": name,
+                "appointments": stats['appointments'],
+                "revenue": stats['revenue'],
+                "utilization": stats['utilization'],
+                "booked_minutes": stats['booked_minutes'],
+                "available_minutes": stats['available_minutes']
+            }
+            for name, stats in employee_stats.items()
+        ], key=lambda x: x['revenue'], reverse=True)[:10],
+        "trends": []  # Can be populated with daily trends if needed
+    }
+
+def fingerprint_rows(rows):
+    """Map record IDs to a stable serialization of their fields, for change detection between syncs"""
+    return {row['id']: json.dumps(row.get('fields', {}), sort_keys=True, default=str) for row in rows}
+
+def sync_analytics_dataset():
+    """Fetch the analytics tables from Airtable, bumping the data version if any rows changed upstream
+    
+    Only one sync runs at a time; callers that waited for another sync reuse its result when it is
+    current. The dataset is stamped with the version read before fetching, so a write that lands
+    during the fetch leaves it out of date rather than passing it off as current.
+    """
+    with analytics_sync_lock:
+        dataset = current_analytics_dataset()
+        if dataset is not None:
+            return dataset
+        return _sync_analytics_dataset()
+
+def _sync_analytics_dataset():
+    global analytics_dataset
+    
+    with analytics_lock:
+        start_version = analytics_data_version
+    
+    appointments = airtable.get_all()
+    services = airtable_services.get_all()
+    employees = airtable_employees.get_all()
+    
+    fingerprints = {
+        "appointments": fingerprint_rows(appointments),
+        "services": fingerprint_rows(services),
+        "employees": fingerprint_rows(employees)
+    }
+    
+    with analytics_lock:
+        previous = analytics_dataset
+        changed_upstream = (
+            previous is not None
+            and previous["version"] == start_version
+            and previous["fingerprints"] != fingerprints
+        )
+    
+    # Apply only the appointment rows that changed since the last sync to the client visit index
+    previous_rows = previous["fingerprints"]["appointments"] if previous else {}
+    current_rows = fingerprints["appointments"]
+    for apt in appointments:
+        if previous_rows.get(apt['id']) != current_rows[apt['id']]:
+            client_visit_index.upsert(apt)
+            client_appointment_index.upsert(apt)
+            reminder_scheduler.upsert(apt)
+    for record_id in previous_rows.keys() - current_rows.keys():
+        client_visit_index.remove(record_id)
+        client_appointment_index.remove(record_id)
+        reminder_scheduler.remove(record_id)
+    client_appointment_index.mark_synced()
+    
+    version = start_version
+    if changed_upstream:
+        # Rows changed in Airtable without going through this API's write endpoints
+        bumped = bump_data_version("sync brought in changed rows")
+        # The fetched rows include the upstream change, but not any write that bumped the version meanwhile
+        if bumped == start_version + 1:
+            version = bumped
+    
+    with analytics_lock:
+        analytics_dataset = {
+            "version": version,
+            "synced_at": time.time(),
+            "fingerprints": fingerprints,
+            "appointment_index": AppointmentIndex(appointments),
+            "capacity_index": EmployeeCapacityIndex(appointments, services, employees),
+            "services": services,
+            "employees": employees
         }
+        return analytics_dataset
+
+def current_analytics_dataset():
+    """The analytics dataset if it matches the data version and is within the sync interval, else None"""
+    with analytics_lock:
+        dataset = analytics_dataset
+        if (dataset is not None
+                and dataset["version"] == analytics_data_version
+                and time.time() - dataset["synced_at"] < ANALYTICS_SYNC_INTERVAL_SECONDS):
+            return dataset
+    return None
+
+def get_analytics_dataset():
+    """Return the current analytics dataset, syncing only after a write or once the sync interval has passed"""
+    return current_analytics_dataset() or sync_analytics_dataset()
+
+def compute_analytics(start_date, end_date):
+    """Return the cache entry for a window, computing it if the data version has moved on"""
+    dataset = get_analytics_dataset()
+    
+    # Serve repeat views of the same window from memory until the data version changes
+    cache_key = (start_date, end_date)
+    with analytics_lock:
+        cached = analytics_cache.get(cache_key)
+    if cached and cached["version"] == dataset["version"]:
+        return cached
+    
+    entry = {
+        "version": dataset["version"],
+        "window": cache_key,
+        "computed_at": datetime.now().isoformat(),
+        "data": build_analytics(dataset, start_date, end_date)
+    }
+    
+    with analytics_lock:
+        if dataset["version"] == analytics_data_version:
+            analytics_cache[cache_key] = entry
+    
+    return entry
+
+def precompute_standard_analytics():
+    """Recompute every named analytics range and store the results for GET /api/analytics"""
+    for range_name in ANALYTICS_RANGE_DAYS:
+        start_date, end_date = resolve_analytics_window(range_name)
+        entry = compute_analytics(start_date, end_date)
+        with analytics_lock:
+            precomputed_analytics[range_name] = entry
+
+async def analytics_precompute_loop():
+    """Precompute the standard ranges every ANALYTICS_PRECOMPUTE_INTERVAL_SECONDS, or sooner after a data change"""
+    while True:
+        analytics_refresh_event.clear()
+        try:
+            await asyncio.to_thread(precompute_standard_analytics)
+            print(f"Precomputed analytics for {len(ANALYTICS_RANGE_DAYS)} ranges (data version {analytics_data_version})")
+        except Exception as e:
+            print(f"Error precomputing analytics: {e}")
         
-        return analytics_data
+        try:
+            await asyncio.wait_for(analytics_refresh_event.wait(), timeout=ANALYTICS_PRECOMPUTE_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+@app.on_event("startup")
+async def start_analytics_scheduler():
+    """Start the background analytics precompute loop when Airtable is configured"""
+    global analytics_scheduler_loop, analytics_refresh_event, analytics_scheduler_task
+    if not airtable or not airtable_services or not airtable_employees or ANALYTICS_PRECOMPUTE_INTERVAL_SECONDS <= 0:
+        return
+    
+    analytics_scheduler_loop = asyncio.get_running_loop()
+    analytics_refresh_event = asyncio.Event()
+    # The first sync indexes every appointment, so the client index needs no separate load
+    client_appointment_index.defer_load()
+    analytics_scheduler_task = asyncio.create_task(analytics_precompute_loop())
+
+@app.on_event("shutdown")
+async def stop_analytics_scheduler():
+    """Cancel the background analytics precompute loop"""
+    if analytics_scheduler_task:
+        analytics_scheduler_task.cancel()
+
+@app.get("/api/analytics")
+async def get_analytics(range: str = "month", start: Optional[str] = None, end: Optional[str] = None):
+    """Get comprehensive analytics data for a named range or a custom start/end window (YYYY-MM-DD)"""
+    if not airtable or not airtable_clients or not airtable_services or not airtable_employees:
+        raise HTTPException(status_code=503, detail="Airtable not configured")
+    
+    start_date, end_date = resolve_analytics_window(range, start, end)
+    
+    try:
+        entry = None
+        if start is None and end is None:
+            # Named ranges are served from the scheduler's results while they cover today's window;
+            # after a write they are flagged stale until the woken scheduler recomputes them
+            range_name = range if range in ANALYTICS_RANGE_DAYS else "month"
+            with analytics_lock:
+                precomputed = precomputed_analytics.get(range_name)
+            if precomputed and precomputed["window"] == (start_date, end_date):
+                entry = precomputed
+        
+        if entry is None:
+            # Any sync this needs is shared with the scheduler and other requests (analytics_sync_lock)
+            entry = await asyncio.to_thread(compute_analytics, start_date, end_date)
+        
+        return {
+            **entry["data"],
+            "computed_at": entry["computed_at"],
+            "stale": entry["version"] != analytics_data_version
+        }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
 
+@app.get("/api/analytics/cohorts")
+async def get_analytics_cohorts(months: int = 12):
+    """Get a monthly cohort retention matrix: clients grouped by first-visit month, by months since that visit"""
+    if not airtable or not airtable_clients or not airtable_services or not airtable_employees:
+        raise HTTPException(status_code=503, detail="Airtable not configured")
+    
+    if months < 1 or months > 120:
+        raise HTTPException(status_code=400, detail="months must be between 1 and 120")
+    
+    try:
+        # A sync, if one is due, is shared with the analytics scheduler and other requests
+        dataset = await asyncio.to_thread(get_analytics_dataset)
+        current_month = month_ordinal(datetime.now().date())
+        
+        return {
+            "months": months,
+            "data_version": dataset["version"],
+            "cohorts": client_visit_index.cohort_matrix(months, current_month)
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching cohorts: {str(e)}")
+
 
 @app.get("/api/services-with-duration")
 async def get_services_with_duration():
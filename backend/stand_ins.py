@@ -0,0 +1,982 @@
+"""Local stand-ins for the Wassenger, Pusher and Airtable HTTP APIs used by server.py
+
+Runs one FastAPI app that answers the Wassenger routes under /v1, Pusher's
+trigger routes under /apps and the Airtable REST API under /v0, so the
+conversation, messaging, appointment and analytics paths can be exercised and
+load-tested without network access or real credentials.
+
+    python stand_ins.py --port 8100 --chats 500 --messages-per-chat 40 --latency-ms 80 --error-rate 0.02
+    python stand_ins.py --port 8100 --appointments 100000 --airtable-rate-limit 5
+
+Point the backend at it with:
+
+    WASSENGER_BASE_URL=http://127.0.0.1:8100/v1 WASSENGER_API_KEY=stand-in
+    PUSHER_HOST=127.0.0.1 PUSHER_PORT=8100 PUSHER_SSL=false
+    AIRTABLE_API_URL=http://127.0.0.1:8100/v0 AIRTABLE_API_KEY=stand-in AIRTABLE_BASE_ID=appStandIn
+
+Generated clients share their phone numbers with the generated WhatsApp chats
+(client N is chat N), so conversations link to clients and their bookings.
+
+Airtable enforces 5 requests per second per base by default and, like the real
+API, refuses everything for 30 seconds once that is exceeded; the stand-in does
+the same unless --airtable-rate-limit 0 is given.
+
+Latency, error rate and data volume can also be changed while running with
+POST /_stand-in/config, and GET /_stand-in/stats reports how many calls each
+route received (used by the benchmark suite to count upstream calls).
+"""
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+from collections import Counter, deque, OrderedDict
+import argparse
+import asyncio
+import hashlib
+import hmac
+import os
+import random
+import re
+import string
+import threading
+import time
+import uuid
+
+import httpx
+
+def env_float(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+# Defaults for the generated data set and injected faults; all can be overridden on the command line
+config = {
+    "seed": int(os.getenv("STAND_IN_SEED", "42")),
+    "latency_ms": env_float("STAND_IN_LATENCY_MS", "0"),
+    "jitter_ms": env_float("STAND_IN_JITTER_MS", "0"),
+    "error_rate": env_float("STAND_IN_ERROR_RATE", "0"),
+    "rate_limit_share": env_float("STAND_IN_RATE_LIMIT_SHARE", "0.25"),
+    "chats": int(os.getenv("STAND_IN_CHATS", "50")),
+    "groups": int(os.getenv("STAND_IN_GROUPS", "5")),
+    "messages_per_chat": int(os.getenv("STAND_IN_MESSAGES_PER_CHAT", "20")),
+    "device_id": os.getenv("STAND_IN_DEVICE_ID", "stand-in-device"),
+    "wassenger_api_key": os.getenv("STAND_IN_WASSENGER_API_KEY", ""),
+    "pusher_app_id": os.getenv("PUSHER_APP_ID", "2017288"),
+    "pusher_key": os.getenv("PUSHER_APP_KEY", "f1f929da8fd632930b80"),
+    "pusher_secret": os.getenv("PUSHER_SECRET", "6f33f8791db91b6568df"),
+    "verify_pusher_signatures": os.getenv("STAND_IN_VERIFY_PUSHER", "true").lower() == "true",
+    "webhook_url": os.getenv("STAND_IN_WEBHOOK_URL", ""),
+    "inbound_per_second": env_float("STAND_IN_INBOUND_PER_SECOND", "0"),
+    "appointments": int(os.getenv("STAND_IN_APPOINTMENTS", "1000")),
+    "clients": int(os.getenv("STAND_IN_CLIENTS", "0")),  # 0: one client per 20 appointments (at least 50)
+    "services": int(os.getenv("STAND_IN_SERVICES", "30")),
+    "employees": int(os.getenv("STAND_IN_EMPLOYEES", "15")),
+    "airtable_rate_limit": env_float("STAND_IN_AIRTABLE_RATE_LIMIT", "5"),  # requests per second per base, 0 disables
+    "airtable_rate_limit_penalty_seconds": env_float("STAND_IN_AIRTABLE_PENALTY_SECONDS", "30"),
+    "airtable_appointments_table": os.getenv("TABLE_NAME", "Table 1")
+}
+
+# Keys that POST /_stand-in/config may change; volume keys regenerate the data set
+RUNTIME_KEYS = {"latency_ms", "jitter_ms", "error_rate", "rate_limit_share", "inbound_per_second", "webhook_url",
+                "airtable_rate_limit", "airtable_rate_limit_penalty_seconds"}
+VOLUME_KEYS = {"seed", "chats", "groups", "messages_per_chat"}
+AIRTABLE_VOLUME_KEYS = {"appointments", "clients", "services", "employees"}
+PUSHER_EVENT_LOG_SIZE = 1000
+HISTORY_SPACING_MINUTES = 7
+
+app = FastAPI(title="Upstream API stand-ins")
+
+def iso(moment: datetime) -> str:
+    """Wassenger's timestamp format ('2025-01-01T10:00:00.000Z')"""
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+def stand_in_phone(index: int) -> str:
+    """Phone number of generated client/chat `index`, shared by the Wassenger and Airtable data sets"""
+    return f"+97150{index:07d}"
+
+class StandInData:
+    """Generated devices, chats, groups and messages, plus everything sent or triggered since startup"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.pusher_events = deque(maxlen=PUSHER_EVENT_LOG_SIZE)
+        self.pusher_event_count = 0
+        self.generate()
+
+    def generate(self):
+        """Build the data set from the configured seed and volumes"""
+        rng = random.Random(config["seed"])
+        now = datetime.now(timezone.utc)
+        chats = []
+        messages_by_chat = {}
+        all_messages = []
+
+        for i in range(config["chats"]):
+            phone = stand_in_phone(i + 1)
+            chat_id = f"{phone[1:]}@c.us"
+            thread = []
+            last_at = now - timedelta(minutes=rng.randrange(60 * 24 * 30))
+            for j in range(config["messages_per_chat"]):
+                created = last_at - timedelta(minutes=HISTORY_SPACING_MINUTES * (config["messages_per_chat"] - 1 - j))
+                thread.append(self.message(chat_id, phone, f"Message {j + 1} from client {i + 1}", from_me=j % 2 == 1, created=created))
+            messages_by_chat[chat_id] = thread
+            all_messages.extend(thread)
+            chats.append({
+                "id": chat_id,
+                "name": f"Client {i + 1}",
+                "phone": phone,
+                "type": "chat",
+                "timestamp": iso(last_at),
+                "lastMessageAt": iso(last_at),
+                "lastMessage": {"body": thread[-1]["body"]} if thread else {},
+                "unreadCount": rng.choice([0, 0, 0, 1, 2])
+            })
+
+        groups = []
+        for i in range(config["groups"]):
+            group_id = f"1203630{i:011d}@g.us"
+            last_at = now - timedelta(minutes=rng.randrange(60 * 24 * 30))
+            groups.append({
+                "id": group_id,
+                "wid": group_id,
+                "name": f"Group {i + 1}",
+                "type": "group",
+                "timestamp": iso(last_at),
+                "lastMessageAt": iso(last_at),
+                "totalParticipants": rng.randrange(3, 250),
+                "unreadCount": 0
+            })
+
+        with self.lock:
+            self.chats = sorted(chats, key=lambda chat: chat["lastMessageAt"], reverse=True)
+            self.groups = groups
+            self.messages_by_chat = messages_by_chat
+            # Newest first, the order GET /v1/messages pages through
+            self.all_messages = sorted(all_messages, key=lambda msg: msg["createdAt"], reverse=True)
+        print(f"Stand-in data: {len(chats)} chats, {len(groups)} groups, {len(all_messages)} messages")
+
+    def message(self, chat_id: str, phone: str, body: str, from_me: bool, created: datetime):
+        """One Wassenger message object"""
+        return {
+            "id": uuid.uuid4().hex[:20].upper(),
+            "wid": chat_id,
+            "phone": phone,
+            "fromNumber": phone,
+            "fromMe": from_me,
+            "message": body,
+            "body": body,
+            "type": "text",
+            "status": "delivered" if from_me else "received",
+            "createdAt": iso(created),
+            "timestamp": iso(created),
+            "chat": {"id": chat_id, "phone": phone}
+        }
+
+    def add_message(self, msg):
+        """Record a sent or inbound message at the head of its chat and of the global history"""
+        with self.lock:
+            self.messages_by_chat.setdefault(msg["chat"]["id"], []).append(msg)
+            self.all_messages.insert(0, msg)
+
+data = StandInData()
+
+async def simulate_upstream(route: str, can_fail: bool = True):
+    """Count the call, sleep for the configured latency and raise the configured share of errors"""
+    data.calls[route] += 1
+    delay_ms = config["latency_ms"] + random.uniform(0, config["jitter_ms"])
+    if delay_ms > 0:
+        await asyncio.sleep(delay_ms / 1000)
+    if can_fail and config["error_rate"] > 0 and random.random() < config["error_rate"]:
+        data.calls[f"{route} (error)"] += 1
+        if random.random() < config["rate_limit_share"]:
+            raise HTTPException(status_code=429, detail="Too many requests (stand-in)")
+        raise HTTPException(status_code=503, detail="Service unavailable (stand-in)")
+
+def check_wassenger_token(request: Request):
+    if config["wassenger_api_key"] and request.headers.get("Token") != config["wassenger_api_key"]:
+        raise HTTPException(status_code=401, detail="Invalid API token")
+
+def check_device(device_id: str):
+    if device_id != config["device_id"]:
+        raise HTTPException(status_code=404, detail=f"Device not found: {device_id}")
+
+def page_of(items, size: Optional[int], page: int):
+    if not size:
+        return items
+    return items[page * size:(page + 1) * size]
+
+# Wassenger API
+
+@app.get("/v1/devices")
+async def list_devices(request: Request):
+    check_wassenger_token(request)
+    await simulate_upstream("GET /v1/devices")
+    return [{
+        "id": config["device_id"],
+        "alias": "Stand-in device",
+        "phone": "+971500000000",
+        "status": "operative",
+        "session": {"status": "online"}
+    }]
+
+@app.get("/v1/devices/{device_id}/chats")
+async def list_device_chats(device_id: str, request: Request, size: Optional[int] = None, page: int = 0):
+    check_wassenger_token(request)
+    await simulate_upstream("GET /v1/devices/{id}/chats")
+    check_device(device_id)
+    with data.lock:
+        chats = data.chats + data.groups
+    return page_of(chats, size, page)
+
+@app.get("/v1/devices/{device_id}/chats/{chat_id}/messages")
+async def list_chat_messages(device_id: str, chat_id: str, request: Request, limit: int = 20):
+    check_wassenger_token(request)
+    await simulate_upstream("GET /v1/devices/{id}/chats/{chat}/messages")
+    check_device(device_id)
+    with data.lock:
+        if chat_id not in data.messages_by_chat:
+            raise HTTPException(status_code=404, detail=f"Chat not found: {chat_id}")
+        # Oldest first, ending with the latest message
+        return data.messages_by_chat[chat_id][-limit:]
+
+@app.get("/v1/devices/{device_id}/groups")
+async def list_groups(device_id: str, request: Request, limit: Optional[int] = None, page: int = 0):
+    check_wassenger_token(request)
+    await simulate_upstream("GET /v1/devices/{id}/groups")
+    check_device(device_id)
+    return page_of(data.groups, limit, page)
+
+@app.get("/v1/chats")
+async def list_chats(request: Request, devices: Optional[str] = None, limit: Optional[int] = None, page: int = 0):
+    check_wassenger_token(request)
+    await simulate_upstream("GET /v1/chats")
+    with data.lock:
+        chats = data.chats + data.groups
+    return page_of(chats, limit, page)
+
+@app.get("/v1/messages")
+async def list_messages(request: Request, devices: Optional[str] = None, limit: int = 100, page: int = 0, after: Optional[str] = None):
+    """All messages newest first, optionally only those created after `after`"""
+    check_wassenger_token(request)
+    await simulate_upstream("GET /v1/messages")
+    with data.lock:
+        messages = data.all_messages
+        if after:
+            # all_messages is sorted newest first, so the newer ones are a prefix
+            end = 0
+            while end < len(messages) and messages[end]["createdAt"] > after:
+                end += 1
+            messages = messages[:end]
+        return messages[page * limit:(page + 1) * limit]
+
+@app.post("/v1/messages")
+async def send_message(request: Request):
+    check_wassenger_token(request)
+    await simulate_upstream("POST /v1/messages")
+    payload = await request.json()
+    digits = "".join(ch for ch in str(payload.get("phone", "")) if ch.isdigit())
+    if len(digits) < 8 or not payload.get("message"):
+        raise HTTPException(status_code=400, detail="Invalid phone number or empty message")
+
+    phone = "+" + digits
+    msg = data.message(f"{digits}@c.us", phone, payload["message"], from_me=True, created=datetime.now(timezone.utc))
+    data.add_message(msg)
+    return {**msg, "status": "queued", "deliveryStatus": "queued"}
+
+# Pusher HTTP API
+
+def check_pusher_signature(request: Request, body: bytes):
+    """Verify the auth_signature the Pusher client library adds to every request"""
+    params = dict(request.query_params)
+    signature = params.pop("auth_signature", "")
+    if params.get("auth_key") != config["pusher_key"]:
+        raise HTTPException(status_code=401, detail="Unknown auth_key")
+    if params.get("body_md5") != hashlib.md5(body).hexdigest():
+        raise HTTPException(status_code=401, detail="body_md5 does not match")
+    string_to_sign = "\n".join([request.method, request.url.path, "&".join(f"{k}={v}" for k, v in sorted(params.items()))])
+    expected = hmac.new(config["pusher_secret"].encode("utf8"), string_to_sign.encode("utf8"), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature, expected):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+def record_pusher_event(channel: str, name: str, payload):
+    data.pusher_event_count += 1
+    data.pusher_events.append({"channel": channel, "name": name, "data": payload, "received_at": time.time()})
+
+async def read_pusher_request(app_id: str, request: Request, route: str):
+    if app_id != config["pusher_app_id"]:
+        raise HTTPException(status_code=404, detail=f"Unknown app: {app_id}")
+    body = await request.body()
+    if config["verify_pusher_signatures"]:
+        check_pusher_signature(request, body)
+    await simulate_upstream(route)
+    return await request.json()
+
+@app.post("/apps/{app_id}/events")
+async def trigger_event(app_id: str, request: Request):
+    event = await read_pusher_request(app_id, request, "POST /apps/{id}/events")
+    for channel in event.get("channels", []):
+        record_pusher_event(channel, event.get("name"), event.get("data"))
+    return {}
+
+@app.post("/apps/{app_id}/batch_events")
+async def trigger_batch_events(app_id: str, request: Request):
+    payload = await read_pusher_request(app_id, request, "POST /apps/{id}/batch_events")
+    batch = payload.get("batch", [])
+    if len(batch) > 10:
+        raise HTTPException(status_code=400, detail="Batch too large (max 10 events)")
+    for event in batch:
+        record_pusher_event(event.get("channel"), event.get("name"), event.get("data"))
+    return {"batch": [{} for _ in batch]}
+
+# Airtable REST API
+
+AIRTABLE_PAGE_SIZE = 100
+AIRTABLE_BATCH_LIMIT = 10
+AIRTABLE_ITERATOR_CACHE_SIZE = 200
+AIRTABLE_EMPLOYEES_TABLE_ID = "tbloZHCP8cTVDBFmK"
+SERVICE_CATEGORIES = ["Hair", "Nails", "Massage", "Facial", "Makeup", "Waxing"]
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+FIRST_NAMES = ["Aisha", "Fatima", "Maryam", "Layla", "Noor", "Sara", "Hana", "Mona", "Reem", "Dana", "Emma", "Olivia", "Sofia", "Priya", "Anna"]
+LAST_NAMES = ["Al Mansoori", "Haddad", "Khan", "Rahman", "Nasser", "Saleh", "Smith", "Garcia", "Patel", "Ivanova", "Costa", "Yousef"]
+
+class AirtableError(Exception):
+    """An error answered in Airtable's {"error": {"type", "message"}} shape"""
+
+    def __init__(self, status_code: int, error_type: str, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_type = error_type
+        self.message = message
+
+@app.exception_handler(AirtableError)
+async def airtable_error_handler(request: Request, exc: AirtableError):
+    return JSONResponse(status_code=exc.status_code, content={"error": {"type": exc.error_type, "message": exc.message}})
+
+class FormulaError(ValueError):
+    """A filterByFormula expression outside the supported subset"""
+
+FORMULA_TOKEN = re.compile(r"""\s*(?:(?P<number>\d+(?:\.\d+)?)|(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|(?P<field>\{[^}]*\})|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<op><=|>=|!=|[=<>&+\-*/(),]))""")
+
+def formula_text(value) -> str:
+    """How Airtable formulas see a cell as text: blank is '', lists (linked records, multi-selects) join with ', '"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, list):
+        return ", ".join(formula_text(item) for item in value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def formula_number(value):
+    """A cell as a number, or None if it is not numeric"""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    try:
+        return float(formula_text(value))
+    except ValueError:
+        return None
+
+def formula_truthy(value) -> bool:
+    return value not in (None, "", 0, False, []) and not (isinstance(value, float) and value != value)
+
+def formula_date(value):
+    text = formula_text(value)
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def compare_formula_values(op: str, left, right) -> bool:
+    left_number, right_number = formula_number(left), formula_number(right)
+    numeric = (isinstance(left, (int, float)) or isinstance(right, (int, float))) and None not in (left_number, right_number)
+    a, b = (left_number, right_number) if numeric else (formula_text(left), formula_text(right))
+    return {"=": a == b, "!=": a != b, "<": a < b, ">": a > b, "<=": a <= b, ">=": a >= b}[op]
+
+def find_formula(needle, haystack, start=None, case_sensitive=True):
+    needle, haystack = formula_text(needle), formula_text(haystack)
+    if not case_sensitive:
+        needle, haystack = needle.lower(), haystack.lower()
+    return haystack.find(needle, max(int(formula_number(start) or 1) - 1, 0)) + 1
+
+def is_same_date(a, b, unit="day"):
+    first, second = formula_date(a), formula_date(b)
+    if not first or not second:
+        return False
+    width = {"year": 4, "month": 7, "day": 10}.get(formula_text(unit).lower(), 10)
+    return first.isoformat()[:width] == second.isoformat()[:width]
+
+FORMULA_FUNCTIONS = {
+    "AND": lambda record, *args: all(formula_truthy(arg) for arg in args),
+    "OR": lambda record, *args: any(formula_truthy(arg) for arg in args),
+    "NOT": lambda record, arg: not formula_truthy(arg),
+    "IF": lambda record, condition, then, otherwise="": then if formula_truthy(condition) else otherwise,
+    "BLANK": lambda record: None,
+    "TRUE": lambda record: True,
+    "FALSE": lambda record: False,
+    "RECORD_ID": lambda record: record["id"],
+    "FIND": lambda record, needle, haystack, start=None: find_formula(needle, haystack, start),
+    "SEARCH": lambda record, needle, haystack, start=None: find_formula(needle, haystack, start, case_sensitive=False),
+    "LOWER": lambda record, text: formula_text(text).lower(),
+    "UPPER": lambda record, text: formula_text(text).upper(),
+    "TRIM": lambda record, text: formula_text(text).strip(),
+    "LEN": lambda record, text: len(formula_text(text)),
+    "VALUE": lambda record, text: formula_number(text),
+    "ARRAYJOIN": lambda record, values, separator=", ": formula_text(separator).join(formula_text(item) for item in (values if isinstance(values, list) else [values])),
+    "TODAY": lambda record: datetime.now(timezone.utc).date().isoformat(),
+    "NOW": lambda record: datetime.now(timezone.utc).isoformat(),
+    "DATESTR": lambda record, value: formula_date(value).date().isoformat() if formula_date(value) else "",
+    "DATETIME_PARSE": lambda record, value, *formats: formula_date(value).isoformat() if formula_date(value) else "",
+    "IS_BEFORE": lambda record, a, b: bool(formula_date(a) and formula_date(b) and formula_date(a) < formula_date(b)),
+    "IS_AFTER": lambda record, a, b: bool(formula_date(a) and formula_date(b) and formula_date(a) > formula_date(b)),
+    "IS_SAME": lambda record, a, b, unit="day": is_same_date(a, b, unit)
+}
+
+class FormulaParser:
+    """Compiles the supported filterByFormula subset into a function of a record
+
+    Supports field references ({Name}), string and number literals, = != < > <= >=, & (concatenation),
+    + - * /, parentheses and the functions in FORMULA_FUNCTIONS. Linked-record fields compare as their
+    comma-joined record IDs, since the stand-in does not resolve primary field values.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = FORMULA_TOKEN.match(text, position)
+            if not match or match.end() == position:
+                raise FormulaError(f"Unexpected input at position {position}: {text[position:position + 20]!r}")
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+            while position < len(text) and text[position].isspace():
+                position += 1
+        self.index = 0
+
+    def peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise FormulaError(f"Expected {value or 'more input'}, found {token[1] or 'end of formula'}")
+        self.index += 1
+        return token
+
+    def compile(self):
+        expression = self.comparison()
+        if self.peek()[0] is not None:
+            raise FormulaError(f"Unexpected {self.peek()[1]!r}")
+        return expression
+
+    def binary(self, operand, operators, combine):
+        left = operand()
+        while self.peek()[0] == "op" and self.peek()[1] in operators:
+            op = self.take()[1]
+            right = operand()
+            left = (lambda op, left, right: lambda record: combine(op, left(record), right(record)))(op, left, right)
+        return left
+
+    def comparison(self):
+        return self.binary(self.concatenation, ("=", "!=", "<", ">", "<=", ">="), compare_formula_values)
+
+    def concatenation(self):
+        return self.binary(self.additive, ("&",), lambda op, a, b: formula_text(a) + formula_text(b))
+
+    def additive(self):
+        return self.binary(self.multiplicative, ("+", "-"), lambda op, a, b: (formula_number(a) or 0) + (formula_number(b) or 0) * (1 if op == "+" else -1))
+
+    def multiplicative(self):
+        def combine(op, a, b):
+            a, b = formula_number(a) or 0, formula_number(b) or 0
+            return a * b if op == "*" else (a / b if b else None)
+        return self.binary(self.unary, ("*", "/"), combine)
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            operand = self.unary()
+            return lambda record: -(formula_number(operand(record)) or 0)
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            number = float(value)
+            return lambda record: number
+        if kind == "string":
+            text = re.sub(r"\\(.)", r"\1", value[1:-1])
+            return lambda record: text
+        if kind == "field":
+            name = value[1:-1]
+            return lambda record: record["fields"].get(name)
+        if kind == "op" and value == "(":
+            expression = self.comparison()
+            self.take(")")
+            return expression
+        if kind == "name":
+            function = FORMULA_FUNCTIONS.get(value.upper())
+            if function is None:
+                raise FormulaError(f"Unsupported function: {value}")
+            self.take("(")
+            arguments = []
+            if self.peek() != ("op", ")"):
+                arguments.append(self.comparison())
+                while self.peek() == ("op", ","):
+                    self.take()
+                    arguments.append(self.comparison())
+            self.take(")")
+            return lambda record: function(record, *(argument(record) for argument in arguments))
+        raise FormulaError(f"Unexpected {value!r}")
+
+def compile_formula(text: str):
+    """filterByFormula text -> predicate on a record"""
+    expression = FormulaParser(text).compile()
+
+    def predicate(record):
+        try:
+            return formula_truthy(expression(record))
+        except TypeError as e:
+            raise FormulaError(f"Invalid arguments: {e}")
+    return predicate
+
+def sort_key(value):
+    """Blanks last, numbers before text, so mixed columns still sort"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (False, 0, value)
+    return (value is None, 1, formula_text(value))
+
+def record_id(rng) -> str:
+    return "rec" + "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(14))
+
+def generate_airtable_tables(appointments: int, clients: int = 0, services: int = 30, employees: int = 15, seed: int = 42):
+    """Seed the Clients, Services, employees and appointments tables with linked, plausible records
+
+    Appointments spread over the past year and the next two months; past ones are mostly
+    Completed, future ones Scheduled or Confirmed, and a few of each are Cancelled.
+    """
+    rng = random.Random(seed)
+    today = datetime.now(timezone.utc).date()
+    created_time = iso(datetime.now(timezone.utc))
+    clients = clients or max(50, appointments // 20)
+
+    def record(fields):
+        return {"id": record_id(rng), "createdTime": created_time, "fields": fields}
+
+    service_records = []
+    for i in range(services):
+        category = SERVICE_CATEGORIES[i % len(SERVICE_CATEGORIES)]
+        service_records.append(record({
+            "Service Name": f"{category} Service {i // len(SERVICE_CATEGORIES) + 1}",
+            "Category": category,
+            "Duration (minutes)": rng.choice([30, 45, 60, 90, 120]),
+            "Price": rng.choice([80, 120, 150, 200, 250, 350, 500]),
+            "Description": f"Stand-in {category.lower()} treatment"
+        }))
+
+    employee_records = []
+    for i in range(employees):
+        employee_records.append(record({
+            "Full Name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "Employee Number": f"E{i + 1:03d}",
+            "Email": f"employee{i + 1}@example.com",
+            "Contact Number": f"+97155{i + 1:07d}",
+            "Availability": sorted(rng.sample(WEEKDAY_NAMES, rng.randrange(4, 7)), key=WEEKDAY_NAMES.index),
+            "Expertise": rng.sample(SERVICE_CATEGORIES, rng.randrange(1, 4)),
+            "Status": "Active" if rng.random() > 0.1 else "Inactive",
+            "Start Date": (today - timedelta(days=rng.randrange(30, 2000))).isoformat(),
+            "Shift Start": "09:00",
+            "Shift End": "18:00",
+            "Services": [service["id"] for service in rng.sample(service_records, min(len(service_records), 5))]
+        }))
+
+    client_records = []
+    for i in range(clients):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        client_records.append(record({
+            "Name": name,
+            "Client Name": name,
+            "Phone": stand_in_phone(i + 1),
+            "Email": f"client{i + 1}@example.com",
+            "Tags": rng.sample(["VIP", "New", "Regular", "Bridal", "Corporate"], rng.randrange(0, 3))
+        }))
+
+    appointment_records = []
+    for i in range(appointments):
+        appointment_date = today + timedelta(days=rng.randrange(-365, 61))
+        service = rng.choice(service_records)
+        if appointment_date < today:
+            status = rng.choices(["Completed", "Cancelled", "Scheduled"], weights=[85, 10, 5])[0]
+        else:
+            status = rng.choices(["Scheduled", "Confirmed", "Cancelled"], weights=[60, 32, 8])[0]
+        slot = rng.randrange(18)  # half-hour slots from 09:00
+        appointment_time = datetime(2000, 1, 1, 9 + slot // 2, 30 * (slot % 2)).strftime("%I:%M %p")
+        appointment_records.append(record({
+            "Appointment ID": f"A{i + 1:03d}",
+            "Client Name": [rng.choice(client_records)["id"]],
+            "Services": [service["id"]],
+            "Stylist": [rng.choice(employee_records)["id"]] if employee_records else [],
+            "Appointment Date": appointment_date.isoformat(),
+            "Appointment Time": appointment_time,
+            "Appointment Status": status,
+            "Total Price": service["fields"]["Price"],
+            "Notes": ""
+        }))
+
+    return {
+        "appointments": appointment_records,
+        "Clients": client_records,
+        "Services": service_records,
+        "employees": employee_records
+    }
+
+class AirtableStandIn:
+    """In-memory Airtable base: tables of records, list iterators for offset paging, and the per-base rate limit"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.iterators = OrderedDict()  # offset iterator ID -> record IDs matching the original query
+        self.request_times = deque()
+        self.penalty_until = 0
+        self.rate_limited = 0
+
+    def generate(self):
+        """Rebuild all tables from the configured seed and volumes"""
+        started = time.time()
+        tables = generate_airtable_tables(config["appointments"], config["clients"], config["services"],
+                                          config["employees"], config["seed"])
+        with self.lock:
+            self.tables = {name: OrderedDict((record["id"], record) for record in records) for name, records in tables.items()}
+            self.iterators.clear()
+        print(f"Stand-in Airtable: {', '.join(f'{len(records)} {name}' for name, records in tables.items())} "
+              f"in {time.time() - started:.1f}s")
+
+    def table(self, name: str):
+        """Resolve a table by name or ID the way server.py refers to it"""
+        if name in (config["airtable_appointments_table"], "Appointments"):
+            name = "appointments"
+        elif name in (AIRTABLE_EMPLOYEES_TABLE_ID, "Employees"):
+            name = "employees"
+        table = self.tables.get(name)
+        if table is None:
+            raise AirtableError(404, "TABLE_NOT_FOUND", f"Could not find table {name} in this base")
+        return table
+
+    def check_rate_limit(self):
+        """Allow airtable_rate_limit requests per rolling second; exceeding it blocks the base for the penalty period"""
+        limit = config["airtable_rate_limit"]
+        if not limit:
+            return
+        now = time.time()
+        with self.lock:
+            while self.request_times and self.request_times[0] <= now - 1:
+                self.request_times.popleft()
+            self.request_times.append(now)
+            if now < self.penalty_until or len(self.request_times) > limit:
+                if now >= self.penalty_until:
+                    self.penalty_until = now + config["airtable_rate_limit_penalty_seconds"]
+                self.rate_limited += 1
+                raise AirtableError(429, "RATE_LIMIT_REACHED", "Rate limit exceeded. Please try again later")
+
+    def list_page(self, table_name: str, params):
+        """One page of a list request, honouring filterByFormula, sort, maxRecords, fields[] and offset"""
+        table = self.table(table_name)
+        page_size = int(params.get("pageSize") or AIRTABLE_PAGE_SIZE)
+        if not 1 <= page_size <= AIRTABLE_PAGE_SIZE:
+            raise AirtableError(422, "INVALID_PAGE_SIZE", f"pageSize must be between 1 and {AIRTABLE_PAGE_SIZE}")
+        fields = params.getlist("fields[]") or params.getlist("fields")
+        offset = params.get("offset")
+
+        with self.lock:
+            if offset:
+                iterator_id, _, position = offset.partition("/")
+                ids = self.iterators.get(iterator_id)
+                if ids is None or not position.isdigit():
+                    raise AirtableError(422, "LIST_RECORDS_ITERATOR_NOT_AVAILABLE", "The offset is no longer valid")
+                start = int(position)
+            else:
+                ids = self.query_ids(table, params)
+                iterator_id = "itr" + uuid.uuid4().hex[:14]
+                self.iterators[iterator_id] = ids
+                while len(self.iterators) > AIRTABLE_ITERATOR_CACHE_SIZE:
+                    self.iterators.popitem(last=False)
+                start = 0
+
+            page = []
+            for record_id in ids[start:start + page_size]:
+                record = table.get(record_id)
+                if record is None:
+                    continue
+                if fields:
+                    record = {**record, "fields": {name: record["fields"][name] for name in fields if name in record["fields"]}}
+                page.append(record)
+
+        result = {"records": page}
+        if start + page_size < len(ids):
+            result["offset"] = f"{iterator_id}/{start + page_size}"
+        return result
+
+    def query_ids(self, table, params):
+        records = list(table.values())
+        formula = params.get("filterByFormula")
+        if formula:
+            try:
+                predicate = compile_formula(formula)
+                records = [record for record in records if predicate(record)]
+            except FormulaError as e:
+                raise AirtableError(422, "INVALID_FILTER_BY_FORMULA", f"The formula for filtering records is invalid: {e}")
+
+        sorts = []
+        index = 0
+        while f"sort[{index}][field]" in params:
+            sorts.append((params[f"sort[{index}][field]"], params.get(f"sort[{index}][direction]", "asc") == "desc"))
+            index += 1
+        for field, descending in reversed(sorts):
+            records.sort(key=lambda record: sort_key(record["fields"].get(field)), reverse=descending)
+
+        max_records = params.get("maxRecords")
+        if max_records:
+            records = records[:int(max_records)]
+        return [record["id"] for record in records]
+
+    def create(self, table_name: str, fields_list):
+        table = self.table(table_name)
+        created = []
+        with self.lock:
+            for fields in fields_list:
+                record = {"id": record_id(random), "createdTime": iso(datetime.now(timezone.utc)), "fields": dict(fields or {})}
+                table[record["id"]] = record
+                created.append(record)
+        return created
+
+    def update(self, table_name: str, updates, replace: bool = False):
+        table = self.table(table_name)
+        with self.lock:
+            missing = [update.get("id") for update in updates if update.get("id") not in table]
+            if missing:
+                raise AirtableError(404, "NOT_FOUND", f"Record not found: {missing[0]}")
+            updated = []
+            for update in updates:
+                record = table[update["id"]]
+                fields = dict(update.get("fields") or {}) if replace else {**record["fields"], **(update.get("fields") or {})}
+                record = {**record, "fields": {name: value for name, value in fields.items() if value not in (None, "", [])}}
+                table[update["id"]] = record
+                updated.append(record)
+        return updated
+
+    def delete(self, table_name: str, record_ids):
+        table = self.table(table_name)
+        with self.lock:
+            missing = [record_id for record_id in record_ids if record_id not in table]
+            if missing:
+                raise AirtableError(404, "NOT_FOUND", f"Record not found: {missing[0]}")
+            for record_id in record_ids:
+                del table[record_id]
+        return [{"id": record_id, "deleted": True} for record_id in record_ids]
+
+airtable_data = AirtableStandIn()
+
+async def simulate_airtable(request: Request, route: str):
+    """Authenticate, apply the base's rate limit, then add the shared latency and error injection"""
+    if not request.headers.get("Authorization", "").startswith("Bearer "):
+        raise AirtableError(401, "AUTHENTICATION_REQUIRED", "Authentication required")
+    airtable_data.check_rate_limit()
+    try:
+        await simulate_upstream(route)
+    except HTTPException as e:
+        raise AirtableError(e.status_code, "RATE_LIMIT_REACHED" if e.status_code == 429 else "SERVICE_UNAVAILABLE", e.detail)
+
+def batch_of(payload, key: str = "records"):
+    records = payload.get(key)
+    if not isinstance(records, list) or not records:
+        raise AirtableError(422, "INVALID_REQUEST_MISSING_FIELDS", f"Could not find field \"{key}\" in the request body")
+    if len(records) > AIRTABLE_BATCH_LIMIT:
+        raise AirtableError(422, "INVALID_RECORDS", f"You can write at most {AIRTABLE_BATCH_LIMIT} records per request")
+    return records
+
+@app.get("/v0/{base_id}/{table_name}")
+async def airtable_list_records(base_id: str, table_name: str, request: Request):
+    await simulate_airtable(request, f"GET /v0/{table_name}")
+    return await asyncio.to_thread(airtable_data.list_page, table_name, request.query_params)
+
+@app.get("/v0/{base_id}/{table_name}/{record_id}")
+async def airtable_get_record(base_id: str, table_name: str, record_id: str, request: Request):
+    await simulate_airtable(request, f"GET /v0/{table_name}/{{id}}")
+    record = airtable_data.table(table_name).get(record_id)
+    if record is None:
+        raise AirtableError(404, "NOT_FOUND", f"Record not found: {record_id}")
+    return record
+
+@app.post("/v0/{base_id}/{table_name}")
+async def airtable_create_records(base_id: str, table_name: str, request: Request):
+    """Create one record ({"fields"}) or a batch of up to 10 ({"records": [{"fields"}]})"""
+    await simulate_airtable(request, f"POST /v0/{table_name}")
+    payload = await request.json()
+    if "records" in payload:
+        return {"records": airtable_data.create(table_name, [record.get("fields") for record in batch_of(payload)])}
+    return airtable_data.create(table_name, [payload.get("fields")])[0]
+
+@app.patch("/v0/{base_id}/{table_name}")
+@app.put("/v0/{base_id}/{table_name}")
+async def airtable_update_records(base_id: str, table_name: str, request: Request):
+    """Update up to 10 records ({"records": [{"id", "fields"}]}); PUT replaces their fields"""
+    await simulate_airtable(request, f"{request.method} /v0/{table_name}")
+    payload = await request.json()
+    return {"records": airtable_data.update(table_name, batch_of(payload), replace=request.method == "PUT")}
+
+@app.patch("/v0/{base_id}/{table_name}/{record_id}")
+@app.put("/v0/{base_id}/{table_name}/{record_id}")
+async def airtable_update_record(base_id: str, table_name: str, record_id: str, request: Request):
+    await simulate_airtable(request, f"{request.method} /v0/{table_name}/{{id}}")
+    payload = await request.json()
+    return airtable_data.update(table_name, [{"id": record_id, "fields": payload.get("fields")}], replace=request.method == "PUT")[0]
+
+@app.delete("/v0/{base_id}/{table_name}")
+async def airtable_delete_records(base_id: str, table_name: str, request: Request):
+    """Delete up to 10 records given as records[]=... (or records=...)"""
+    await simulate_airtable(request, f"DELETE /v0/{table_name}")
+    record_ids = request.query_params.getlist("records[]") or request.query_params.getlist("records")
+    if len(record_ids) > AIRTABLE_BATCH_LIMIT:
+        raise AirtableError(422, "INVALID_RECORDS", f"You can delete at most {AIRTABLE_BATCH_LIMIT} records per request")
+    return {"records": airtable_data.delete(table_name, record_ids)}
+
+@app.delete("/v0/{base_id}/{table_name}/{record_id}")
+async def airtable_delete_record(base_id: str, table_name: str, record_id: str, request: Request):
+    await simulate_airtable(request, f"DELETE /v0/{table_name}/{{id}}")
+    return airtable_data.delete(table_name, [record_id])[0]
+
+# Stand-in control
+
+@app.get("/_stand-in/stats")
+async def stand_in_stats():
+    """Calls per route since startup or the last reset, Pusher events received and Airtable requests refused with 429"""
+    with data.lock:
+        volume = {"chats": len(data.chats), "groups": len(data.groups), "messages": len(data.all_messages)}
+    with airtable_data.lock:
+        volume.update({f"airtable {name}": len(records) for name, records in airtable_data.tables.items()})
+    return {
+        "calls": dict(data.calls),
+        "total_calls": sum(count for route, count in data.calls.items() if not route.endswith("(error)")),
+        "pusher_events": data.pusher_event_count,
+        "airtable_rate_limited": airtable_data.rate_limited,
+        "volume": volume,
+        "config": {key: value for key, value in config.items() if key not in ("pusher_secret", "wassenger_api_key")}
+    }
+
+@app.get("/_stand-in/pusher-events")
+async def stand_in_pusher_events(limit: int = 100):
+    """The most recently triggered Pusher events, newest last"""
+    return list(data.pusher_events)[-limit:]
+
+@app.post("/_stand-in/reset")
+async def stand_in_reset():
+    """Clear call counters, the Pusher event log and any Airtable rate-limit penalty"""
+    data.calls.clear()
+    data.pusher_events.clear()
+    data.pusher_event_count = 0
+    with airtable_data.lock:
+        airtable_data.request_times.clear()
+        airtable_data.penalty_until = 0
+        airtable_data.rate_limited = 0
+    return {"success": True}
+
+@app.post("/_stand-in/config")
+async def stand_in_config(request: Request):
+    """Change latency, error rate, inbound traffic or data volume; volume changes regenerate the data set"""
+    updates = await request.json()
+    unknown = set(updates) - RUNTIME_KEYS - VOLUME_KEYS - AIRTABLE_VOLUME_KEYS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown settings: {', '.join(sorted(unknown))}")
+    for key, value in updates.items():
+        config[key] = type(config[key])(value)
+    if set(updates) & VOLUME_KEYS:
+        await asyncio.to_thread(data.generate)
+    if set(updates) & (AIRTABLE_VOLUME_KEYS | {"seed"}):
+        await asyncio.to_thread(airtable_data.generate)
+    return {key: config[key] for key in updates}
+
+async def inbound_message_loop():
+    """Post simulated inbound WhatsApp messages to the backend webhook at inbound_per_second"""
+    async with httpx.AsyncClient(timeout=10) as client:
+        while True:
+            rate = config["inbound_per_second"]
+            if not rate or not config["webhook_url"]:
+                await asyncio.sleep(1)
+                continue
+            with data.lock:
+                chat = random.choice(data.chats) if data.chats else None
+            if chat:
+                msg = data.message(chat["id"], chat["phone"], f"Inbound message at {iso(datetime.now(timezone.utc))}",
+                                   from_me=False, created=datetime.now(timezone.utc))
+                data.add_message(msg)
+                try:
+                    await client.post(config["webhook_url"], json={"event": "message:in:new", "data": msg})
+                    data.calls["webhook deliveries"] += 1
+                except httpx.HTTPError as e:
+                    data.calls["webhook deliveries (error)"] += 1
+                    print(f"Webhook delivery failed: {e!r}")
+            await asyncio.sleep(1 / rate)
+
+@app.on_event("startup")
+async def start_stand_ins():
+    if not airtable_data.tables:
+        await asyncio.to_thread(airtable_data.generate)
+    asyncio.create_task(inbound_message_loop())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Wassenger, Pusher and Airtable stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--seed", type=int, default=config["seed"])
+    parser.add_argument("--chats", type=int, default=config["chats"], help="number of individual chats")
+    parser.add_argument("--groups", type=int, default=config["groups"], help="number of group chats")
+    parser.add_argument("--messages-per-chat", type=int, default=config["messages_per_chat"])
+    parser.add_argument("--latency-ms", type=float, default=config["latency_ms"], help="fixed delay added to every upstream call")
+    parser.add_argument("--jitter-ms", type=float, default=config["jitter_ms"], help="extra random delay of up to this much")
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"], help="share of calls answered with 429/503")
+    parser.add_argument("--rate-limit-share", type=float, default=config["rate_limit_share"], help="share of injected errors that are 429s")
+    parser.add_argument("--device-id", default=config["device_id"])
+    parser.add_argument("--wassenger-api-key", default=config["wassenger_api_key"], help="require this Token header (default: accept any)")
+    parser.add_argument("--no-verify-pusher", action="store_true", help="accept Pusher requests without checking signatures")
+    parser.add_argument("--webhook-url", default=config["webhook_url"], help="backend webhook for simulated inbound messages")
+    parser.add_argument("--inbound-per-second", type=float, default=config["inbound_per_second"])
+    parser.add_argument("--appointments", type=int, default=config["appointments"], help="appointments to seed (e.g. 100000)")
+    parser.add_argument("--clients", type=int, default=config["clients"], help="clients to seed (default: appointments / 20, at least 50)")
+    parser.add_argument("--services", type=int, default=config["services"])
+    parser.add_argument("--employees", type=int, default=config["employees"])
+    parser.add_argument("--airtable-rate-limit", type=float, default=config["airtable_rate_limit"], help="Airtable requests per second before 429s (0 disables)")
+    parser.add_argument("--airtable-penalty-seconds", type=float, default=config["airtable_rate_limit_penalty_seconds"], help="how long a base stays blocked after exceeding the limit")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    import uvicorn
+    args = parse_args()
+    config.update({
+        "seed": args.seed,
+        "chats": args.chats,
+        "groups": args.groups,
+        "messages_per_chat": args.messages_per_chat,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "rate_limit_share": args.rate_limit_share,
+        "device_id": args.device_id,
+        "wassenger_api_key": args.wassenger_api_key,
+        "verify_pusher_signatures": not args.no_verify_pusher,
+        "webhook_url": args.webhook_url,
+        "inbound_per_second": args.inbound_per_second,
+        "appointments": args.appointments,
+        "clients": args.clients,
+        "services": args.services,
+        "employees": args.employees,
+        "airtable_rate_limit": args.airtable_rate_limit,
+        "airtable_rate_limit_penalty_seconds": args.airtable_penalty_seconds
+    })
+    data.generate()
+    airtable_data.generate()
+    uvicorn.run(app, host=args.host, port=args.port)
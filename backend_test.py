@@ -2397,6 +2397,8 @@ class BackendAPITester:
             "api/conversations",
             200
         )
+        if success and isinstance(response_data, dict):
+            response_data = response_data.get('conversations', [])
         
         if success and isinstance(response_data, list):
             print(f"✅ Found {len(response_data)} conversations")
@@ -2651,6 +2653,8 @@ class BackendAPITester:
             "api/conversations",
             200
         )
+        if success and isinstance(response_data, dict):
+            response_data = response_data.get('conversations', [])
         
         if success and isinstance(response_data, list):
             print(f"✅ Conversations endpoint returned {len(response_data)} conversations")
@@ -2770,6 +2774,8 @@ class BackendAPITester:
             "api/conversations",
             200
         )
+        if success and isinstance(response_data, dict):
+            response_data = response_data.get('conversations', [])
         
         if not success:
             print(f"❌ Cannot test device access - conversations endpoint failed")
@@ -2845,6 +2851,8 @@ class BackendAPITester:
             "api/conversations",
             200
         )
+        if success and isinstance(response_data, dict):
+            response_data = response_data.get('conversations', [])
         
         if not success or not isinstance(response_data, list):
             print(f"❌ Cannot test chat retrieval - invalid response")
@@ -3025,6 +3033,447 @@ class BackendAPITester:
         
         return test_results["overall_success"], test_results
 
+    def test_analytics_custom_range(self):
+        """Test GET /api/analytics with explicit start/end dates"""
+        print("\n🔍 TESTING: Analytics Custom Date Range")
+        print("-" * 50)
+        
+        success, response_data = self.run_test(
+            "Analytics Custom Range",
+            "GET",
+            "api/analytics?start=2025-01-01&end=2025-01-31",
+            200
+        )
+        
+        if success and isinstance(response_data, dict):
+            period = response_data.get('period', {})
+            if period.get('start') == '2025-01-01' and period.get('end') == '2025-01-31':
+                print("✅ Response period matches the requested window")
+            else:
+                print(f"⚠️  Unexpected period in response: {period}")
+        
+        # Reversed and malformed windows must be rejected
+        reversed_ok, _ = self.run_test(
+            "Analytics Reversed Range",
+            "GET",
+            "api/analytics?start=2025-02-01&end=2025-01-01",
+            400
+        )
+        malformed_ok, _ = self.run_test(
+            "Analytics Malformed Start Date",
+            "GET",
+            "api/analytics?start=01/02/2025",
+            400
+        )
+        
+        return success and reversed_ok and malformed_ok, response_data
+
+    def test_analytics_cohorts(self):
+        """Test GET /api/analytics/cohorts retention matrix structure"""
+        print("\n🔍 TESTING: Analytics Cohort Retention Matrix")
+        print("-" * 50)
+        
+        success, response_data = self.run_test(
+            "Analytics Cohorts",
+            "GET",
+            "api/analytics/cohorts?months=6",
+            200
+        )
+        
+        if success and isinstance(response_data, dict):
+            cohorts = response_data.get('cohorts', [])
+            print(f"✅ Found {len(cohorts)} cohorts")
+            for cohort in cohorts:
+                active = cohort.get('active', [])
+                if active and active[0] != cohort.get('size'):
+                    print(f"⚠️  Cohort {cohort.get('cohort')} month-0 activity does not match its size")
+                    success = False
+        
+        return success, response_data
+
+    def test_conversations_incremental_sync(self):
+        """Test POST /api/conversations/sync twice: the second run should only fetch newer messages"""
+        print("\n🔍 TESTING: Incremental Wassenger Message Sync")
+        print("-" * 50)
+        
+        first_ok, first = self.run_test(
+            "Message Sync (initial)",
+            "POST",
+            "api/conversations/sync",
+            200
+        )
+        second_ok, second = self.run_test(
+            "Message Sync (repeat)",
+            "POST",
+            "api/conversations/sync",
+            200
+        )
+        
+        if first_ok and second_ok:
+            print(f"   High-water mark: {second.get('high_water_mark')}")
+            print(f"   Repeat sync fetched {second.get('fetched', 0)} messages (initial: {first.get('fetched', 0)})")
+            if second.get('imported', 0) > first.get('imported', 0):
+                print("⚠️  Repeat sync imported more messages than the initial sync")
+        
+        return first_ok and second_ok, second
+
+    def test_conversations_pagination(self):
+        """Test keyset pagination of GET /api/conversations and per-thread message history"""
+        print("\n🔍 TESTING: Paginated Conversations and Message History")
+        print("-" * 50)
+        
+        success, page = self.run_test(
+            "Conversation Summaries (first page)",
+            "GET",
+            "api/conversations?limit=5",
+            200
+        )
+        
+        if not success or not isinstance(page, dict):
+            return False, page
+        
+        conversations = page.get('conversations', [])
+        print(f"✅ Page has {len(conversations)} conversations, next cursor: {'yes' if page.get('next_cursor') else 'no'}")
+        if any('messages' in conversation for conversation in conversations):
+            print("⚠️  Summaries should not embed messages")
+            success = False
+        
+        if conversations:
+            history_ok, history = self.run_test(
+                "Conversation Message History",
+                "GET",
+                f"api/conversations/{conversations[0]['id']}/messages?limit=5",
+                200
+            )
+            success = success and history_ok
+            if history_ok:
+                print(f"✅ Loaded {len(history.get('messages', []))} messages, more available: {bool(history.get('next_before'))}")
+        
+        invalid_ok, _ = self.run_test(
+            "Conversation Summaries (invalid cursor)",
+            "GET",
+            "api/conversations?cursor=not-a-cursor",
+            400
+        )
+        
+        return success and invalid_ok, page
+    
+    def test_realtime_metrics(self):
+        """Test that real-time delivery exposes queue depth and drop counters"""
+        print("\n🔍 TESTING: Real-time Delivery Metrics")
+        print("-" * 50)
+        
+        success, metrics = self.run_test(
+            "Real-time Metrics",
+            "GET",
+            "api/realtime/metrics",
+            200
+        )
+        
+        if success:
+            pusher = metrics.get('pusher', {})
+            print(f"✅ Backend: {metrics.get('backend')}, queue depth: {pusher.get('queue_depth')}")
+            print(f"✅ Sent: {pusher.get('sent')}, retries: {pusher.get('retries')}, dropped: {pusher.get('dropped_queue_full', 0) + pusher.get('dropped_after_retries', 0)}")
+        
+        return success, metrics
+    
+    def test_webhook_pipeline_metrics(self):
+        """Test that a repeated webhook delivery is acked as a duplicate and the pipeline reports its backlog"""
+        print("\n🔍 TESTING: Webhook Ingestion Pipeline")
+        print("-" * 50)
+        
+        webhook_data = {
+            "event": "message:in:new",
+            "data": {
+                "id": f"backend-test-{int(time.time())}",
+                "fromNumber": "+971502810801",
+                "body": "Pipeline dedup test",
+                "fromMe": False
+            }
+        }
+        
+        first_ok, first = self.run_test("Webhook (first delivery)", "POST", "api/webhook/wassenger", 200, data=webhook_data)
+        retry_ok, retry = self.run_test("Webhook (retried delivery)", "POST", "api/webhook/wassenger", 200, data=webhook_data)
+        
+        success = first_ok and retry_ok
+        if success:
+            if retry.get('duplicate'):
+                print("✅ Retried delivery was deduplicated")
+            else:
+                print(f"⚠️  Retried delivery was not flagged as duplicate: {retry}")
+                success = False
+        
+        metrics_ok, metrics = self.run_test("Webhook Pipeline Metrics", "GET", "api/webhook/metrics", 200)
+        if metrics_ok:
+            print(f"✅ Backlog: {metrics.get('backlog')}, processed last minute: {metrics.get('processed_last_minute')}, duplicates: {metrics.get('duplicates')}")
+        
+        return success and metrics_ok, metrics
+    
+    def test_conversation_search(self):
+        """Test full-text search over stored messages with phrase and prefix queries"""
+        print("\n🔍 TESTING: Conversation Search")
+        print("-" * 50)
+        
+        success = True
+        for query in ['"couples massage"', 'appoint*']:
+            query_ok, response = self.run_test(
+                f"Search Conversations ({query})",
+                "GET",
+                f"api/conversations/search?q={requests.utils.quote(query)}&limit=5",
+                200
+            )
+            success = success and query_ok
+            if query_ok:
+                results = response.get('results', [])
+                print(f"✅ {len(results)} results for {query}")
+                for result in results[:3]:
+                    print(f"   - {result.get('client')}: {result.get('snippet')}")
+        
+        empty_ok, _ = self.run_test(
+            "Search Conversations (no words)",
+            "GET",
+            "api/conversations/search?q=%22%22",
+            400
+        )
+        
+        return success and empty_ok, None
+    
+    def test_conversation_client_links(self):
+        """Test that conversations carry the linked Airtable client and next appointment"""
+        print("\n🔍 TESTING: Conversation Client Links")
+        print("-" * 50)
+        
+        success, page = self.run_test(
+            "Conversation Summaries with Client Links",
+            "GET",
+            "api/conversations?limit=20",
+            200
+        )
+        
+        if not success or not isinstance(page, dict):
+            return False, page
+        
+        conversations = page.get('conversations', [])
+        missing = [c.get('id') for c in conversations if 'client_id' not in c or 'next_appointment' not in c]
+        if missing:
+            print(f"⚠️  {len(missing)} conversations lack client_id/next_appointment fields")
+            success = False
+        
+        linked = [c for c in conversations if c.get('client_id')]
+        print(f"✅ {len(linked)} of {len(conversations)} conversations linked to a client")
+        for conversation in linked[:3]:
+            next_appointment = conversation.get('next_appointment') or {}
+            print(f"   - {conversation.get('client')} ({conversation.get('phone')}): next {next_appointment.get('date', 'none')}")
+        
+        return success, page
+
+    def test_bulk_messaging(self):
+        """Test queuing a bulk message job and polling its per-recipient status"""
+        print("\n🔍 TESTING: Bulk Messaging")
+        print("-" * 50)
+        
+        invalid_ok, _ = self.run_test(
+            "Bulk Message (unknown placeholder)",
+            "POST",
+            "api/messages/bulk",
+            400,
+            data={"template": "Hi {nickname}", "recipients": [{"phone": "+971502810801"}]}
+        )
+        
+        success, job = self.run_test(
+            "Bulk Message (queue job)",
+            "POST",
+            "api/messages/bulk",
+            202,
+            data={
+                "template": "Hi {first_name}, this is a bulk messaging test",
+                "recipients": [{"phone": "+971502810801", "name": "Test Client"}]
+            }
+        )
+        
+        if not success:
+            return False, job
+        
+        print(f"✅ Job {job.get('id')} queued for {job.get('total')} recipients")
+        for _ in range(10):
+            status_ok, status = self.run_test("Bulk Message (status)", "GET", job.get('status_url', '').lstrip('/'), 200)
+            if not status_ok or status.get('status') not in ('queued', 'running'):
+                break
+            time.sleep(1)
+        
+        if status_ok:
+            print(f"✅ Job {status.get('status')}: {status.get('sent')} sent, {status.get('failed')} failed")
+            for recipient in status.get('recipients', []):
+                print(f"   - {recipient.get('phone')}: {recipient.get('status')} {recipient.get('error') or ''}")
+        
+        return invalid_ok and status_ok, job
+    
+    def test_appointment_reminders(self):
+        """Test the appointment reminder schedule endpoint"""
+        print("\n🔍 TESTING: Appointment Reminders")
+        print("-" * 50)
+        
+        success, reminders = self.run_test(
+            "Upcoming Appointment Reminders",
+            "GET",
+            "api/reminders?limit=10",
+            200
+        )
+        
+        if success:
+            print(f"✅ Enabled: {reminders.get('enabled')}, offsets: {reminders.get('offsets_hours')} hours")
+            print(f"✅ {reminders.get('scheduled_appointments')} appointments scheduled, {reminders.get('sent')} reminders sent")
+            for reminder in reminders.get('upcoming', [])[:5]:
+                print(f"   - {reminder.get('appointment_id')}: {reminder.get('offset_hours')}h reminder at {reminder.get('due_at')}")
+        
+        return success, reminders
+    
+    def test_conversation_thread_limits(self):
+        """Test the threads and messages_per_thread parameters of GET /api/conversations"""
+        print("\n🔍 TESTING: Conversation Thread Limits")
+        print("-" * 50)
+        
+        success, envelope = self.run_test(
+            "Conversations (3 threads, 2 messages each)",
+            "GET",
+            "api/conversations?threads=3&messages_per_thread=2",
+            200
+        )
+        conversations = envelope.get('conversations', []) if success else []
+        
+        if success:
+            if len(conversations) > 3 or any(len(c.get('messages', [])) > 2 for c in conversations):
+                print("⚠️  Response exceeds the requested thread or message limits")
+                success = False
+            else:
+                print(f"✅ Got {len(conversations)} threads within the requested limits")
+        
+        invalid_ok, _ = self.run_test(
+            "Conversations (invalid thread count)",
+            "GET",
+            "api/conversations?threads=0",
+            400
+        )
+        
+        return success and invalid_ok, conversations
+    
+    def test_wassenger_circuit_status(self):
+        """Test that the health check reports the Wassenger circuit breaker state"""
+        print("\n🔍 TESTING: Wassenger Circuit Breaker Status")
+        print("-" * 50)
+        
+        success, health = self.run_test("Health Check (Wassenger circuit)", "GET", "api/health", 200)
+        
+        if success:
+            circuit = health.get('wassenger_circuit')
+            if not circuit:
+                print("⚠️  Health check does not report the Wassenger circuit")
+                return False, health
+            print(f"✅ Circuit {circuit.get('state')}, consecutive failures: {circuit.get('consecutive_failures')}")
+        
+        return success, health
+    
+    def test_unread_counters(self):
+        """Test the unread badge count and marking a thread read"""
+        print("\n🔍 TESTING: Unread Counters")
+        print("-" * 50)
+        
+        success, counts = self.run_test("Unread Badge Count", "GET", "api/conversations/unread-count", 200)
+        if not success:
+            return False, counts
+        print(f"✅ {counts.get('unread_total')} unread messages in {counts.get('unread_threads')} threads")
+        
+        page_ok, page = self.run_test("Conversation Summaries (for mark read)", "GET", "api/conversations?limit=20", 200)
+        unread = [c for c in page.get('conversations', []) if c.get('unread')] if page_ok else []
+        if unread:
+            read_ok, read = self.run_test(
+                "Mark Conversation Read",
+                "POST",
+                f"api/conversations/{requests.utils.quote(unread[0]['id'])}/read",
+                200
+            )
+            success = success and read_ok
+            if read_ok:
+                print(f"✅ Marked {unread[0]['id']} read, unread total now {read.get('unread_total')}")
+        else:
+            print("ℹ️  No unread conversations to mark read")
+        
+        missing_ok, _ = self.run_test("Mark Unknown Conversation Read", "POST", "api/conversations/unknown-thread/read", 404)
+        
+        return success and page_ok and missing_ok, counts
+    
+    def test_conversation_snapshot(self):
+        """Test that conversations are served from the snapshot with its age and stale flag"""
+        print("\n🔍 TESTING: Conversation Snapshot Freshness")
+        print("-" * 50)
+        
+        url = f"{self.base_url}/api/conversations"
+        self.tests_run += 1
+        try:
+            start = time.time()
+            response = requests.get(url)
+            elapsed = time.time() - start
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False, None
+        
+        if response.status_code != 200 or 'X-Snapshot-Stale' not in response.headers:
+            print(f"❌ Failed - Status: {response.status_code}, headers: {dict(response.headers)}")
+            return False, None
+        self.tests_passed += 1
+        print(f"✅ Served {len(response.json()['conversations'])} conversations in {elapsed:.2f}s")
+        print(f"✅ Stale: {response.headers.get('X-Snapshot-Stale')}, age: {response.headers.get('X-Snapshot-Age', 'never refreshed')}s")
+        
+        page_ok, page = self.run_test("Conversation Summaries (snapshot fields)", "GET", "api/conversations?limit=5", 200)
+        if page_ok:
+            print(f"✅ Envelope stale: {page.get('stale')}, age: {page.get('snapshot_age_seconds')}s, refreshing: {page.get('refreshing')}")
+        
+        return page_ok, page
+
+    def test_conversation_booking_context(self):
+        """Test that thread detail includes the linked client's upcoming and recent appointments"""
+        print("\n🔍 TESTING: Conversation Booking Context")
+        print("-" * 50)
+        
+        success, page = self.run_test(
+            "Conversation Summaries",
+            "GET",
+            "api/conversations?limit=20",
+            200
+        )
+        
+        if not success or not isinstance(page, dict):
+            return False, page
+        
+        linked = [conversation for conversation in page.get('conversations', []) if conversation.get('client_id')]
+        if not linked:
+            print("⚠️  No conversation is linked to a client - skipping booking context check")
+            return True, page
+        
+        detail_ok, detail = self.run_test(
+            "Conversation Detail with Booking Context",
+            "GET",
+            f"api/conversations/{linked[0]['id']}/messages?limit=5",
+            200
+        )
+        
+        if not detail_ok:
+            return False, detail
+        
+        booking = detail.get('booking')
+        if not booking or booking.get('client_id') != linked[0]['client_id']:
+            print(f"⚠️  Expected booking context for client {linked[0]['client_id']}, got: {booking}")
+            return False, detail
+        
+        upcoming_dates = [appointment['date'] for appointment in booking.get('upcoming', [])]
+        recent_dates = [appointment['date'] for appointment in booking.get('recent', [])]
+        print(f"✅ {booking.get('client_name')}: {len(upcoming_dates)} upcoming, {len(recent_dates)} recent appointments")
+        if upcoming_dates != sorted(upcoming_dates) or recent_dates != sorted(recent_dates, reverse=True):
+            print("⚠️  Upcoming appointments should be soonest first and recent ones latest first")
+            return False, detail
+        
+        return True, detail
+
 def main():
     print("🚨 WASSENGER API INTEGRATION TESTING - REAL CONVERSATIONS")
     print("=" * 80)
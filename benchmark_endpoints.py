@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""Endpoint benchmarks for the dashboard API, run against the local upstream stand-ins
+
+For each data size (appointments seeded into the Airtable stand-in) this starts
+backend/stand_ins.py and the backend on free local ports, then requests every
+/api/* route and records:
+
+- p50/p95/p99 latency of warm requests, plus the first (cold) request
+- upstream calls per request, counted by the stand-ins (Airtable and Wassenger calls are
+  budgeted; Pusher calls are reported only, since events are batched in the background)
+- the backend process's peak resident memory
+
+Results are checked against benchmark_budgets.json and against the previous
+passing run (benchmark_last_run.json). The run exits non-zero when a route
+exceeds its budget, regresses, or a backend route has no benchmark case.
+
+    python benchmark_endpoints.py                       # 1k, 10k and 100k appointments
+    python benchmark_endpoints.py --sizes 1000 --routes analytics
+    python benchmark_endpoints.py --write-budgets 2.0   # budgets = this run x 2
+"""
+import argparse
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+BUDGETS_PATH = os.path.join(ROOT, "benchmark_budgets.json")
+LAST_RUN_PATH = os.path.join(ROOT, "benchmark_last_run.json")
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_ITERATIONS = 20
+DEFAULT_MAX_ROUTE_SECONDS = 60
+MIN_SAMPLES = 3
+STAND_IN_CHATS = 200
+STAND_IN_MESSAGES_PER_CHAT = 20
+STARTUP_TIMEOUT_SECONDS = 180
+REQUEST_TIMEOUT_SECONDS = 600
+SETTLE_SECONDS = 0.5  # lets queued Pusher events and webhook workers reach the stand-ins before counting
+FIXTURE_BATCH_SIZE = 10
+MEMORY_BUDGET_HEADROOM = 1.5  # peak memory is far less noisy than latency
+MIN_LATENCY_BUDGET_MS = 25  # below this, scheduler noise dominates
+UPSTREAM_SERVICES = {"/v0": "airtable", "/v1": "wassenger", "/apps": "pusher"}
+# Pusher events are batched by a background dispatcher, so their call count per request is not stable
+BUDGETED_SERVICES = ("airtable", "wassenger")
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def upstream_calls_by_service(calls):
+    """Stand-in call counters ({"GET /v0/Clients": 3, ...}) -> {"airtable": 3, ...}, ignoring injected-error tallies"""
+    totals = {service: 0 for service in UPSTREAM_SERVICES.values()}
+    for route, count in calls.items():
+        if route.endswith("(error)") or " " not in route:
+            continue
+        path = route.split(" ", 1)[1]
+        for prefix, service in UPSTREAM_SERVICES.items():
+            if path.startswith(prefix + "/"):
+                totals[service] += count
+    return totals
+
+def diff_counts(after, before):
+    return {service: after[service] - before.get(service, 0) for service in after}
+
+class RouteCase:
+    """One benchmarked request shape for a backend route
+
+    `route` is the path template as the backend's OpenAPI schema lists it, used to check coverage.
+    `path` and `body` may be callables of the run context (and request number for bodies); `prepare`
+    returns one (path, body) per request for routes that consume their target, such as deletes.
+    """
+
+    def __init__(self, method, route, path=None, body=None, prepare=None, label=None, stream=False):
+        self.method = method
+        self.route = route
+        self.path = path or route
+        self.body = body
+        self.prepare = prepare
+        self.label = label
+        self.stream = stream
+
+    @property
+    def name(self):
+        return f"{self.method} {self.label or self.route}"
+
+    def requests_for(self, ctx, count):
+        if self.prepare:
+            return self.prepare(ctx, count)
+        path = self.path(ctx) if callable(self.path) else self.path
+        return [(path, self.body(ctx, i) if callable(self.body) else self.body) for i in range(count)]
+
+def delete_case(route, table, fields):
+    """A DELETE case whose every request removes its own freshly seeded stand-in record"""
+    def prepare(ctx, count):
+        ids = ctx["env"].create_airtable_records(table, [fields(ctx, i) for i in range(count)])
+        return [(route.split("{")[0] + record_id, None) for record_id in ids]
+    return RouteCase("DELETE", route, prepare=prepare)
+
+def appointment_fields(ctx, i):
+    return {
+        "Appointment ID": f"B{uuid.uuid4().hex[:8]}",
+        "Client Name": [ctx["client_id"]],
+        "Services": [ctx["service_id"]],
+        "Stylist": [ctx["employee_id"]],
+        "Appointment Date": (date.today() + timedelta(days=3)).isoformat(),
+        "Appointment Time": "11:00 AM",
+        "Appointment Status": "Scheduled"
+    }
+
+def webhook_body(ctx, i):
+    return {
+        "event": "message:in:new",
+        "data": {
+            "id": f"bench-{uuid.uuid4().hex}",
+            "phone": ctx["conversation_phone"],
+            "fromMe": False,
+            "body": f"Benchmark inbound message {i}",
+            "chat": {"id": ctx["conversation_id"], "name": "Benchmark"}
+        }
+    }
+
+ROUTE_CASES = [
+    RouteCase("GET", "/api/health"),
+    RouteCase("GET", "/api/records"),
+    RouteCase("POST", "/api/records", body=lambda ctx, i: {"name": f"Benchmark {i}", "notes": "benchmark"}),
+    RouteCase("PUT", "/api/records/{record_id}", path=lambda ctx: f"/api/records/{ctx['appointment_id']}",
+              body={"notes": "benchmark update"}),
+    delete_case("/api/records/{record_id}", "appointments", appointment_fields),
+    RouteCase("GET", "/api/clients"),
+    RouteCase("GET", "/api/services"),
+    RouteCase("GET", "/api/employees"),
+    RouteCase("POST", "/api/appointments", body=lambda ctx, i: {
+        "client_id": ctx["client_id"],
+        "service_id": ctx["service_id"],
+        "employee_id": ctx["employee_id"],
+        "date": (date.today() + timedelta(days=7)).isoformat(),
+        "time": "02:00 PM",
+        "notes": "benchmark"
+    }),
+    RouteCase("PUT", "/api/appointments/{appointment_id}", path=lambda ctx: f"/api/appointments/{ctx['appointment_id']}",
+              body=lambda ctx, i: {"action": "update", "notes": f"benchmark update {i}"}),
+    delete_case("/api/appointments/{appointment_id}", "appointments", appointment_fields),
+    RouteCase("POST", "/api/employees", body=lambda ctx, i: {
+        "full_name": f"Benchmark Therapist {i}",
+        "availability_days": ["Monday", "Tuesday"],
+        "expertise": ["Massage"],
+        "status": "Active"
+    }),
+    RouteCase("PUT", "/api/employees/{employee_id}", path=lambda ctx: f"/api/employees/{ctx['employee_id']}",
+              body={"contact_number": "+971550000000"}),
+    delete_case("/api/employees/{employee_id}", "employees", lambda ctx, i: {"Full Name": f"Disposable {i}", "Status": "Active"}),
+    RouteCase("GET", "/api/employees/{employee_id}", path=lambda ctx: f"/api/employees/{ctx['employee_id']}"),
+    RouteCase("GET", "/api/employee-availability"),
+    RouteCase("GET", "/api/conversations"),
+    RouteCase("GET", "/api/conversations", path="/api/conversations?limit=50", label="/api/conversations?limit=50"),
+    RouteCase("GET", "/api/conversations/unread-count"),
+    RouteCase("POST", "/api/conversations/{conversation_id}/read",
+              path=lambda ctx: f"/api/conversations/{ctx['conversation_id']}/read"),
+    RouteCase("GET", "/api/conversations/{conversation_id}/messages",
+              path=lambda ctx: f"/api/conversations/{ctx['conversation_id']}/messages?limit=50"),
+    RouteCase("GET", "/api/conversations/search", path="/api/conversations/search?q=message&limit=20"),
+    RouteCase("POST", "/api/conversations/sync"),
+    RouteCase("GET", "/api/realtime/metrics"),
+    RouteCase("GET", "/api/events", stream=True),
+    RouteCase("POST", "/api/send-message", body=lambda ctx, i: {"phone": ctx["conversation_phone"], "message": f"Benchmark reply {i}"}),
+    RouteCase("POST", "/api/messages/bulk", body=lambda ctx, i: {
+        "template": "Hi {first_name}, see you soon",
+        "recipients": [{"phone": ctx["conversation_phone"], "name": "Benchmark"}],
+        "rate_per_second": 50
+    }),
+    RouteCase("GET", "/api/messages/bulk"),
+    RouteCase("GET", "/api/messages/bulk/{job_id}", path=lambda ctx: f"/api/messages/bulk/{ctx['bulk_job_id']}"),
+    RouteCase("POST", "/api/messages/bulk/{job_id}/cancel", path=lambda ctx: f"/api/messages/bulk/{ctx['bulk_job_id']}/cancel"),
+    RouteCase("GET", "/api/reminders"),
+    RouteCase("POST", "/api/webhook/wassenger", body=webhook_body),
+    RouteCase("GET", "/api/webhook/metrics"),
+    RouteCase("GET", "/api/debug-services-field"),
+    RouteCase("GET", "/api/debug-employee-fields"),
+    RouteCase("GET", "/api/test-analytics"),
+    RouteCase("GET", "/api/analytics", path="/api/analytics?range=30d", label="/api/analytics?range=30d"),
+    RouteCase("GET", "/api/analytics", path="/api/analytics?range=1y", label="/api/analytics?range=1y"),
+    RouteCase("GET", "/api/analytics/cohorts"),
+    RouteCase("GET", "/api/services-with-duration"),
+    RouteCase("GET", "/api/therapists-by-service/{service_name}", path="/api/therapists-by-service/Massage")
+]
+
+class BenchmarkEnvironment:
+    """The stand-ins and a backend seeded with `appointments` appointments, on free local ports"""
+
+    def __init__(self, appointments, args):
+        self.appointments = appointments
+        self.args = args
+        self.stand_in_port = free_port()
+        self.backend_port = free_port()
+        self.stand_in_url = f"http://127.0.0.1:{self.stand_in_port}"
+        self.backend_url = f"http://127.0.0.1:{self.backend_port}"
+        self.workdir = tempfile.mkdtemp(prefix="dashboard-bench-")
+        self.processes = []
+        self.session = requests.Session()
+
+    def __enter__(self):
+        stand_in_command = [
+            sys.executable, "stand_ins.py",
+            "--port", str(self.stand_in_port),
+            "--appointments", str(self.appointments),
+            "--chats", str(STAND_IN_CHATS),
+            "--messages-per-chat", str(STAND_IN_MESSAGES_PER_CHAT),
+            "--latency-ms", str(self.args.upstream_latency_ms),
+            "--airtable-rate-limit", "5" if self.args.realistic_airtable else "0"
+        ]
+        self.start("stand-ins", stand_in_command, {}, f"{self.stand_in_url}/_stand-in/stats")
+
+        backend_env = {
+            "WASSENGER_BASE_URL": f"{self.stand_in_url}/v1",
+            "WASSENGER_API_KEY": "stand-in",
+            "PUSHER_HOST": "127.0.0.1",
+            "PUSHER_PORT": str(self.stand_in_port),
+            "PUSHER_SSL": "false",
+            "REALTIME_BACKEND": "pusher",
+            "AIRTABLE_API_URL": f"{self.stand_in_url}/v0",
+            "AIRTABLE_API_KEY": "stand-in",
+            "AIRTABLE_BASE_ID": "appBenchmark",
+            "MESSAGE_STORE_PATH": os.path.join(self.workdir, "messages.db"),
+            # Background refresh loops off, so every upstream call is caused by a benchmarked request
+            "WASSENGER_SYNC_INTERVAL_SECONDS": "0",
+            "ANALYTICS_PRECOMPUTE_INTERVAL_SECONDS": "0",
+            "APPOINTMENT_REMINDERS_ENABLED": "false"
+        }
+        if not self.args.realistic_airtable:
+            backend_env["AIRTABLE_PAGE_DELAY_SECONDS"] = "0"
+        backend_command = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                           "--port", str(self.backend_port), "--log-level", "warning"]
+        self.backend = self.start("backend", backend_command, backend_env, f"{self.backend_url}/api/health")
+        return self
+
+    def __exit__(self, *exc):
+        for process, log in self.processes:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+
+    def start(self, name, command, env, ready_url):
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        process = subprocess.Popen(command, cwd=BACKEND_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append((process, log))
+        deadline = time.time() + STARTUP_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            if process.poll() is not None:
+                break
+            try:
+                if requests.get(ready_url, timeout=2).status_code == 200:
+                    return process
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        with open(log.name) as output:
+            tail = output.read()[-2000:]
+        raise RuntimeError(f"{name} did not start (see {log.name}):\n{tail}")
+
+    def stand_in_calls(self):
+        return upstream_calls_by_service(self.session.get(f"{self.stand_in_url}/_stand-in/stats").json()["calls"])
+
+    def memory_peak_mb(self):
+        """Peak resident set size of the backend process (Linux), or None where /proc is unavailable"""
+        try:
+            with open(f"/proc/{self.backend.pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            return None
+        return None
+
+    def create_airtable_records(self, table, fields_list):
+        """Seed records straight into the Airtable stand-in (these calls are made before counting starts)"""
+        ids = []
+        for start in range(0, len(fields_list), FIXTURE_BATCH_SIZE):
+            response = self.session.post(
+                f"{self.stand_in_url}/v0/appBenchmark/{table}",
+                json={"records": [{"fields": fields} for fields in fields_list[start:start + FIXTURE_BATCH_SIZE]]},
+                headers={"Authorization": "Bearer stand-in"}
+            )
+            response.raise_for_status()
+            ids.extend(record["id"] for record in response.json()["records"])
+        return ids
+
+    def call(self, method, path, body=None, stream=False):
+        if stream:
+            # Server-sent events never finish; time the response headers and hang up
+            with self.session.request(method, self.backend_url + path, stream=True, timeout=REQUEST_TIMEOUT_SECONDS) as response:
+                return response.status_code
+        response = self.session.request(method, self.backend_url + path, json=body, timeout=REQUEST_TIMEOUT_SECONDS)
+        return response.status_code
+
+def build_context(env):
+    """IDs the route cases need, plus one conversation sync so the message store has threads"""
+    backend = env.backend_url
+    ctx = {"env": env}
+    clients = requests.get(f"{backend}/api/clients", timeout=REQUEST_TIMEOUT_SECONDS).json()
+    services = requests.get(f"{backend}/api/services", timeout=REQUEST_TIMEOUT_SECONDS).json()
+    employees = requests.get(f"{backend}/api/employees", timeout=REQUEST_TIMEOUT_SECONDS).json()
+    ctx.update(client_id=clients[0]["id"], service_id=services[0]["id"], employee_id=employees[0]["id"])
+    ctx["appointment_id"] = env.create_airtable_records("appointments", [appointment_fields(ctx, 0)])[0]
+
+    requests.post(f"{backend}/api/conversations/sync", timeout=REQUEST_TIMEOUT_SECONDS).raise_for_status()
+    conversation = requests.get(f"{backend}/api/conversations?limit=1", timeout=REQUEST_TIMEOUT_SECONDS).json()["conversations"][0]
+    ctx.update(conversation_id=conversation["id"], conversation_phone=conversation["phone"])
+
+    job = requests.post(f"{backend}/api/messages/bulk", json={
+        "template": "Benchmark setup message",
+        "recipients": [{"phone": conversation["phone"]}],
+        "rate_per_second": 50
+    }, timeout=REQUEST_TIMEOUT_SECONDS).json()
+    ctx["bulk_job_id"] = job["id"]
+    time.sleep(SETTLE_SECONDS)
+    return ctx
+
+def measure_case(env, ctx, case, args):
+    """Cold request, then warm requests until `iterations` or the route's time allowance is used up"""
+    planned = case.requests_for(ctx, args.iterations + 1)
+
+    before = env.stand_in_calls()
+    path, body = planned[0]
+    started = time.perf_counter()
+    status = env.call(case.method, path, body, case.stream)
+    cold_ms = (time.perf_counter() - started) * 1000
+    time.sleep(SETTLE_SECONDS)
+    after_cold = env.stand_in_calls()
+
+    samples = []
+    statuses = {status}
+    route_started = time.time()
+    for path, body in planned[1:]:
+        started = time.perf_counter()
+        statuses.add(env.call(case.method, path, body, case.stream))
+        samples.append((time.perf_counter() - started) * 1000)
+        if len(samples) >= MIN_SAMPLES and time.time() - route_started > args.max_route_seconds:
+            break
+    time.sleep(SETTLE_SECONDS)
+    after_warm = env.stand_in_calls()
+
+    warm_calls = diff_counts(after_warm, after_cold)
+    return {
+        "samples": len(samples),
+        "statuses": sorted(statuses),
+        "cold_ms": round(cold_ms, 2),
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "cold_upstream_calls": sum(count for service, count in diff_counts(after_cold, before).items() if service in BUDGETED_SERVICES),
+        "upstream_calls": round(sum(warm_calls[service] for service in BUDGETED_SERVICES) / len(samples), 2),
+        "upstream_calls_by_service": {service: round(count / len(samples), 2) for service, count in warm_calls.items() if count},
+        "memory_peak_mb": env.memory_peak_mb()
+    }
+
+def uncovered_routes(env):
+    """Backend /api routes (from its OpenAPI schema) that no route case exercises"""
+    schema = requests.get(f"{env.backend_url}/openapi.json", timeout=30).json()
+    served = {f"{method.upper()} {path}" for path, methods in schema["paths"].items() if path.startswith("/api/") for method in methods}
+    covered = {f"{case.method} {case.route}" for case in ROUTE_CASES}
+    return sorted(served - covered)
+
+def run_size(appointments, cases, args):
+    print(f"\n🔍 BENCHMARK: {appointments:,} appointments")
+    print("-" * 100)
+    with BenchmarkEnvironment(appointments, args) as env:
+        ctx = build_context(env)
+        result = {"routes": {}, "uncovered_routes": uncovered_routes(env)}
+        for case in cases:
+            try:
+                measured = measure_case(env, ctx, case, args)
+            except (requests.RequestException, RuntimeError) as e:
+                measured = {"error": str(e)}
+            result["routes"][case.name] = measured
+            if "error" in measured:
+                print(f"❌ {case.name:<58} {measured['error'][:80]}")
+                continue
+            print(f"{'✅' if max(measured['statuses']) < 500 else '⚠️ '} {case.name:<58} "
+                  f"p50 {measured['p50_ms']:>9.1f}  p95 {measured['p95_ms']:>9.1f}  p99 {measured['p99_ms']:>9.1f} ms  "
+                  f"cold {measured['cold_ms']:>9.1f} ms  upstream {measured['upstream_calls']:>6}/req  "
+                  f"status {','.join(map(str, measured['statuses']))}")
+        result["memory_peak_mb"] = env.memory_peak_mb()
+        print(f"📊 Backend peak memory: {result['memory_peak_mb']} MB")
+    return result
+
+def check_results(results, budgets, previous, args):
+    """Budget breaches and regressions against the previous run, as readable failure lines"""
+    failures = []
+    tolerance = budgets.get("regression_tolerance", 0.25)
+    min_regression_ms = budgets.get("regression_min_ms", 5)
+    comparable = previous and previous.get("settings") == results["settings"]
+
+    for size, size_result in results["sizes"].items():
+        size_budget = budgets.get("sizes", {}).get(size, {})
+        previous_size = previous["sizes"].get(size, {}) if comparable else {}
+
+        for route in size_result["uncovered_routes"]:
+            failures.append(f"[{size}] {route}: no benchmark case")
+
+        memory = size_result.get("memory_peak_mb")
+        if memory is not None and "memory_peak_mb" in size_budget and memory > size_budget["memory_peak_mb"]:
+            failures.append(f"[{size}] memory peak {memory} MB exceeds budget {size_budget['memory_peak_mb']} MB")
+        previous_memory = previous_size.get("memory_peak_mb")
+        if memory is not None and previous_memory and memory > previous_memory * (1 + tolerance):
+            failures.append(f"[{size}] memory peak {memory} MB regressed from {previous_memory} MB")
+
+        for name, measured in size_result["routes"].items():
+            if "error" in measured:
+                failures.append(f"[{size}] {name}: {measured['error'][:200]}")
+                continue
+            if max(measured["statuses"]) >= 500:
+                failures.append(f"[{size}] {name}: server error (status {measured['statuses']})")
+
+            budget = size_budget.get("routes", {}).get(name)
+            if budget is None:
+                if args.strict:
+                    failures.append(f"[{size}] {name}: no budget")
+            else:
+                if measured["p95_ms"] > budget["p95_ms"]:
+                    failures.append(f"[{size}] {name}: p95 {measured['p95_ms']} ms exceeds budget {budget['p95_ms']} ms")
+                if measured["upstream_calls"] > budget["upstream_calls"]:
+                    failures.append(f"[{size}] {name}: {measured['upstream_calls']} upstream calls/request exceeds budget {budget['upstream_calls']}")
+
+            before = previous_size.get("routes", {}).get(name)
+            if not before or "error" in before:
+                continue
+            if measured["p95_ms"] > before["p95_ms"] * (1 + tolerance) and measured["p95_ms"] - before["p95_ms"] > min_regression_ms:
+                failures.append(f"[{size}] {name}: p95 regressed {before['p95_ms']} -> {measured['p95_ms']} ms")
+            if measured["upstream_calls"] > before["upstream_calls"]:
+                failures.append(f"[{size}] {name}: upstream calls/request regressed {before['upstream_calls']} -> {measured['upstream_calls']}")
+    return failures
+
+def budgets_from_results(results, headroom, budgets):
+    """Budgets at `headroom` x this run's p95 (at least MIN_LATENCY_BUDGET_MS), MEMORY_BUDGET_HEADROOM x its memory peak, and exactly its upstream calls"""
+    for size, size_result in results["sizes"].items():
+        size_budget = budgets.setdefault("sizes", {}).setdefault(size, {})
+        if size_result.get("memory_peak_mb"):
+            size_budget["memory_peak_mb"] = math.ceil(size_result["memory_peak_mb"] * MEMORY_BUDGET_HEADROOM)
+        routes = size_budget.setdefault("routes", {})
+        for name, measured in size_result["routes"].items():
+            if "error" not in measured:
+                routes[name] = {
+                    "p95_ms": max(math.ceil(measured["p95_ms"] * headroom), MIN_LATENCY_BUDGET_MS),
+                    "upstream_calls": measured["upstream_calls"]
+                }
+    return budgets
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as handle:
+        return json.load(handle)
+
+def write_json(path, data):
+    with open(path, "w") as handle:
+        json.dump(data, handle, indent=2, sort_keys=True)
+        handle.write("\n")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every /api route against the local stand-ins")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="appointment counts to seed")
+    parser.add_argument("--routes", nargs="+", help="only cases whose name contains one of these substrings")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="warm requests per route")
+    parser.add_argument("--max-route-seconds", type=float, default=DEFAULT_MAX_ROUTE_SECONDS,
+                        help=f"stop sampling a route after this long (at least {MIN_SAMPLES} samples)")
+    parser.add_argument("--upstream-latency-ms", type=float, default=0, help="latency the stand-ins add to every upstream call")
+    parser.add_argument("--realistic-airtable", action="store_true",
+                        help="keep Airtable's 5 requests/second limit and the wrapper's pause between pages")
+    parser.add_argument("--output", help="also write this run's results to this file")
+    parser.add_argument("--write-budgets", type=float, metavar="HEADROOM", help="rewrite budgets from this run with this headroom factor")
+    parser.add_argument("--update-baseline", action="store_true", help="save this run as the regression baseline even if it fails")
+    parser.add_argument("--strict", action="store_true", help="fail routes that have no budget")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    cases = [case for case in ROUTE_CASES if not args.routes or any(part in case.name for part in args.routes)]
+    results = {
+        "settings": {
+            "iterations": args.iterations,
+            "upstream_latency_ms": args.upstream_latency_ms,
+            "realistic_airtable": args.realistic_airtable
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": {}
+    }
+    for size in args.sizes:
+        results["sizes"][str(size)] = run_size(size, cases, args)
+        if args.routes:
+            # A filtered run cannot tell whether unlisted routes are covered
+            results["sizes"][str(size)]["uncovered_routes"] = []
+
+    budgets = load_json(BUDGETS_PATH, {})
+    previous = load_json(LAST_RUN_PATH, None)
+    failures = check_results(results, budgets, previous, args)
+
+    if args.output:
+        write_json(args.output, results)
+    if args.write_budgets:
+        write_json(BUDGETS_PATH, budgets_from_results(results, args.write_budgets, budgets))
+        print(f"\n📝 Budgets written to {BUDGETS_PATH}")
+
+    print("\n" + "=" * 100)
+    if failures:
+        print(f"❌ {len(failures)} benchmark checks failed:")
+        for failure in failures:
+            print(f"   - {failure}")
+    else:
+        print("✅ All routes within budget and no regressions against the previous run")
+
+    if not failures or args.update_baseline:
+        if previous and previous.get("settings") == results["settings"]:
+            # Keep the baseline for sizes and routes a partial run skipped
+            for size, size_result in previous["sizes"].items():
+                current = results["sizes"].setdefault(size, size_result)
+                for name, measured in size_result.get("routes", {}).items():
+                    current["routes"].setdefault(name, measured)
+        write_json(LAST_RUN_PATH, results)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
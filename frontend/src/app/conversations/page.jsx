@@ -26,23 +26,16 @@ export default function ConversationsPage() {
   const [activeTab, setActiveTab] = useState("recent"); // "recent" or "groups"
   const messagesEndRef = useRef(null);
 
-  // Pusher instance reference
+  // Pusher instance / built-in event stream references
   const pusherRef = useRef(null);
+  const eventSourceRef = useRef(null);
 
-  // Initialize Pusher and fetch conversations
+  // Subscribe to real-time updates and fetch conversations
   useEffect(() => {
     console.log('ConversationsPage useEffect running...');
     
-    // Initialize Pusher
-    pusherRef.current = new Pusher('f1f929da8fd632930b80', {
-      cluster: 'ap2'
-    });
-
-    // Subscribe to the conversations channel
-    const channel = pusherRef.current.subscribe('my-channel');
-    
-    // Listen for new messages
-    channel.bind('new-message', (data) => {
+    // Handle a new message from either real-time backend
+    const handleNewMessage = (data) => {
       console.log('New message received:', data);
       
       // Update conversations with new message
@@ -68,6 +61,8 @@ export default function ConversationsPage() {
             ...updatedConversations[convIndex],
             lastMessage: data.message,
             time: data.time,
+            // Unread count and status are maintained by the backend
+            ...(data.unread !== undefined && { unread: data.unread, status: data.status }),
             messages: [...updatedConversations[convIndex].messages, newMessage]
           };
           
@@ -77,13 +72,13 @@ export default function ConversationsPage() {
         } else {
           // Create new conversation if doesn't exist
           const newConversation = {
-            id: Date.now().toString(),
+            id: data.conversation_id || Date.now().toString(),
             client: data.sender_name || `Contact ${data.phone}`,
             phone: data.phone,
             lastMessage: data.message,
             time: data.time,
-            status: 'pending',
-            unread: data.sender === 'client' ? 1 : 0,
+            status: data.status || 'pending',
+            unread: data.unread !== undefined ? data.unread : (data.sender === 'client' ? 1 : 0),
             tag: 'Regular',
             messages: [{
               id: Date.now().toString(),
@@ -99,13 +94,38 @@ export default function ConversationsPage() {
         
         return updatedConversations;
       });
-    });
+    };
+
+    if (process.env.NEXT_PUBLIC_REALTIME_BACKEND === 'sse') {
+      // Built-in Server-Sent Events stream from the backend
+      eventSourceRef.current = new EventSource('/api/events');
+      eventSourceRef.current.addEventListener('new-message', (event) => {
+        handleNewMessage(JSON.parse(event.data));
+      });
+      eventSourceRef.current.addEventListener('conversations-refreshed', () => {
+        fetchConversations();
+      });
+    } else {
+      // Initialize Pusher
+      pusherRef.current = new Pusher('f1f929da8fd632930b80', {
+        cluster: 'ap2'
+      });
+
+      // Subscribe to the conversations channel and listen for new messages
+      const channel = pusherRef.current.subscribe('my-channel');
+      channel.bind('new-message', handleNewMessage);
+      // The backend refreshed its conversation snapshot from Wassenger
+      channel.bind('conversations-refreshed', () => fetchConversations());
+    }
 
     // Fetch initial conversations
     fetchConversations();
 
     // Cleanup
     return () => {
+      if (eventSourceRef.current) {
+        eventSourceRef.current.close();
+      }
       if (pusherRef.current) {
         pusherRef.current.unsubscribe('my-channel');
         pusherRef.current.disconnect();
@@ -130,14 +150,14 @@ export default function ConversationsPage() {
       console.log('Response status:', response.status);
       
       if (response.ok) {
-        const data = await response.json();
+        const { conversations: data } = await response.json();
         console.log('Conversations fetched successfully:', data.length, 'conversations');
         console.log('Setting conversations state...');
         setConversations(data);
         
         // Set first conversation as selected if available
         if (data.length > 0) {
-          setSelectedConversation(data[0].id);
+          setSelectedConversation(prev => prev || data[0].id);
           console.log('Selected conversation:', data[0].id);
         }
         
@@ -154,6 +174,18 @@ export default function ConversationsPage() {
     }
   };
 
+  const selectConversation = async (conv) => {
+    setSelectedConversation(conv.id);
+    if (!conv.unread) return;
+
+    setConversations(prev => prev.map(c => c.id === conv.id ? { ...c, unread: 0 } : c));
+    try {
+      await fetch(`/api/conversations/${encodeURIComponent(conv.id)}/read`, { method: 'POST' });
+    } catch (error) {
+      console.error('Error marking conversation read:', error);
+    }
+  };
+
   const sendMessage = async () => {
     if (!message.trim() || sending) return;
     
@@ -358,7 +390,7 @@ export default function ConversationsPage() {
                       return (
                     <div
                       key={conv.id}
-                      onClick={() => setSelectedConversation(conv.id)}
+                      onClick={() => selectConversation(conv)}
                       className={`p-4 border-b border-gray-100 dark:border-gray-700 cursor-pointer hover:bg-gray-50 dark:hover:bg-gray-700 transition-colors ${
                         selectedConversation === conv.id
                           ? "bg-purple-50 dark:bg-purple-900/20 border-l-4 border-l-purple-500"